@@ -3,8 +3,8 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE','tango_with_django_project.settin
 
 import django
 django.setup()
-from rango.models import Category
 from rango.models import Page
+from rango.importer import import_rows
 
 def populate(): 
     
@@ -46,34 +46,24 @@ def populate():
             'Other Frameworks': {'pages': other_pages, 'views': 32,'likes': 16} }
 
 
-    # Adding all catagory pages to DB
+    # Flatten the catagories and their pages into importer rows, then write them
+    # in bulk (a few queries in total rather than several per category and page)
+    rows = []
     for cat, cat_data in cats.items():
 
         # cat_data is dictionary, cat is the key (or name of the category in this case.)
-        c = add_cat(cat, cat_data['views'], cat_data['likes'])
-        
-        for p in cat_data['pages']:
-            add_page(c,p['title'], p['url'], p['views'])
-
-    # Print out the catagories
-    for c in Category.objects.all():
-        for p in Page.objects.filter(category=c):
-            print(f'- {c}: {p}')
+        rows.append({'category': cat,
+                     'category_views': cat_data['views'],
+                     'category_likes': cat_data['likes']})
 
+        for p in cat_data['pages']:
+            rows.append({'category': cat, 'title': p['title'], 'url': p['url'], 'views': p['views']})
 
-def add_page(cat, title, url, views=0):
-    p = Page.objects.get_or_create(category=cat, title=title)[0]
-    p.url = url
-    p.views = views
-    p.save()
-    return p
+    import_rows(rows)
 
-def add_cat(name, views=0, likes=0):
-    c = Category.objects.get_or_create(name=name)[0]
-    c.views = views
-    c.likes = likes
-    c.save()
-    return c
+    # Print out the catagories, fetching each page's category in the same query
+    for p in Page.objects.select_related('category').order_by('category__id', 'id'):
+        print(f'- {p.category}: {p}')
 
 
 # Start execution here
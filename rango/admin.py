@@ -1,18 +1,205 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+
+from rango import category_stats, search
+from rango.caching import touch_on_commit
+from rango.leaderboards import top_pages
 from rango.models import Category, Page
 from rango.models import UserProfile
 
+# Counting stops here: past it the changelist just shows "more than" this many
+MAX_COUNT = 10000
+
+
+def estimated_rows(model):
+    # A cheap estimate of the number of rows in model's table, or None
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute('SELECT table_rows FROM information_schema.tables '
+                           'WHERE table_schema = DATABASE() AND table_name = %s', [table])
+        else:
+            # SQLite keeps no row count; the highest id is one index lookup away
+            # (and only overestimates, by the rows deleted so far)
+            return model.objects.aggregate(n=Max('pk'))['n'] or 0
+        row = cursor.fetchone()
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    SELECT COUNT(*) reads the whole table (or index) on most databases, which is
+    what makes a big changelist time out. An unfiltered list is counted from the
+    table statistics instead, and a filtered one is counted only up to MAX_COUNT.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_rows(queryset.model)
+            if estimate is not None and estimate > MAX_COUNT:
+                return estimate
+        return queryset.order_by()[:MAX_COUNT].count()
+
+
+class PageActionForm(ActionForm):
+    # The id of the target of the "move to category" action (a choice field would
+    # load every category on each changelist load)
+    category = forms.IntegerField(required=False, label='Category id')
+
+
+class CategoryFilter(admin.SimpleListFilter):
+    """
+    Filter pages by category without listing every category: the sidebar offers
+    the LIMIT most active ones (and the one selected), and any other category is
+    a click away through the category links in the list (see category_link).
+    """
+    title = 'category'
+    parameter_name = 'category'
+
+    LIMIT = 10
+
+    def lookups(self, request, model_admin):
+        choices = list(Category.objects.order_by('-trending_score').values_list('id', 'name')[:self.LIMIT])
+        selected = self.selected_id()
+        if selected is not None and selected not in {pk for pk, _ in choices}:
+            choices += Category.objects.filter(id=selected).values_list('id', 'name')
+        return [(str(pk), name) for pk, name in choices]
+
+    def selected_id(self):
+        try:
+            return int(self.value()) if self.value() else None
+        except ValueError:
+            raise IncorrectLookupParameters(f'Bad category id: {self.value()}')
+
+    def queryset(self, request, queryset):
+        selected = self.selected_id()
+        return queryset if selected is None else queryset.filter(category_id=selected)
+
+
+class LinkStatusFilter(admin.SimpleListFilter):
+    # Fixed choices, each an indexed range of link_status, instead of a SELECT DISTINCT
+    title = 'link status'
+    parameter_name = 'link'
+
+    FILTERS = {
+        'ok': ('OK (2xx)', Q(link_status__gte=200, link_status__lt=300)),
+        'redirect': ('Redirect (3xx)', Q(link_status__gte=300, link_status__lt=400)),
+        'client_error': ('Dead (4xx)', Q(link_status__gte=400, link_status__lt=500)),
+        'server_error': ('Server error (5xx)', Q(link_status__gte=500)),
+        'unreachable': ('Unreachable', Q(link_status__isnull=True, link_checked__isnull=False)),
+        'unchecked': ('Not checked yet', Q(link_checked__isnull=True)),
+    }
+
+    def lookups(self, request, model_admin):
+        return [(value, label) for value, (label, _) in self.FILTERS.items()]
+
+    def queryset(self, request, queryset):
+        if self.value() in self.FILTERS:
+            return queryset.filter(self.FILTERS[self.value()][1])
+        return queryset
+
+
 # Create model admin class to pass to register. 
 # This changes he admin options for the app
 class PageAdmin(admin.ModelAdmin):
 
     # List display admin option (tuple of field names to display on the list page for the object)
-    list_display = ('title','category','url')
+    list_display = ('title','category_link','url','views','link_status')
+    # Fetch each row's category in the same query, not one query per row
+    list_select_related = ('category',)
+    list_filter = (CategoryFilter, LinkStatusFilter)
+    # Searched through the full-text index (see get_search_results)
+    search_fields = ('title', 'category__name')
+    raw_id_fields = ('category',)
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @admin.display(description='category', ordering='category__name')
+    def category_link(self, page):
+        # Links to this list filtered down to the page's category
+        return format_html('<a href="?{}={}">{}</a>', CategoryFilter.parameter_name,
+                           page.category_id, page.category.name)
+
+    action_form = PageActionForm
+    actions = ['reset_views', 'move_to_category']
+
+    def get_search_results(self, request, queryset, search_term):
+        return search.filter_matching(queryset, search_term), False
+
+    @admin.action(description='Reset views of selected pages')
+    def reset_views(self, request, queryset):
+        with transaction.atomic():
+            # One UPDATE for the pages and one for their categories' counters
+            category_ids = list(queryset.values_list('category_id', flat=True).distinct())
+            updated = queryset.update(views=0, updated_at=timezone.now())
+            category_stats.repair(category_ids)
+            changed(category_ids)
+        top_pages.invalidate()
+        self.message_user(request, f'Reset the views of {updated} pages.')
+
+    @admin.action(description='Move selected pages to category')
+    def move_to_category(self, request, queryset):
+        category_id = request.POST.get('category')
+        try:
+            category = Category.objects.get(id=category_id)
+        except (Category.DoesNotExist, ValueError):
+            self.message_user(request, 'Choose the category to move the pages to.', messages.ERROR)
+            return
+
+        with transaction.atomic():
+            category_ids = list(queryset.values_list('category_id', flat=True).distinct())
+            moved = queryset.update(category=category, updated_at=timezone.now())
+            category_stats.repair(category_ids + [category.id])
+            # The pages are indexed alongside their category's name
+            search.index_category(category)
+            changed(category_ids + [category.id])
+        self.message_user(request, f'Moved {moved} pages to {category.name}.')
+
 
 class CategoryAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug':('name',)}
 
+    list_display = ('name', 'slug', 'likes', 'page_count', 'total_views')
+    search_fields = ('name',)
+    # Maintained from the pages (see rango/category_stats.py) and the like buffer
+    readonly_fields = Category.counter_fields
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    actions = ['repair_stats']
+
+    def get_search_results(self, request, queryset, search_term):
+        return search.filter_matching(queryset, search_term), False
+
+    @admin.action(description='Recount pages and views of selected categories')
+    def repair_stats(self, request, queryset):
+        with transaction.atomic():
+            category_ids = list(queryset.values_list('id', flat=True))
+            repaired = category_stats.repair(category_ids)
+            changed(category_ids)
+        self.message_user(request, f'Recounted {repaired} categories.')
+
+
+def changed(category_ids):
+    # update() bypasses model signals, so mark the changed listings by hand
+    touch_on_commit('categories', *[f'category:{category_id}' for category_id in category_ids])
+
+
 # Register your models here.
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(Page, PageAdmin)
-admin.site.register(UserProfile)
\ No newline at end of file
+admin.site.register(UserProfile)
@@ -0,0 +1,135 @@
+"""
+Read-only JSON API for categories and their pages.
+
+Rows are serialised straight from .values() querysets (no model instances) and
+every response carries a strong ETag and a Last-Modified built from the change
+stamps in rango.caching. Those stamps live in the cache, so a client revalidating
+unchanged data gets its 304 from django.views.decorators.http.condition before
+any query runs.
+"""
+import json
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition, require_GET
+
+from rango.caching import get_stamps
+from rango.middleware import query_budget
+from rango.models import Category
+from rango.pagination import PAGE_SIZE, page_values
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the standard library encoder is the fallback
+    orjson = None
+
+MAX_LIMIT = 100
+
+CATEGORY_ID_KEY = 'rango:category-id:{}'
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def json_response(data):
+    return HttpResponse(dumps(data), content_type='application/json')
+
+
+def get_limit(request, default=PAGE_SIZE):
+    try:
+        return max(1, min(int(request.GET.get('limit', default)), MAX_LIMIT))
+    except ValueError:
+        return default
+
+
+def category_id(slug):
+    # slug -> id, cached, so revalidating a page listing needs no query
+    key = CATEGORY_ID_KEY.format(slug)
+    pk = cache.get(key)
+    if pk is None:
+        pk = Category.objects.filter(slug=slug).values_list('id', flat=True).first()
+        if pk is not None:
+            cache.set(key, pk, timeout=None)
+    return pk
+
+
+def request_category_id(request, slug):
+    # category_id(), looked up once per request: the ETag, the Last-Modified and
+    # the view all need it, and an unknown slug is never cached
+    ids = request.__dict__.setdefault('_rango_category_ids', {})
+    if slug not in ids:
+        ids[slug] = category_id(slug)
+    return ids[slug]
+
+
+def validators(request, *names):
+    """
+    (ETag, Last-Modified) for a response built from the named change stamps.
+    The query string is part of the ETag, since each slice of a listing is a
+    different representation. condition() asks for the two separately, so the
+    pair is kept on the request and the stamps are read once.
+    """
+    memo = request.__dict__.setdefault('_rango_validators', {})
+    if names not in memo:
+        stamps = get_stamps(*names)
+        tag = '-'.join(f'{stamp:x}' for stamp in stamps)
+        etag = quote_etag(f'{tag}-{request.GET.urlencode()}')
+        last_modified = datetime.fromtimestamp(max(stamps) / 1e9, tz=timezone.utc)
+        memo[names] = etag, last_modified
+    return memo[names]
+
+
+def categories_validators(request):
+    return validators(request, 'catalog', 'categories')
+
+
+def pages_validators(request, category_name_slug):
+    pk = request_category_id(request, category_name_slug)
+    if pk is None:
+        return None, None
+    return validators(request, 'catalog', f'category:{pk}')
+
+
+@query_budget(1)
+@require_GET
+@condition(etag_func=lambda request: categories_validators(request)[0],
+           last_modified_func=lambda request: categories_validators(request)[1])
+def categories(request):
+    # Keyset pagination on id: ?after=<id of the last category seen>&limit=N
+    limit = get_limit(request)
+    rows = Category.objects.order_by('id').values('id', 'name', 'slug', 'views', 'likes')
+    try:
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        after = 0
+    if after:
+        rows = rows.filter(id__gt=after)
+
+    rows = list(rows[:limit + 1])
+    next_after = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_after = rows[-1]['id']
+
+    return json_response({'results': rows, 'next': next_after})
+
+
+@query_budget(2)
+@require_GET
+@condition(etag_func=lambda request, **kwargs: pages_validators(request, **kwargs)[0],
+           last_modified_func=lambda request, **kwargs: pages_validators(request, **kwargs)[1])
+def category_pages(request, category_name_slug):
+    # Most viewed first; ?after=<cursor from "next">&limit=N for the next slice
+    pk = request_category_id(request, category_name_slug)
+    if pk is None:
+        raise Http404('No such category.')
+
+    limit = get_limit(request)
+    rows, next_cursor = page_values(pk, request.GET.get('after'), limit)
+
+    return json_response({'results': rows, 'next': next_cursor})
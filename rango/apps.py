@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class RangoConfig(AppConfig):
     name = 'rango'
+
+    def ready(self):
+        # Connect the model signal handlers
+        import rango.signals  # noqa: F401
+        # Register the throttle's deploy check before the URLconf is loaded
+        import rango.throttle  # noqa: F401
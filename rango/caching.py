@@ -0,0 +1,124 @@
+"""
+Generation-keyed caching helpers.
+
+Rather than deleting every cached entry that depends on some data, each kind of
+cached data has a generation number stored in the cache. Cache keys include the
+current generation, so bumping the generation makes all the old entries
+unreachable at once (they simply expire out of the cache later on).
+"""
+import asyncio
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+GENERATION_KEY = 'rango:generation:{}'
+
+
+def get_generation(name):
+    # Start every generation at 1 the first time it is asked for
+    key = GENERATION_KEY.format(name)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, 1, timeout=None)
+        generation = cache.get(key, 1)
+    return generation
+
+
+def bump_generation(name):
+    key = GENERATION_KEY.format(name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Key was missing (never read, or evicted); any new value invalidates
+        cache.add(key, 1, timeout=None)
+        return cache.incr(key)
+
+
+def versioned_key(name, *parts):
+    # e.g. versioned_key('categories', 'sidebar', 'python') -> 'rango:categories:3:sidebar:python'
+    return ':'.join(['rango', name, str(get_generation(name))] + [str(p) for p in parts])
+
+
+STAMP_KEY = 'rango:stamp:{}'
+
+# Touched along with every other stamp: the version of the catalog as a whole
+GLOBAL_STAMP = 'global'
+
+
+def get_stamp(name, seed=None):
+    """
+    The time (in nanoseconds) some data last changed, for ETags and
+    Last-Modified. Unlike a generation, a stamp that falls out of the cache
+    comes back as "now", never as a value a client might already hold, unless
+    seed(name) can tell from the database when the data last changed.
+    """
+    key = STAMP_KEY.format(name)
+    stamp = cache.get(key)
+    if stamp is None:
+        seeded = seed(name) if seed is not None else None
+        cache.add(key, seeded or time.time_ns(), timeout=None)
+        stamp = cache.get(key)
+    return stamp
+
+
+def get_stamps(*names, seed=None):
+    # Several stamps in one cache round trip
+    keys = {STAMP_KEY.format(name): name for name in names}
+    found = cache.get_many(list(keys))
+    return [found[key] if key in found else get_stamp(name, seed) for key, name in keys.items()]
+
+
+def touch(*names):
+    now = time.time_ns()
+    names = set(names) | {GLOBAL_STAMP}
+    cache.set_many({STAMP_KEY.format(name): now for name in names}, timeout=None)
+
+
+def touch_on_commit(*names):
+    # Touch now and again once the write is committed, so a reader that picked up
+    # the first stamp while the old rows were still visible is not left with it
+    touch(*names)
+    transaction.on_commit(lambda: touch(*names))
+
+
+# How long one request may hold the right to recompute a single-flight entry, and
+# how often the requests waiting on it look for the result
+LOCK_TIMEOUT = 10
+POLL_INTERVAL = 0.05
+
+
+async def asingle_flight(key, version, compute, timeout=None):
+    """
+    The value cached under key for this version, computing it with the
+    coroutine function compute() on a miss. Only one request at a time
+    recomputes a key (it holds a cache.add() lock): the others are handed the
+    previous version if there is one, or wait for the new value otherwise, so a
+    burst of requests for the same cold entry costs a single computation.
+    """
+    entry = await cache.aget(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    lock_key = f'{key}:lock'
+    if await cache.aadd(lock_key, 1, timeout=LOCK_TIMEOUT):
+        try:
+            value = await compute()
+            await cache.aset(key, (version, value), timeout)
+        finally:
+            await cache.adelete(lock_key)
+        return value
+
+    if entry is not None:
+        # Someone else is recomputing; a slightly stale copy will do meanwhile
+        return entry[1]
+
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(POLL_INTERVAL)
+        entry = await cache.aget(key)
+        if entry is not None:
+            return entry[1]
+
+    # The request holding the lock never delivered; do the work ourselves
+    return await compute()
@@ -0,0 +1,154 @@
+"""
+Denormalized per-category counters.
+
+Category.page_count and Category.total_views hold COUNT(*) and SUM(views) of the
+category's pages, so listings never aggregate over Page. They are adjusted with
+F() expressions in the same transaction as the change to the pages: a page
+saved or deleted (see rango.signals, and Page.save, which is atomic), a batch of
+buffered clicks flushed (see rango.clicks), or a batch of imported rows.
+
+Category.trending_score is the number of recent page additions and clicks,
+each decaying with a half-life of RANGO_TRENDING_HALF_LIFE_DAYS. Rather than
+decaying every score as time passes, an event at time t weighs
+2 ** ((t - EPOCH) / HALF_LIFE): later events weigh more, and all scores keep
+the order their decayed values would have, so ORDER BY trending_score needs no
+maintenance. Those weights grow without bound (a float overflows after about
+1000 half-lives), so the score stored is the log2 of their sum, which grows by
+one per half-life instead, and events are added to it in SQL (see
+add_events()). decayed() turns a score back into "events, as of now".
+
+Every update here also sets the category's updated_at, so it records the last
+change to the category or any of its pages (see rango.conditional).
+
+repair() recomputes the counters from the pages in bulk.
+"""
+import math
+import time
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Case, Count, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Abs, Coalesce, Greatest, Log, Power
+from django.utils import timezone
+
+from rango.models import Category, Page
+
+HALF_LIFE = getattr(settings, 'RANGO_TRENDING_HALF_LIFE_DAYS', 7) * 24 * 60 * 60
+
+# Weights double every HALF_LIFE after this
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc).timestamp()
+
+
+def exponent(at=None):
+    # log2 of the weight of one event at time at (default now)
+    return ((time.time() if at is None else at) - EPOCH) / HALF_LIFE
+
+
+def add_events(count, at=None):
+    """
+    An expression for trending_score with count more events at time at, i.e.
+    log2(2 ** trending_score + count * 2 ** exponent(at)), computed as
+    max(a, b) + log2(1 + 2 ** -|a - b|) so no power of two ever overflows.
+    """
+    score = F('trending_score')
+    added = Value(exponent(at) + math.log2(count), output_field=FloatField())
+    two = Value(2.0, output_field=FloatField())
+    return Greatest(score, added) + Log(two, Value(1.0, output_field=FloatField()) +
+                                        Power(two, -Abs(score - added)))
+
+
+def decayed(score, at=None):
+    return 2.0 ** min(score - exponent(at), 1000)
+
+
+def page_added(page):
+    Category.objects.filter(id=page.category_id).update(
+        page_count=F('page_count') + 1,
+        total_views=F('total_views') + page.views,
+        trending_score=add_events(1),
+        updated_at=timezone.now())
+
+
+def page_removed(page, category_id=None, views=None):
+    # category_id and views default to the page's own, for a page that has been deleted
+    Category.objects.filter(id=page.category_id if category_id is None else category_id).update(
+        page_count=F('page_count') - 1,
+        total_views=F('total_views') - (page.views if views is None else views),
+        updated_at=timezone.now())
+
+
+def page_changed(page):
+    """
+    Adjust the counters for a saved page, using the values it was loaded with
+    (see Page.from_db). A page loaded without them has its category repaired.
+    """
+    category_id, views = getattr(page, 'loaded_values', (None, None))
+    if category_id is None or views is None:
+        repair([page.category_id])
+    elif category_id != page.category_id:
+        # Moved to another category
+        page_removed(page, category_id, views)
+        Category.objects.filter(id=page.category_id).update(
+            page_count=F('page_count') + 1, total_views=F('total_views') + page.views,
+            updated_at=timezone.now())
+    elif views != page.views:
+        Category.objects.filter(id=page.category_id).update(
+            total_views=F('total_views') + (page.views - views), updated_at=timezone.now())
+    else:
+        # Only the title or url changed, which still changes the category's listing
+        Category.objects.filter(id=page.category_id).update(updated_at=timezone.now())
+
+
+def views_added(counts):
+    """
+    Add page views, given as {page_id: views}, to the pages' categories. Called
+    by the click buffer inside the transaction that updates Page.views; returns
+    the ids of the categories changed.
+    """
+    by_category = defaultdict(int)
+    for page_id, category_id in Page.objects.filter(id__in=counts).values_list('id', 'category_id'):
+        by_category[category_id] += counts[page_id]
+
+    # One UPDATE per distinct number of views, as for the pages themselves
+    by_count = defaultdict(list)
+    for category_id, count in by_category.items():
+        by_count[count].append(category_id)
+
+    at = time.time()
+    for count, category_ids in by_count.items():
+        Category.objects.filter(id__in=category_ids).update(
+            total_views=F('total_views') + count,
+            trending_score=add_events(count, at),
+            updated_at=timezone.now())
+
+    return list(by_category)
+
+
+def repair(category_ids=None, reset_trending=False):
+    """
+    Recompute page_count and total_views from the pages, for the given
+    categories or all of them, in a single UPDATE. The trending score cannot be
+    recomputed (clicks are not kept one by one); reset_trending sets it as if
+    every view had happened now (0, next to nothing, for a category without views).
+    """
+    pages = Page.objects.filter(category=OuterRef('pk')).order_by().values('category')
+    page_count = pages.annotate(n=Count('id')).values('n')
+    total_views = pages.annotate(total=Sum('views')).values('total')
+
+    values = {
+        'page_count': Coalesce(Subquery(page_count, output_field=IntegerField()), 0),
+        'total_views': Coalesce(Subquery(total_views, output_field=IntegerField()), 0),
+        'updated_at': timezone.now(),
+    }
+    categories = Category.objects.all()
+    if category_ids is not None:
+        categories = categories.filter(id__in=category_ids)
+
+    updated = categories.update(**values)
+    if reset_trending:
+        two = Value(2.0, output_field=FloatField())
+        categories.update(trending_score=Case(
+            When(total_views__gt=0, then=Log(two, F('total_views')) + exponent()),
+            default=Value(0.0), output_field=FloatField()))
+    return updated
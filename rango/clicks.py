@@ -0,0 +1,48 @@
+"""
+Buffered click tracking for Page.views.
+
+Every click on a /rango/goto/<page_id>/ link is recorded into a CounterBuffer
+(see rango.counters) instead of issuing an UPDATE straight away; the clicks are
+written to the database in batches.
+"""
+from django.conf import settings
+
+from rango import category_stats
+from rango.caching import touch
+from rango.counters import CounterBuffer
+from rango.leaderboards import categories_trending, pages_viewed
+from rango.models import Page
+
+# How often (in seconds) and after how many buffered clicks we write to the DB
+FLUSH_INTERVAL = getattr(settings, 'RANGO_CLICK_FLUSH_INTERVAL', 5.0)
+FLUSH_THRESHOLD = getattr(settings, 'RANGO_CLICK_FLUSH_THRESHOLD', 500)
+
+
+class ClickBuffer(CounterBuffer):
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, flush_threshold=FLUSH_THRESHOLD):
+        super().__init__(Page, 'views', flush_interval, flush_threshold)
+
+    def written(self, counts):
+        # The categories' total views and trending scores go up in the same transaction
+        category_stats.views_added(counts)
+
+    def flushed(self, page_ids):
+        # Tell the leaderboards, and mark the categories whose page order may have changed
+        pages_viewed(page_ids)
+        category_ids = list(Page.objects.filter(id__in=page_ids)
+                                        .values_list('category_id', flat=True).distinct())
+        categories_trending(category_ids)
+        touch(*[f'category:{category_id}' for category_id in category_ids])
+
+
+# The buffer shared by every request handled in this process
+click_buffer = ClickBuffer()
+
+
+def record_click(page_id):
+    click_buffer.record(page_id)
+
+
+def flush_clicks():
+    return click_buffer.flush()
@@ -0,0 +1,101 @@
+"""
+Conditional GET for the HTML pages.
+
+@conditional_page(stamps) gives an async view an ETag and a Last-Modified built
+from change stamps (see rango.caching), and answers If-None-Match /
+If-Modified-Since with a 304 before the view runs, so an unchanged page costs
+one cache lookup instead of its queries and template render. stamps(request,
+*args, **kwargs) returns the names of the stamps the page depends on, or None
+to skip the check (e.g. for an unknown category).
+
+The pages show who is logged in, so the ETag also covers the session and CSRF
+cookies, and the responses say Vary: Cookie. Cache-Control: no-cache makes
+browsers and shared caches revalidate every time rather than guess at how long
+a copy stays fresh. A stamp that has fallen out of the cache is seeded from the
+database, so clients keep getting 304s after a restart: a category's from its
+updated_at, and the stamps covering every category ('catalog', 'categories'
+and 'global') from the latest updated_at of them all.
+The sidebar's trending order is allowed to lag, as it does in its own cache
+(see rango.templatetags.rango_template_tags).
+"""
+import hashlib
+from functools import partial, wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from rango.caching import GLOBAL_STAMP, get_stamps
+from rango.models import Category
+
+
+# Stamps touched by a change to any category or page
+CATALOG_STAMPS = ('catalog', 'categories', GLOBAL_STAMP)
+
+
+def catalog_seed():
+    latest = Category.objects.aggregate(updated_at=Max('updated_at'), count=Count('id'))
+    if latest['updated_at'] is None:
+        return None
+    # Offset by the number of categories, so deleting one (which leaves no
+    # updated_at behind) changes the seed too
+    return int(latest['updated_at'].timestamp() * 10 ** 9) + latest['count']
+
+
+def seed_stamp(name, seen=None):
+    # When a category, or one of its pages, last changed according to the database.
+    # seen, if given, keeps the catalog's seed for the other catalog stamps
+    if name in CATALOG_STAMPS:
+        seen = {} if seen is None else seen
+        if 'catalog' not in seen:
+            seen['catalog'] = catalog_seed()
+        return seen['catalog']
+    if not name.startswith('category:'):
+        return None
+    updated_at = Category.objects.filter(id=int(name.split(':', 1)[1])) \
+                                 .values_list('updated_at', flat=True).first()
+    return int(updated_at.timestamp() * 10 ** 9) if updated_at else None
+
+
+def page_validators(request, names):
+    # (ETag, Last-Modified timestamp) for a page built from the named stamps
+    stamps = get_stamps(*names, seed=partial(seed_stamp, seen={}))
+    cookies = '|'.join(request.COOKIES.get(name, '') for name in
+                       (settings.SESSION_COOKIE_NAME, settings.CSRF_COOKIE_NAME))
+    visitor = hashlib.blake2b(cookies.encode(), digest_size=8).hexdigest() if cookies.strip('|') else 'anon'
+    tag = '-'.join(f'{stamp:x}' for stamp in stamps)
+    etag = quote_etag(f'{tag}-{visitor}-{request.GET.urlencode()}')
+    return etag, max(stamps) // 10 ** 9
+
+
+def conditional_page(stamps):
+    def decorator(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await view_func(request, *args, **kwargs)
+
+            # In a thread: the slug lookup and the seed may have to query the database
+            def validators():
+                names = stamps(request, *args, **kwargs)
+                return page_validators(request, names) if names else (None, None)
+
+            etag, last_modified = await sync_to_async(validators)()
+            if etag is None:
+                return await view_func(request, *args, **kwargs)
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view_func(request, *args, **kwargs)
+
+            if response.status_code in (200, 304):
+                response.headers.setdefault('ETag', etag)
+                response.headers.setdefault('Last-Modified', http_date(last_modified))
+                patch_cache_control(response, no_cache=True)
+                patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
+
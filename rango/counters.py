@@ -0,0 +1,164 @@
+"""
+Write-coalescing counters.
+
+Hot counters (Page.views) are not bumped with one UPDATE per event. Increments are added up in an in-process buffer and flushed, on a
+background thread, as soon as the buffer holds enough of them, by a timer at
+most flush_interval seconds after the first one arrived (so an idle worker does
+not sit on them), and again when the process exits. A flush groups
+rows by their pending increment so one UPDATE ... SET field = field + n covers
+every row that received n increments, all inside a single transaction. No
+request ever waits on the row lock of a popular page or category.
+"""
+import atexit
+import logging
+import math
+import threading
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from rango.routers import pin_to_primary, unpin
+
+logger = logging.getLogger('rango.counters')
+
+_buffers = []
+
+
+class CounterBuffer:
+
+    # Set to the time of the flush on every row written, as auto_now would be by save()
+    updated_field = 'updated_at'
+
+    def __init__(self, model, field, flush_interval, flush_threshold):
+        self.model = model
+        self.field = field
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+
+        # primary key -> increment not yet written to the database
+        self._pending = defaultdict(int)
+        self._pending_total = 0
+        self._flushing = False
+        # Pending flush_interval after the first increment since the last timed flush
+        self._timer = None
+        self._lock = threading.Lock()
+
+        _buffers.append(self)
+
+    def record(self, pk, count=1):
+        with self._lock:
+            self._pending[pk] += count
+            self._pending_total += count
+            due = not self._flushing and self._pending_total >= self.flush_threshold
+            if due:
+                self._flushing = True
+            timer = None
+            if self._timer is None and not math.isinf(self.flush_interval):
+                timer = self._timer = threading.Timer(self.flush_interval, self._timed_flush)
+                timer.daemon = True
+
+        if due:
+            # Write in the background so the request that tipped the buffer over
+            # does not pay for the flush
+            threading.Thread(target=self._background_flush, daemon=True).start()
+        if timer is not None:
+            timer.start()
+
+    def _timed_flush(self):
+        with self._lock:
+            self._timer = None
+            if self._flushing:
+                # Whatever arrives after that flush's swap starts a new timer
+                return
+            self._flushing = True
+        self._background_flush()
+
+    def _background_flush(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Could not flush buffered %s.%s', self.model.__name__, self.field)
+        finally:
+            self._flushing = False
+            # The thread had its own database connection; do not leave it open
+            connection.close()
+
+    def pending(self, pk):
+        with self._lock:
+            return self._pending.get(pk, 0)
+
+    def flush(self):
+        # Swap the buffer out under the lock so increments keep arriving while we write
+        with self._lock:
+            pending = self._pending
+            self._pending = defaultdict(int)
+            self._pending_total = 0
+
+        if not pending:
+            return 0
+
+        # Group rows by increment: one UPDATE per distinct increment, not per row
+        by_count = defaultdict(list)
+        for pk, count in pending.items():
+            by_count[count].append(pk)
+
+        try:
+            with transaction.atomic():
+                now = timezone.now()
+                for count, pks in by_count.items():
+                    changes = {self.field: F(self.field) + count}
+                    if self.updated_field:
+                        changes[self.updated_field] = now
+                    self.model.objects.filter(pk__in=pks).update(**changes)
+                self.written(pending)
+        except Exception:
+            # Put the increments back so a failed flush does not lose them
+            with self._lock:
+                for pk, count in pending.items():
+                    self._pending[pk] += count
+                    self._pending_total += count
+            raise
+
+        # The UPDATEs bypass model signals. Whatever flushed() reads back has to
+        # come from the primary, where the new counts already are.
+        token = pin_to_primary()
+        try:
+            self.flushed(list(pending))
+        finally:
+            unpin(token)
+
+        return sum(pending.values())
+
+    def clear(self):
+        # Drop the buffered increments without writing them (e.g. between tests)
+        with self._lock:
+            self._pending = defaultdict(int)
+            self._pending_total = 0
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+
+    def written(self, pending):
+        # Hook for changes that must commit together with the increments ({pk: count})
+        pass
+
+    def flushed(self, pks):
+        # Hook for refreshing whatever is derived from the counter
+        pass
+
+
+def clear_buffers():
+    for buffer in _buffers:
+        buffer.clear()
+
+
+@atexit.register
+def _flush_on_exit():
+    for buffer in _buffers:
+        try:
+            buffer.flush()
+        except Exception:
+            logger.exception('Could not flush buffered %s.%s on exit',
+                             buffer.model.__name__, buffer.field)
@@ -0,0 +1,115 @@
+"""
+Streaming catalog export.
+
+The export has the columns import_catalog reads (category, category_views,
+category_likes, title, url, views), so a dump can be loaded straight back in:
+one row per page, after one row without a title for each category that has no
+pages. Rows are read with values_list().iterator(), which fetches them from
+the database cursor chunk_size at a time, encoded into chunks of about
+CHUNK_BYTES and, optionally, gzipped as they go. Nothing holds more than a
+chunk of rows, so memory stays flat however large the catalog is.
+
+export() returns the chunks as bytes, for a StreamingHttpResponse (see
+views.export_csv and views.export_jsonl) or the export_catalog command. Under
+ASGI, Django would read a plain iterator to the end before sending anything, so
+the view hands it aiterate(chunks) instead, which pulls a few chunks at a time
+in a worker thread.
+"""
+import csv
+import io
+import json
+import zlib
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+from rango.models import Category, Page
+
+COLUMNS = ('category', 'category_views', 'category_likes', 'title', 'url', 'views')
+
+FORMATS = ('csv', 'jsonl')
+
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/jsonl; charset=utf-8'}
+
+# Rows fetched per round trip to the database
+CHUNK_SIZE = 2000
+
+# Encoded output handed on at a time
+CHUNK_BYTES = 64 * 1024
+
+
+def rows(chunk_size=CHUNK_SIZE):
+    # Categories without pages, then every page with its category, as tuples in COLUMNS order
+    empty = Category.objects.filter(page__isnull=True).order_by('id') \
+                            .values_list('name', 'views', 'likes')
+    for name, views, likes in empty.iterator(chunk_size=chunk_size):
+        yield name, views, likes, None, None, None
+
+    pages = Page.objects.order_by('category_id', 'id') \
+                        .values_list('category__name', 'category__views', 'category__likes',
+                                     'title', 'url', 'views')
+    yield from pages.iterator(chunk_size=chunk_size)
+
+
+def csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def jsonl_chunks(rows):
+    lines = []
+    size = 0
+    for row in rows:
+        # A category without pages has no page keys at all, as the importer expects
+        record = dict(zip(COLUMNS, row if row[3] is not None else row[:3]))
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        lines.append(line)
+        size += len(line) + 1
+        if size >= CHUNK_BYTES:
+            yield ('\n'.join(lines) + '\n').encode()
+            lines = []
+            size = 0
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+def gzipped(chunks, level=6):
+    # A gzip stream (wbits 31: gzip header and trailer) compressed as the chunks arrive
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def aiterate(chunks, batch=8):
+    """
+    The chunks as an async iterator. Each batch is read with sync_to_async on
+    the same (thread-sensitive) thread, which owns the database cursor.
+    """
+    iterator = iter(chunks)
+    next_batch = sync_to_async(lambda: list(islice(iterator, batch)), thread_sensitive=True)
+    while True:
+        items = await next_batch()
+        if not items:
+            return
+        for item in items:
+            yield item
+
+
+def export(fmt, compress=False, chunk_size=CHUNK_SIZE):
+    """The whole catalog in fmt ('csv' or 'jsonl'), as an iterator of bytes."""
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown export format {fmt!r}')
+    encode = csv_chunks if fmt == 'csv' else jsonl_chunks
+    chunks = encode(rows(chunk_size))
+    return gzipped(chunks) if compress else chunks
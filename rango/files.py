@@ -0,0 +1,178 @@
+"""
+File serving for media (and, optionally, collected static) files.
+
+Django's static() helper serves files through django.views.static.serve, which
+is meant for development: no byte ranges, a weak validator and the worker pushes
+every byte itself. serve_file() answers conditional requests with a 304 from a
+single stat() call, supports single byte ranges, picks precompressed .br/.gz
+copies, and with RANGO_FILE_ACCEL set hands the transfer to the front-end web
+server (nginx X-Accel-Redirect or Apache/lighttpd X-Sendfile) so the worker
+never streams the bytes at all.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (FileResponse, Http404, HttpResponse, HttpResponseNotModified,
+                         StreamingHttpResponse)
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+
+from rango.storage import precompressed_path
+
+CHUNK_SIZE = 64 * 1024
+
+# Media is uploaded by users: anything but these is sent as a download, so a
+# browser never renders it as a page of this site
+INLINE_MEDIA_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=0, must-revalidate'
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def make_etag(stat):
+    # Strong validator from size and modification time (in nanoseconds)
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def not_modified(request, etag, mtime):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        # If-None-Match wins over If-Modified-Since when both are sent
+        return if_none_match.strip() == '*' or etag in [t.strip() for t in if_none_match.split(',')]
+    since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return since is not None and int(mtime) <= since
+
+
+def parse_range(header, size):
+    # A single 'bytes=a-b' range as (start, end) inclusive; None to send the whole file
+    match = _RANGE_RE.match(header or '')
+    if not match or size == 0:
+        return None
+    first, last = match.groups()
+    if first == '':
+        if last == '':
+            return None
+        # Suffix range: the final N bytes, of which there must be at least one
+        if int(last) == 0:
+            raise ValueError('unsatisfiable range')
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start > end:
+        raise ValueError('unsatisfiable range')
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_file(request, path, document_root, precompressed=False, immutable=False, accel_key=None):
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        fullpath = safe_join(document_root, path)
+    except (SuspiciousFileOperation, ValueError):
+        raise Http404('Not found.')
+
+    encoding = None
+    if precompressed:
+        fullpath, encoding = precompressed_path(fullpath, request.META.get('HTTP_ACCEPT_ENCODING', ''))
+
+    try:
+        stat = os.stat(fullpath)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('Not found.')
+    if not os.path.isfile(fullpath):
+        raise Http404('Not found.')
+
+    etag = make_etag(stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': IMMUTABLE if immutable else REVALIDATE,
+        'Accept-Ranges': 'bytes',
+    }
+    if precompressed:
+        headers['Vary'] = 'Accept-Encoding'
+
+    if not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    content_type, _ = mimetypes.guess_type(path)
+    content_type = content_type or 'application/octet-stream'
+
+    # RANGO_FILE_ACCEL is 'nginx' (X-Accel-Redirect), 'sendfile' (X-Sendfile) or None.
+    # For nginx, RANGO_FILE_ACCEL_PREFIXES maps accel_key to an internal location.
+    accel = getattr(settings, 'RANGO_FILE_ACCEL', None)
+    accel_prefixes = getattr(settings, 'RANGO_FILE_ACCEL_PREFIXES', {})
+
+    if accel == 'sendfile' or (accel == 'nginx' and accel_key in accel_prefixes):
+        # The front-end server sends the file (and handles Range) itself
+        response = HttpResponse(content_type=content_type)
+        if accel == 'sendfile':
+            response['X-Sendfile'] = fullpath
+        else:
+            location = accel_prefixes[accel_key].rstrip('/') + '/' + path
+            if encoding:
+                location += os.path.splitext(fullpath)[1]
+            response['X-Accel-Redirect'] = location
+    else:
+        # Ranges are only honoured when they still match this version of the file
+        if_range = request.META.get('HTTP_IF_RANGE')
+        byte_range = None
+        if if_range is None or if_range == etag:
+            try:
+                byte_range = parse_range(request.META.get('HTTP_RANGE'), stat.st_size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{stat.st_size}'
+                return response
+
+        if byte_range is None:
+            # FileResponse lets the WSGI server use os.sendfile() where it can
+            response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+            response['Content-Length'] = str(stat.st_size)
+        else:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(_read_range(fullpath, start, length),
+                                             status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+            response['Content-Length'] = str(length)
+
+    if encoding:
+        response['Content-Encoding'] = encoding
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def serve_media(request, path):
+    # Profile pictures are stored under their content hash, so they never change
+    immutable = path.startswith('profile_images/')
+    response = serve_file(request, path, settings.MEDIA_ROOT, immutable=immutable, accel_key='media')
+    if mimetypes.guess_type(path)[0] not in INLINE_MEDIA_TYPES:
+        response['Content-Disposition'] = 'attachment'
+    return response
+
+
+def serve_static(request, path):
+    # Collected static names carry a content hash (ManifestStaticFilesStorage)
+    return serve_file(request, path, settings.STATIC_ROOT, precompressed=True,
+                      immutable=True, accel_key='static')
@@ -1,5 +1,6 @@
 from django import forms
 from django.contrib.auth.models import User
+from rango.images import picture_format
 from rango.models import Page, Category, UserProfile
 
 class CategoryForm(forms.ModelForm):
@@ -27,7 +28,9 @@ class PageForm(forms.ModelForm):
         model = Page
 
         # Hiding the forieng key from the form (can also use include and not mention category) 
-        exclude = ('category',)
+        # and the results of the link checker
+        exclude = ('category', 'link_status', 'link_error', 'link_latency', 'link_etag',
+                   'link_last_modified', 'link_checked')
 
     def clean(self):
         cleaned_data = self.cleaned_data
@@ -35,9 +38,9 @@ class PageForm(forms.ModelForm):
         # Getting the cleaned url data from the ModelForm
         url = cleaned_data.get('url')
        
-        # If url is not empty and doesn't start with 'http://',
+        # If url is not empty and doesn't start with 'http://' (or 'https://'),
         # then prepend 'http://'.
-        if url and not url.startswith('http://'):
+        if url and not url.startswith(('http://', 'https://')):
             url = f'http://{url}'
             cleaned_data['url'] = url
        
@@ -56,3 +59,10 @@ class UserProfileForm(forms.ModelForm):
         model = UserProfile
         fields = ('website', 'picture')
 
+    def clean_picture(self):
+        # Only real images; store_picture names the file after the detected format
+        picture = self.cleaned_data.get('picture')
+        if picture and 'picture' in self.files and picture_format(picture) is None:
+            raise forms.ValidationError('Please upload a JPEG, PNG, GIF or WebP image.')
+        return picture
+
@@ -0,0 +1,79 @@
+"""
+Password hashing off the event loop.
+
+PBKDF2 deliberately burns tens of milliseconds of CPU per call. In an async view
+that would stall every other request on the event loop, so the hashing is run
+on a small, bounded thread pool (hashlib releases the GIL while it works). Only
+the CPU-bound part goes to the pool; the database lookups stay on the request's
+own connection.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.hashers import check_password, make_password
+from django.contrib.auth.signals import user_login_failed
+
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+_pool = ThreadPoolExecutor(max_workers=getattr(settings, 'RANGO_HASH_WORKERS', 4),
+                           thread_name_prefix='rango-hashing')
+
+
+async def run_hasher(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_pool, func, *args)
+
+
+async def hash_password(raw_password):
+    return await run_hasher(make_password, raw_password)
+
+
+async def authenticate_async(request, username, password):
+    """
+    authenticate() for async views. With the stock ModelBackend the user lookup
+    runs on the request's connection and only the password check goes to the
+    hashing pool; any other backend setup falls back to authenticate() itself.
+    Either way a failure sends user_login_failed, and a password stored with an
+    outdated hasher or iteration count is rehashed, as authenticate() would.
+    """
+    if list(settings.AUTHENTICATION_BACKENDS) != [MODEL_BACKEND]:
+        return await sync_to_async(authenticate)(request, username=username, password=password)
+
+    user = await _check_credentials(username, password)
+    if user is None:
+        # The password is masked as authenticate() masks it
+        credentials = {'username': username, 'password': '********************'}
+        await sync_to_async(user_login_failed.send)(sender='django.contrib.auth',
+                                                    credentials=credentials, request=request)
+        return None
+
+    user.backend = MODEL_BACKEND
+    return user
+
+
+async def _check_credentials(username, password):
+    # ModelBackend.authenticate(), with the hashing done on the pool
+    if username is None or password is None:
+        return None
+
+    UserModel = get_user_model()
+    try:
+        user = await sync_to_async(UserModel._default_manager.get_by_natural_key)(username)
+    except UserModel.DoesNotExist:
+        # Hash anyway so a missing user takes as long as a wrong password
+        await hash_password(password)
+        return None
+
+    outdated = []
+    if not await run_hasher(check_password, password, user.password, outdated.append):
+        return None
+    if not getattr(user, 'is_active', True):
+        return None
+
+    if outdated:
+        # Stored with a hasher or work factor that is no longer the preferred one
+        user.password = await hash_password(password)
+        await sync_to_async(user.save)(update_fields=['password'])
+    return user
@@ -0,0 +1,49 @@
+"""
+Base class for middleware that runs in whichever mode the rest of the chain does:
+plain calls under WSGI, coroutines under ASGI, so an async view is never pushed
+onto a thread just to get through it.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+
+class HybridMiddleware:
+    """
+    Subclasses implement before(request), which returns some state,
+    after(state), which always runs once the response (or an exception) is
+    back, and finish(request, response, state), which returns the response.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def before(self, request):
+        return None
+
+    def after(self, state):
+        pass
+
+    def finish(self, request, response, state):
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self.before(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.after(state)
+        return self.finish(request, response, state)
+
+    async def __acall__(self, request):
+        state = self.before(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.after(state)
+        return self.finish(request, response, state)
@@ -0,0 +1,140 @@
+"""
+Profile picture storage and thumbnailing.
+
+An uploaded picture is hashed while it is copied to storage and saved under its
+SHA-256, so the same image uploaded twice is stored once. Its extension comes
+from the format Pillow detects, never from the uploaded name, so a file that
+is not a JPEG, PNG, GIF or WebP image is refused rather than stored (and later
+served) as whatever it claims to be. The request returns as
+soon as the original is saved; resizing happens afterwards on a small pool of
+background threads, which write a WebP and a JPEG thumbnail per size and then
+flag the profile. Until then templates fall back to the original picture.
+"""
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+logger = logging.getLogger('rango.images')
+
+# Thumbnail edge lengths in pixels, and the formats written for each
+THUMBNAIL_SIZES = {'small': 64, 'medium': 200}
+THUMBNAIL_FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+
+UPLOAD_DIR = 'profile_images'
+THUMBNAIL_DIR = 'profile_images/thumbs'
+
+# Formats accepted for profile pictures, and the extension each is stored with
+PICTURE_FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp'}
+
+# 0 workers makes thumbnails inline after commit (handy for tests and scripts)
+WORKERS = getattr(settings, 'RANGO_IMAGE_WORKERS', 2)
+
+_executor = ThreadPoolExecutor(max_workers=max(WORKERS, 1), thread_name_prefix='rango-images')
+
+
+def picture_format(upload):
+    # The upload's format as Pillow reads it, or None unless it is one of PICTURE_FORMATS
+    from PIL import Image
+
+    upload.seek(0)
+    try:
+        with Image.open(upload) as image:
+            fmt = image.format
+            image.verify()
+    except Exception:
+        # Pillow raises all sorts for files it cannot make sense of
+        return None
+    finally:
+        upload.seek(0)
+    return fmt if fmt in PICTURE_FORMATS else None
+
+
+def store_picture(upload):
+    """
+    Save an uploaded image under its content hash and return (name, hash).
+    If an identical file was uploaded before, the stored copy is reused.
+    Raises ValueError if the upload is not an image in PICTURE_FORMATS.
+    """
+    fmt = picture_format(upload)
+    if fmt is None:
+        raise ValueError(f'{upload.name} is not a JPEG, PNG, GIF or WebP image')
+
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    content_hash = digest.hexdigest()
+
+    ext = PICTURE_FORMATS[fmt]
+    name = f'{UPLOAD_DIR}/{content_hash[:2]}/{content_hash}{ext}'
+
+    if not default_storage.exists(name):
+        upload.seek(0)
+        name = default_storage.save(name, upload)
+
+    return name, content_hash
+
+
+def thumbnail_name(content_hash, size, fmt):
+    return f'{THUMBNAIL_DIR}/{content_hash[:2]}/{content_hash}_{size}.{fmt}'
+
+
+def thumbnail_url(profile, size='small', fmt='webp'):
+    # The thumbnail if it has been made, otherwise the original picture
+    if not profile.picture:
+        return ''
+    if profile.thumbnails_ready and profile.picture_hash:
+        return default_storage.url(thumbnail_name(profile.picture_hash, size, fmt))
+    return profile.picture.url
+
+
+def make_thumbnails(name, content_hash):
+    from PIL import Image
+
+    with default_storage.open(name) as f:
+        original = Image.open(f)
+        original.load()
+    original = original.convert('RGB')
+
+    for size, edge in THUMBNAIL_SIZES.items():
+        image = original.copy()
+        image.thumbnail((edge, edge))
+        for fmt, pil_format in THUMBNAIL_FORMATS.items():
+            target = thumbnail_name(content_hash, size, fmt)
+            # Identical uploads share thumbnails, so they may already exist
+            if default_storage.exists(target):
+                continue
+            buffer = BytesIO()
+            image.save(buffer, pil_format, quality=85)
+            default_storage.save(target, ContentFile(buffer.getvalue()))
+
+
+def _process(profile_id, name, content_hash, in_worker=True):
+    from rango.models import UserProfile
+
+    try:
+        make_thumbnails(name, content_hash)
+        # Only flag the profile if it still shows this picture
+        UserProfile.objects.filter(id=profile_id, picture_hash=content_hash) \
+                           .update(thumbnails_ready=True)
+    except Exception:
+        logger.exception('Could not make thumbnails for %s', name)
+    finally:
+        # Worker threads get their own connection; do not leave it open
+        if in_worker:
+            connection.close()
+
+
+def queue_thumbnails(profile):
+    # Start once the profile row is committed, so the worker can see it
+    args = (profile.id, profile.picture.name, profile.picture_hash)
+    if WORKERS == 0:
+        transaction.on_commit(lambda: _process(*args, in_worker=False))
+    else:
+        transaction.on_commit(lambda: _executor.submit(_process, *args))
@@ -0,0 +1,173 @@
+"""
+Bulk catalog importer.
+
+Rows are dictionaries with a 'category' name and, optionally, 'category_views',
+'category_likes', 'title', 'url' and 'views'. A row without a title only creates
+or updates the category. Rows are consumed lazily and written in batches, each
+batch in its own transaction, with a handful of queries per batch rather than
+several per row:
+
+    1. one SELECT for slug clashes, one INSERT ... ON CONFLICT (name) DO UPDATE
+       per set of category columns given (so at most four) and one SELECT for
+       the categories' ids,
+    2. one SELECT for the batch's existing pages, one bulk INSERT and one bulk
+       UPDATE (pages have no unique key to upsert on).
+
+bulk_create() skips Category.save() and the model signals, so slugs are computed
+here with slugify, each batch adds its new rows to the search index itself, and
+the page counters and derived caches are refreshed once at the end.
+"""
+import csv
+import json
+from itertools import islice
+
+from django.db import transaction
+from django.template.defaultfilters import slugify
+from django.utils import timezone
+
+from rango import category_stats
+from rango.caching import bump_generation, touch
+from rango.leaderboards import top_categories, top_pages, trending_categories
+from rango.models import Category, Page
+from rango.search import index_new
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def read_csv(file):
+    for row in csv.DictReader(file):
+        yield row
+
+
+def read_jsonl(file):
+    for line in file:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def batches(rows, batch_size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _int(value):
+    # CSV gives us strings (or '' for a missing column); JSON gives ints or None
+    if value in (None, ''):
+        return None
+    return int(value)
+
+
+def _import_categories(batch):
+    wanted = {}
+    for row in batch:
+        name = row['category'].strip()
+        values = wanted.setdefault(name, {})
+        for field in ('views', 'likes'):
+            value = _int(row.get(f'category_{field}'))
+            if value is not None:
+                values[field] = value
+
+    # A name whose slug is already another category's (or an earlier row's) is
+    # skipped: the upsert below only resolves conflicts on the name
+    slugs = {name: slugify(name) for name in wanted}
+    taken = dict(Category.objects.filter(slug__in=slugs.values()).values_list('slug', 'name'))
+    for name, slug in slugs.items():
+        if taken.setdefault(slug, name) != name:
+            del wanted[name]
+
+    # One upsert per set of columns given, since update_fields is per statement
+    # (bulk_create() sets updated_at on the new rows; it is also updated on conflict)
+    by_fields = {}
+    for name, values in wanted.items():
+        by_fields.setdefault(tuple(sorted(values)), []).append(
+            Category(name=name, slug=slugs[name], **values))
+    for fields, categories in by_fields.items():
+        if fields:
+            Category.objects.bulk_create(categories, update_conflicts=True, unique_fields=['name'],
+                                         update_fields=list(fields) + ['updated_at'])
+        else:
+            Category.objects.bulk_create(categories, ignore_conflicts=True)
+
+    # bulk_create() does not return primary keys for upserts, so look them up
+    return {c.name: c for c in Category.objects.filter(name__in=wanted).only('id', 'name')}
+
+
+def _import_pages(batch, categories):
+    wanted = {}
+    for row in batch:
+        title = (row.get('title') or '').strip()
+        if not title:
+            continue
+        category = categories.get(row['category'].strip())
+        if category is None:
+            # The category clashed with an existing slug and was not created
+            continue
+        wanted[(category.id, title)] = {'url': row.get('url') or '',
+                                        'views': _int(row.get('views')) or 0}
+
+    if not wanted:
+        return 0
+
+    category_ids = {category_id for category_id, _ in wanted}
+    titles = {title for _, title in wanted}
+    existing = {}
+    for page in Page.objects.filter(category_id__in=category_ids, title__in=titles) \
+                            .only('id', 'category_id', 'title', 'url', 'views'):
+        existing.setdefault((page.category_id, page.title), page)
+
+    new, changed = [], []
+    now = timezone.now()
+    for (category_id, title), values in wanted.items():
+        page = existing.get((category_id, title))
+        if page is None:
+            new.append(Page(category_id=category_id, title=title, **values))
+        elif page.url != values['url'] or page.views != values['views']:
+            page.url = values['url']
+            page.views = values['views']
+            page.updated_at = now
+            changed.append(page)
+
+    if new:
+        Page.objects.bulk_create(new)
+    if changed:
+        Page.objects.bulk_update(changed, ['url', 'views', 'updated_at'])
+
+    return len(wanted)
+
+
+def import_rows(rows, batch_size=DEFAULT_BATCH_SIZE, on_batch=None):
+    """
+    Import an iterable of rows, batch_size rows per transaction. on_batch, if
+    given, is called with the number of rows done after each committed batch,
+    which is what makes an interrupted import resumable.
+    """
+    done = 0
+    category_ids = set()
+    try:
+        for batch in batches(rows, batch_size):
+            with transaction.atomic():
+                categories = _import_categories(batch)
+                _import_pages(batch, categories)
+                batch_ids = [category.id for category in categories.values()]
+                index_new(batch_ids)
+            category_ids.update(batch_ids)
+            done += len(batch)
+            if on_batch:
+                on_batch(done)
+    finally:
+        # Bulk writes bypass model signals: recount the committed batches' categories
+        # and invalidate the derived caches by hand
+        if done:
+            category_stats.repair(category_ids)
+            bump_generation('categories')
+            touch('catalog')
+            top_categories.invalidate()
+            top_pages.invalidate()
+            trending_categories.invalidate()
+
+    return done
@@ -0,0 +1,137 @@
+"""
+Top-N leaderboards for the index page.
+
+The index shows the most liked and the trending categories, and the most viewed
+pages. Instead of sorting the tables on every hit, each leaderboard is kept in
+the cache as a short list of rows and updated in place whenever a score changes. The list holds a few
+more rows than are displayed, so a row dropping out can be replaced without
+going back to the database. Only when the list can no longer be trusted (a row
+fell below the cut-off, or was deleted) is it rebuilt, using the indexed
+ORDER BY ... LIMIT query.
+
+Updates are a read-modify-write of the cached list, so they take a cache.add()
+lock, as asingle_flight does, and two processes updating at once cannot drop
+each other's rows. A rebuild may still race with an update; the list expires
+after LEADERBOARD_TIMEOUT, which bounds how long such a slip can last.
+"""
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+from rango.caching import LOCK_TIMEOUT
+from rango.models import Category, Page
+
+# Number of rows displayed, and number kept so a few can drop out safely
+TOP_N = 5
+KEEP_N = TOP_N * 3
+
+# How long a cached list lives before it is rebuilt from the database anyway
+LEADERBOARD_TIMEOUT = 10 * 60
+
+# How often an update waiting for the lock tries again (updates hold it briefly)
+LOCK_POLL = 0.002
+
+
+class Leaderboard:
+
+    def __init__(self, name, model, score_field, fields):
+        self.name = name
+        self.model = model
+        self.score_field = score_field
+        self.fields = ('id', score_field) + tuple(fields)
+        self.key = f'rango:leaderboard:{name}'
+        self.lock_key = f'{self.key}:lock'
+
+    def rebuild(self):
+        rows = list(self.model.objects.order_by(f'-{self.score_field}', 'id')
+                                      .values(*self.fields)[:KEEP_N])
+        cache.set(self.key, rows, LEADERBOARD_TIMEOUT)
+        return rows
+
+    def rows(self):
+        rows = cache.get(self.key)
+        if rows is None:
+            rows = self.rebuild()
+        return rows
+
+    def top(self, n=TOP_N):
+        return self.rows()[:n]
+
+    async def atop(self, n=TOP_N):
+        # top() for async views, using the async cache and ORM APIs
+        rows = await cache.aget(self.key)
+        if rows is None:
+            queryset = self.model.objects.order_by(f'-{self.score_field}', 'id').values(*self.fields)
+            rows = [row async for row in queryset[:KEEP_N]]
+            await cache.aset(self.key, rows, LEADERBOARD_TIMEOUT)
+        return rows[:n]
+
+    @contextmanager
+    def lock(self):
+        # Yields once this process holds the lock, or after LOCK_TIMEOUT if its
+        # holder never let go (it expires by then anyway)
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while not cache.add(self.lock_key, 1, timeout=LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(LOCK_POLL)
+        try:
+            yield
+        finally:
+            cache.delete(self.lock_key)
+
+    def invalidate(self):
+        # Under the lock, so an update in progress cannot write the old list back
+        with self.lock():
+            cache.delete(self.key)
+
+    def update(self, row):
+        # Offer a changed row (a dict with at least self.fields) to the leaderboard
+        with self.lock():
+            self._update(row)
+
+    def _update(self, row):
+        rows = cache.get(self.key)
+        if rows is None:
+            # Nothing cached yet, the next read will build it from the database
+            return
+
+        row = {field: row[field] for field in self.fields}
+        others = [r for r in rows if r['id'] != row['id']]
+        was_listed = len(others) != len(rows)
+        full = len(rows) >= KEEP_N
+
+        cutoff = rows[-1][self.score_field] if full else None
+        if full and row[self.score_field] < cutoff:
+            if was_listed:
+                # It dropped below rows we never fetched; start again from the index
+                cache.delete(self.key)
+            return
+
+        others.append(row)
+        others.sort(key=lambda r: (-r[self.score_field], r['id']))
+        cache.set(self.key, others[:KEEP_N], LEADERBOARD_TIMEOUT)
+
+    def remove(self, pk):
+        with self.lock():
+            rows = cache.get(self.key)
+            if rows is not None and any(r['id'] == pk for r in rows):
+                cache.delete(self.key)
+
+
+top_categories = Leaderboard('categories', Category, 'likes', ('name', 'slug'))
+top_pages = Leaderboard('pages', Page, 'views', ('title', 'url'))
+trending_categories = Leaderboard('trending', Category, 'trending_score', ('name', 'slug'))
+
+
+def pages_viewed(page_ids):
+    # Called after views were bumped with update(), which bypasses model signals
+    for row in Page.objects.filter(id__in=page_ids).values(*top_pages.fields):
+        top_pages.update(row)
+
+
+def categories_trending(category_ids):
+    # Called after trending scores were raised with update()
+    for row in Category.objects.filter(id__in=category_ids).values(*trending_categories.fields):
+        trending_categories.update(row)
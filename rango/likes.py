@@ -0,0 +1,49 @@
+"""
+Category likes.
+
+Whether a user has liked a category is recorded as a CategoryLike row, whose
+unique (user, category) constraint makes the check-and-set atomic: a second like
+fails the INSERT instead of being counted. The row and the count's
+UPDATE ... SET likes = likes + 1 commit in one transaction, so a crash can never
+leave a like recorded but not counted (or counted twice).
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from rango.caching import touch
+from rango.leaderboards import top_categories
+from rango.models import Category, CategoryLike
+from rango.suggest import category_index
+
+
+def likes_changed(rows):
+    # Refresh what is derived from the like counts (rows: dicts of top_categories.fields)
+    for row in rows:
+        top_categories.update(row)
+    category_index.likes_changed(rows)
+    touch('categories', *[f'category:{row["id"]}' for row in rows])
+
+
+def like_category(user, category_id):
+    """
+    Like a category on behalf of user. Returns (liked, likes): whether this call
+    added a like, and the category's like count; or None if there is no such
+    category.
+    """
+    try:
+        with transaction.atomic():
+            if not Category.objects.filter(id=category_id).update(likes=F('likes') + 1,
+                                                                  updated_at=timezone.now()):
+                return None
+            CategoryLike.objects.create(user=user, category_id=category_id)
+    except IntegrityError:
+        # Already liked: the count's UPDATE is rolled back with the INSERT
+        liked = False
+    else:
+        liked = True
+
+    row = Category.objects.filter(id=category_id).values(*top_categories.fields).first()
+    if liked:
+        likes_changed([row])
+    return liked, row['likes']
@@ -0,0 +1,166 @@
+"""
+Dead link checking for Page.url.
+
+LinkChecker is a small HTTP/1.1 client on asyncio streams that does just what
+a link check needs: a HEAD request (or a GET, for servers that refuse HEAD),
+following redirects, with the validators from the previous check sent along as
+If-None-Match / If-Modified-Since so an unchanged page can answer 304. At most
+`concurrency` requests are in flight overall and `per_host` to any one host, so
+a category full of links to one site does not hammer it, and each host's
+keep-alive connections are reused between checks.
+
+manage.py check_links feeds it pages oldest check first and writes the results
+back with bulk_update.
+"""
+import asyncio
+import ssl
+import time
+from collections import defaultdict, namedtuple
+from urllib.parse import urljoin, urlsplit
+
+USER_AGENT = 'Rango-LinkChecker/1.0'
+
+REDIRECTS = {301, 302, 303, 307, 308}
+
+# status is None when no response arrived; error then says why
+LinkResult = namedtuple('LinkResult', 'status latency etag last_modified error')
+
+
+class LinkError(Exception):
+    pass
+
+
+class LinkChecker:
+
+    def __init__(self, concurrency=100, per_host=4, timeout=10.0, max_redirects=5):
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self._slots = asyncio.Semaphore(concurrency)
+        self._host_slots = defaultdict(lambda: asyncio.Semaphore(per_host))
+        # (scheme, host, port) -> idle keep-alive connections as (reader, writer)
+        self._idle = defaultdict(list)
+        self._ssl = ssl.create_default_context()
+
+    async def check(self, url, etag='', last_modified=''):
+        """
+        Check one URL. A 304 means the page is unchanged since the check that
+        returned etag / last_modified, and those validators are kept.
+        """
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        start = time.perf_counter()
+        try:
+            for _ in range(self.max_redirects + 1):
+                status, response_headers = await asyncio.wait_for(
+                    self._request(url, 'HEAD', headers), self.timeout)
+                if status in (405, 501):
+                    # HEAD not allowed; the GET's body is never read
+                    status, response_headers = await asyncio.wait_for(
+                        self._request(url, 'GET', headers), self.timeout)
+                if status in REDIRECTS and 'location' in response_headers:
+                    url = urljoin(url, response_headers['location'])
+                    # The validators belong to the original URL
+                    headers = {}
+                    continue
+                break
+            else:
+                raise LinkError('too many redirects')
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                LinkError, UnicodeError, ValueError) as e:
+            return LinkResult(None, self._elapsed(start), etag, last_modified,
+                              str(e) or e.__class__.__name__)
+
+        if status == 304:
+            return LinkResult(status, self._elapsed(start), etag, last_modified, '')
+        return LinkResult(status, self._elapsed(start), response_headers.get('etag', ''),
+                          response_headers.get('last-modified', ''), '')
+
+    def _elapsed(self, start):
+        # Milliseconds
+        return round((time.perf_counter() - start) * 1000, 1)
+
+    async def _request(self, url, method, headers):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise LinkError(f'not an http(s) URL: {url[:100]}')
+        host = parts.hostname.encode('idna').decode('ascii')
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, host, port)
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        host_header = host if parts.port is None else f'{host}:{port}'
+
+        # The host's slot first: a busy host must not sit on overall slots while it waits
+        async with self._host_slots[host], self._slots:
+            for _ in range(2):
+                reused = bool(self._idle[key])
+                reader, writer = self._idle[key].pop() if reused else await self._connect(key)
+                try:
+                    status, response_headers, keep_alive = await self._exchange(
+                        reader, writer, method, host_header, path, headers)
+                except (OSError, LinkError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if reused:
+                        # The server had closed the idle connection; try a fresh one
+                        continue
+                    raise
+                except BaseException:
+                    # Timed out or cancelled half way through; the connection is unusable
+                    writer.close()
+                    raise
+
+                if method == 'HEAD' and keep_alive:
+                    self._idle[key].append((reader, writer))
+                else:
+                    writer.close()
+                return status, response_headers
+
+        raise LinkError('connection closed')
+
+    async def _connect(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            return await asyncio.open_connection(host, port, ssl=self._ssl, server_hostname=host)
+        return await asyncio.open_connection(host, port)
+
+    async def _exchange(self, reader, writer, method, host, path, headers):
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {host}', f'User-Agent: {USER_AGENT}', 'Accept: */*']
+        if method != 'HEAD':
+            # The body is not wanted, so the connection cannot be reused
+            lines.append('Connection: close')
+        lines.extend(f'{name}: {value}' for name, value in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise LinkError('connection closed')
+        try:
+            version, code = status_line.split()[:2]
+            status = int(code)
+        except ValueError:
+            raise LinkError(f'bad status line: {status_line[:100]!r}')
+
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        connection = response_headers.get('connection', '').lower()
+        if version == b'HTTP/1.1':
+            keep_alive = connection != 'close'
+        else:
+            keep_alive = connection == 'keep-alive'
+        return status, response_headers, keep_alive
+
+    async def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
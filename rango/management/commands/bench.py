@@ -0,0 +1,241 @@
+import itertools
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from rango import urls as rango_urls
+from rango.clicks import flush_clicks
+from rango.importer import import_rows
+from rango.models import Category, Page
+
+BENCH_PASSWORD = 'bench-password-123'
+
+
+class Command(BaseCommand):
+    help = ('Build a synthetic catalog in a throwaway database, drive every rango route '
+            'through the test client and report throughput, latency percentiles, query '
+            'counts and allocated memory per route as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--pages', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per route.')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Client threads issuing requests at once.')
+        parser.add_argument('--routes', nargs='*',
+                            help='Only benchmark these route names (default: all).')
+        parser.add_argument('--no-memory', action='store_true',
+                            help='Skip tracemalloc (it slows every request down).')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout.')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+
+        # Benchmark against a throwaway database, the same way the test runner does
+        # (on SQLite a temporary file, so several client threads can share it)
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        if connection.vendor == 'sqlite':
+            fd, test_settings['NAME'] = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(fd)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            cache.clear()
+            # The replica aliases still name the real database, so read from the throwaway one
+            # only; and every request comes from one address, so the login throttle is off
+            with override_settings(ALLOWED_HOSTS=['testserver'], RANGO_VISITS_STORE='cookie',
+                                   RANGO_READ_REPLICAS=[], RANGO_THROTTLE=False):
+                self.populate(options)
+                report = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def populate(self, options):
+        start = time.perf_counter()
+
+        num_categories = options['categories']
+        rows = [{'category': f'Category {c}', 'category_likes': self.random.randint(0, 1000)}
+                for c in range(num_categories)]
+        rows.extend({'category': f'Category {p % num_categories}', 'title': f'Page {p}',
+                     'url': f'http://example.com/{p}', 'views': self.random.randint(0, 10000)}
+                    for p in range(options['pages']))
+        import_rows(rows)
+
+        # Hash the shared password once rather than once per user
+        password = make_password(BENCH_PASSWORD)
+        User.objects.bulk_create(User(username=f'bench-user-{u}', password=password)
+                                 for u in range(options['users']))
+
+        self.users = list(User.objects.filter(username__startswith='bench-user-'))
+        # The catalog exports are for staff only
+        self.staff = User.objects.create(username='bench-staff', is_staff=True)
+        self.slugs = list(Category.objects.values_list('slug', flat=True))
+        self.page_ids = list(Page.objects.values_list('id', flat=True))
+        self.category_ids = list(Category.objects.values_list('id', flat=True))
+        self.populate_seconds = time.perf_counter() - start
+
+    def scenarios(self):
+        # Route name -> function(i) returning (method, url, data, user or None)
+        counter = itertools.count()
+        pick = self.random.choice
+
+        def category_url(name, i):
+            return reverse(name, kwargs={'category_name_slug': pick(self.slugs)})
+
+        return {
+            'index': lambda i: ('get', reverse('rango:index'), None, None),
+            'about': lambda i: ('get', reverse('rango:about'), None, None),
+            'show_category': lambda i: ('get', category_url('rango:show_category', i), None, None),
+            'category_pages': lambda i: ('get', category_url('rango:category_pages', i),
+                                         {'after': '5000.0'}, None),
+            'add_category': lambda i: ('post', reverse('rango:add_category'),
+                                       {'name': f'Bench category {next(counter)}',
+                                        'views': 0, 'likes': 0}, pick(self.users)),
+            'add_page': lambda i: ('post', category_url('rango:add_page', i),
+                                   {'title': f'Bench page {next(counter)}',
+                                    'url': 'http://example.com/', 'views': 0}, pick(self.users)),
+            'register': lambda i: ('post', reverse('rango:register'),
+                                   {'username': f'bench-new-{next(counter)}',
+                                    'email': 'bench@example.com',
+                                    'password': BENCH_PASSWORD, 'website': ''}, None),
+            'login': lambda i: ('post', reverse('rango:login'),
+                                {'username': pick(self.users).username,
+                                 'password': BENCH_PASSWORD}, None),
+            'logout': lambda i: ('get', reverse('rango:logout'), None, pick(self.users)),
+            'restricted': lambda i: ('get', reverse('rango:restricted'), None, pick(self.users)),
+            'search': lambda i: ('get', reverse('rango:search'),
+                                 {'q': f'page {self.random.randint(0, 99)}'}, None),
+            'api_categories': lambda i: ('get', reverse('rango:api_categories'), None, None),
+            'api_category_pages': lambda i: ('get', category_url('rango:api_category_pages', i), None, None),
+            'suggest': lambda i: ('get', reverse('rango:suggest'),
+                                  {'prefix': f'category {self.random.randint(0, 9)}'}, None),
+            'like_category': lambda i: ('post', reverse('rango:like_category'),
+                                        {'category_id': pick(self.category_ids)}, pick(self.users)),
+            'export_csv': lambda i: ('get', reverse('rango:export_csv'), None, self.staff),
+            'export_jsonl': lambda i: ('get', reverse('rango:export_jsonl'), {'gzip': '1'}, self.staff),
+            'goto': lambda i: ('get', reverse('rango:goto', kwargs={'page_id': pick(self.page_ids)}),
+                               None, None),
+        }
+
+    def run(self, options):
+        scenarios = self.scenarios()
+        route_names = [pattern.name for pattern in rango_urls.urlpatterns]
+
+        missing = set(route_names) - set(scenarios)
+        if missing:
+            self.stderr.write(f'No benchmark scenario for: {", ".join(sorted(missing))}')
+
+        selected = options['routes'] or route_names
+        routes = {}
+        for name in selected:
+            if name in scenarios:
+                routes[name] = self.bench_route(name, scenarios[name], options)
+
+        flush_clicks()
+        return {
+            'dataset': {'categories': options['categories'], 'pages': options['pages'],
+                        'users': options['users'], 'build_seconds': round(self.populate_seconds, 3)},
+            'requests_per_route': options['requests'],
+            'concurrency': options['concurrency'],
+            'routes': routes,
+        }
+
+    def bench_route(self, name, scenario, options):
+        local = threading.local()
+        lock = threading.Lock()
+        latencies, queries, statuses = [], [], {}
+        template_seconds = {}
+
+        def one_request(i):
+            method, url, data, user = scenario(i)
+            if user is None:
+                if not hasattr(local, 'client'):
+                    local.client = Client()
+                client = local.client
+            else:
+                # A logged-in client per user and thread (logout needs a fresh login)
+                clients = local.__dict__.setdefault('auth_clients', {})
+                client = clients.get(user.id)
+                if client is None or name == 'logout':
+                    client = clients[user.id] = Client()
+                    client.force_login(user)
+
+            start = time.perf_counter()
+            response = getattr(client, method)(url, data or {})
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - start
+
+            stats = getattr(response.wsgi_request, 'query_stats', None)
+            timings = getattr(response.wsgi_request, 'template_timings', None)
+            with lock:
+                if timings is not None:
+                    for template, (_, _, own) in timings.templates.items():
+                        template_seconds[template] = template_seconds.get(template, 0.0) + own
+                latencies.append(elapsed)
+                queries.append(stats.count if stats else 0)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        track_memory = not options['no_memory']
+        if track_memory:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            list(pool.map(one_request, range(options['requests'])))
+        wall = time.perf_counter() - start
+
+        result = {
+            'requests_per_second': round(len(latencies) / wall, 1),
+            'latency_ms': self.percentiles(latencies),
+            'queries_per_request': {'mean': round(statistics.mean(queries), 2), 'max': max(queries)},
+            'status_codes': {str(code): n for code, n in sorted(statuses.items())},
+            # Mean time per request spent in each template itself (nested templates excluded)
+            'template_ms': {template: round(seconds / len(latencies) * 1000, 3)
+                            for template, seconds in sorted(template_seconds.items(),
+                                                            key=lambda item: -item[1])},
+        }
+        if track_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result['memory_kb'] = {'retained': round((current - baseline) / 1024, 1),
+                                   'peak': round((peak - baseline) / 1024, 1)}
+
+        self.stderr.write(f'{name:16} {result["requests_per_second"]:>8} req/s  '
+                          f'p95 {result["latency_ms"]["p95"]} ms')
+        return result
+
+    def percentiles(self, latencies):
+        ordered = sorted(latencies)
+
+        def at(fraction):
+            return round(ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] * 1000, 3)
+
+        return {'p50': at(0.50), 'p95': at(0.95), 'p99': at(0.99),
+                'mean': round(statistics.mean(ordered) * 1000, 3)}
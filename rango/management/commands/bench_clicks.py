@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from rango.clicks import ClickBuffer
+from rango.models import Category, Page
+
+
+class Command(BaseCommand):
+    help = 'Compare one UPDATE per click against the buffered click flush.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clicks', type=int, default=10000,
+                            help='Number of clicks to simulate.')
+        parser.add_argument('--pages', type=int, default=20,
+                            help='Number of pages the clicks are spread across.')
+
+    def handle(self, *args, **options):
+        clicks = options['clicks']
+        num_pages = options['pages']
+
+        # Everything happens inside a transaction that is rolled back at the end,
+        # so the benchmark never leaves rows behind.
+        with transaction.atomic():
+            category = Category.objects.create(name='__bench_clicks__')
+            Page.objects.bulk_create(
+                Page(category=category, title=f'bench {i}', url='http://example.com/')
+                for i in range(num_pages))
+            page_ids = list(Page.objects.filter(category=category).values_list('id', flat=True))
+
+            # The click stream: a hot link plus a long tail
+            stream = [page_ids[0] if i % 2 else page_ids[i % num_pages] for i in range(clicks)]
+
+            # One UPDATE per click
+            start = time.perf_counter()
+            for page_id in stream:
+                Page.objects.filter(id=page_id).update(views=F('views') + 1)
+            per_click = time.perf_counter() - start
+
+            # Buffered clicks, flushed once at the end
+            buffer = ClickBuffer(flush_interval=float('inf'), flush_threshold=float('inf'))
+            start = time.perf_counter()
+            for page_id in stream:
+                buffer.record(page_id)
+            buffer.flush()
+            buffered = time.perf_counter() - start
+
+            # Both passes should have counted every click
+            total = sum(Page.objects.filter(category=category).values_list('views', flat=True))
+            assert total == 2 * clicks, total
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'{clicks} clicks over {num_pages} pages')
+        self.stdout.write(f'  per-click UPDATE: {per_click:.3f}s ({clicks / per_click:,.0f} clicks/s)')
+        self.stdout.write(f'  buffered flush:   {buffered:.3f}s ({clicks / buffered:,.0f} clicks/s)')
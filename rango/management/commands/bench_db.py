@@ -0,0 +1,131 @@
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+
+from rango.importer import import_rows
+from rango.models import Category, Page
+from rango.pagination import page_values
+
+
+class Command(BaseCommand):
+    help = ('Run a mixed read/write workload (category listings and new pages) from several '
+            'threads against a throwaway SQLite database, once per journal mode, and report '
+            'throughput and latency for each as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='*', default=['DELETE', 'WAL'],
+                            help='SQLite journal modes to compare (DELETE is the rollback journal).')
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--pages', type=int, default=2000)
+        parser.add_argument('--operations', type=int, default=2000,
+                            help='Operations per journal mode, shared between the threads.')
+        parser.add_argument('--write-ratio', type=float, default=0.2)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('bench_db compares SQLite journal modes; the default database is '
+                               f'{connection.vendor}.')
+
+        report = {'operations': options['operations'], 'write_ratio': options['write_ratio'],
+                  'threads': options['threads'], 'modes': {}}
+        for mode in options['modes']:
+            # Replica aliases name the real database, so keep every read on the throwaway one
+            with override_settings(RANGO_SQLITE_JOURNAL_MODE=mode, RANGO_READ_REPLICAS=[]):
+                report['modes'][mode.lower()] = result = self.bench_mode(options)
+            self.stderr.write(f'{mode:8} {result["operations_per_second"]:>8} ops/s  '
+                              f'{result["errors"]} errors')
+
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def bench_mode(self, options):
+        # A fresh database file per mode, since the journal mode is stored in the file
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        fd, test_settings['NAME'] = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            cache.clear()
+            self.populate(options)
+            # Reconnect, so this connection also gets the journal mode under test
+            connection.close()
+            return self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def populate(self, options):
+        rng = random.Random(options['seed'])
+        num_categories = options['categories']
+        rows = [{'category': f'Category {c}'} for c in range(num_categories)]
+        rows.extend({'category': f'Category {p % num_categories}', 'title': f'Page {p}',
+                     'url': f'http://example.com/{p}', 'views': rng.randint(0, 10000)}
+                    for p in range(options['pages']))
+        import_rows(rows)
+        self.category_ids = list(Category.objects.values_list('id', flat=True))
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        plan = [(rng.random() < options['write_ratio'], rng.choice(self.category_ids))
+                for _ in range(options['operations'])]
+
+        lock = threading.Lock()
+        latencies = {'read': [], 'write': []}
+        errors = []
+
+        def operation(write, category_id):
+            start = time.perf_counter()
+            try:
+                if write:
+                    Page.objects.create(category_id=category_id, title='Bench page',
+                                        url='http://example.com/bench')
+                else:
+                    page_values(category_id, None, 20)
+            except OperationalError as e:
+                # e.g. "database is locked" once the busy timeout runs out
+                with lock:
+                    errors.append(str(e))
+                return
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies['write' if write else 'read'].append(elapsed)
+
+        def worker(steps):
+            try:
+                for write, category_id in steps:
+                    operation(write, category_id)
+            finally:
+                # Each worker thread opened its own connection
+                connection.close()
+
+        threads = options['threads']
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(worker, [plan[i::threads] for i in range(threads)]))
+        wall = time.perf_counter() - start
+
+        done = len(latencies['read']) + len(latencies['write'])
+        result = {'operations_per_second': round(done / wall, 1), 'errors': len(errors)}
+        for kind, values in latencies.items():
+            if values:
+                result[kind] = self.percentiles(values)
+        return result
+
+    def percentiles(self, latencies):
+        ordered = sorted(latencies)
+
+        def at(fraction):
+            return round(ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] * 1000, 3)
+
+        return {'count': len(ordered), 'p50': at(0.50), 'p95': at(0.95), 'p99': at(0.99),
+                'mean': round(statistics.mean(ordered) * 1000, 3)}
@@ -0,0 +1,70 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+
+class LegacyVisitMiddleware:
+    # What the old visitor_cookie_handler did: assign the session keys on every request
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.session['visits'] = request.session.get('visits', 1)
+        request.session['last_visit'] = str(time.time())
+        return self.get_response(request)
+
+
+class SessionWriteCounter:
+
+    def __init__(self):
+        self.writes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.startswith(('INSERT', 'UPDATE')) and 'django_session' in sql:
+            self.writes += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Count session-table writes per request for each way of tracking visits.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests to the index page per visitor.')
+
+    def measure(self, requests, **overrides):
+        counter = SessionWriteCounter()
+        with override_settings(ALLOWED_HOSTS=['testserver'], **overrides):
+            client = Client()
+            url = reverse('rango:index')
+            start = time.perf_counter()
+            with connection.execute_wrapper(counter):
+                for _ in range(requests):
+                    client.get(url)
+            elapsed = time.perf_counter() - start
+        return counter.writes, elapsed
+
+    def handle(self, *args, **options):
+        requests = options['requests']
+        legacy = list(settings.MIDDLEWARE)
+        legacy[legacy.index('rango.middleware.VisitorMiddleware')] = \
+            f'{__name__}.LegacyVisitMiddleware'
+
+        runs = [
+            ('legacy (write every request)', {'MIDDLEWARE': legacy}),
+            ('session, day rollover only', {'RANGO_VISITS_STORE': 'session'}),
+            ('signed cookie', {'RANGO_VISITS_STORE': 'cookie'}),
+        ]
+
+        # Roll everything back so the benchmark leaves no sessions behind
+        with transaction.atomic():
+            for label, overrides in runs:
+                writes, elapsed = self.measure(requests, **overrides)
+                self.stdout.write(f'{label:30} {writes / requests:.3f} session writes/request, '
+                                  f'{requests / elapsed:,.0f} requests/s')
+            transaction.set_rollback(True)
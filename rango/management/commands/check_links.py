@@ -0,0 +1,122 @@
+import asyncio
+from collections import defaultdict, deque
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from django.utils import timezone
+
+from rango.linkcheck import LinkChecker
+from rango.models import Page
+
+# Pages read ahead of the checks, per unit of concurrency
+BACKLOG = 10
+
+RESULT_FIELDS = ['link_status', 'link_error', 'link_latency', 'link_etag',
+                 'link_last_modified', 'link_checked']
+
+
+class Command(BaseCommand):
+    help = ('Check every Page.url over HTTP, oldest check first, and record the status, '
+            'latency and validators on each page.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=200,
+                            help='Requests in flight at once, across all hosts.')
+        parser.add_argument('--per-host', type=int, default=4,
+                            help='Requests in flight at once to any one host.')
+        parser.add_argument('--timeout', type=float, default=10.0,
+                            help='Seconds allowed per request.')
+        parser.add_argument('--older-than', type=float, default=0,
+                            help='Only check pages not checked in this many hours.')
+        parser.add_argument('--limit', type=int, help='Check at most this many pages.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Pages written back per bulk update.')
+
+    def handle(self, *args, **options):
+        # async_to_sync rather than asyncio.run, so the ORM calls made through
+        # sync_to_async run on this thread (and its database connection)
+        checked, dead = async_to_sync(self.check_pages)(options)
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} links, {dead} dead.'))
+
+    def pages(self, options):
+        pages = Page.objects.only('id', 'url', 'link_status', 'link_etag', 'link_last_modified') \
+                            .order_by(F('link_checked').asc(nulls_first=True), 'id')
+        if options['older_than']:
+            cutoff = timezone.now() - timedelta(hours=options['older_than'])
+            pages = pages.filter(Q(link_checked__isnull=True) | Q(link_checked__lt=cutoff))
+        if options['limit']:
+            pages = pages[:options['limit']]
+        return pages
+
+    async def check_pages(self, options):
+        checker = LinkChecker(concurrency=options['concurrency'], per_host=options['per_host'],
+                              timeout=options['timeout'])
+        # Pages are queued per host and each host gets at most per_host workers, so a
+        # long run of links to one site never ties up the slots the others could use.
+        # Up to BACKLOG pages are read ahead to find those other hosts' links.
+        queues = {}
+        workers = defaultdict(int)
+        read_ahead = asyncio.Semaphore(options['concurrency'] * BACKLOG)
+        tasks = set()
+        done = []
+        counts = {'checked': 0, 'dead': 0}
+
+        async def save():
+            batch = done[:]
+            del done[:]
+            if batch:
+                await Page.objects.abulk_update(batch, RESULT_FIELDS, batch_size=options['batch_size'])
+
+        async def check(page):
+            result = await checker.check(page.url, page.link_etag, page.link_last_modified)
+            if result.status != 304:
+                # (304: unchanged since the last check, whose status still holds)
+                page.link_status = result.status
+            page.link_error = result.error[:200]
+            page.link_latency = result.latency
+            page.link_etag = result.etag[:200]
+            page.link_last_modified = result.last_modified[:64]
+            page.link_checked = timezone.now()
+
+            counts['checked'] += 1
+            if page.link_status is None or page.link_status >= 400:
+                counts['dead'] += 1
+            done.append(page)
+            if len(done) >= options['batch_size']:
+                await save()
+
+        async def worker(host):
+            queue = queues[host]
+            while queue:
+                page = queue.popleft()
+                try:
+                    await check(page)
+                finally:
+                    read_ahead.release()
+            # No await since the queue was found empty, so nothing was added meanwhile
+            workers[host] -= 1
+            if not workers[host]:
+                del queues[host], workers[host]
+
+        try:
+            async for page in self.pages(options).aiterator(chunk_size=2000):
+                await read_ahead.acquire()
+                host = urlsplit(page.url).hostname or ''
+                queues.setdefault(host, deque()).append(page)
+                if workers[host] < options['per_host']:
+                    workers[host] += 1
+                    task = asyncio.create_task(worker(host))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await save()
+            await checker.close()
+
+        return counts['checked'], counts['dead']
@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rango.export import CHUNK_SIZE, FORMATS, export
+
+
+class Command(BaseCommand):
+    help = ('Stream every category and page to a CSV or JSONL file in the format '
+            'import_catalog reads, optionally gzipped. Use - to write to stdout.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to write, e.g. catalog.csv or catalog.jsonl.gz.')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Output format (defaults to the file extension).')
+        parser.add_argument('--gzip', action='store_true',
+                            help='Compress the output (implied by a .gz extension).')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Rows fetched from the database at a time.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        name, ext = os.path.splitext(path)
+        compress = options['gzip'] or ext.lower() == '.gz'
+        if ext.lower() == '.gz':
+            ext = os.path.splitext(name)[1]
+        fmt = options['format'] or ext.lstrip('.').lower()
+        if fmt not in FORMATS:
+            raise CommandError(f'Cannot tell the format of {path}, pass --format.')
+
+        start = time.perf_counter()
+        written = 0
+        chunks = export(fmt, compress, options['chunk_size'])
+        if path == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+                written += len(chunk)
+            sys.stdout.buffer.flush()
+            return
+
+        with open(path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                written += len(chunk)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {written:,} bytes to {path} in {elapsed:.1f}s.'))
@@ -0,0 +1,55 @@
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rango.importer import DEFAULT_BATCH_SIZE, import_rows, read_csv, read_jsonl
+
+
+class Command(BaseCommand):
+    help = ('Stream a CSV or JSONL catalog of categories and pages into the database. '
+            'Columns/keys: category, category_views, category_likes, title, url, views.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file to import.')
+        parser.add_argument('--format', choices=('csv', 'jsonl'),
+                            help='Input format (defaults to the file extension).')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Rows written per transaction.')
+        parser.add_argument('--resume', action='store_true',
+                            help='Skip the rows committed by a previous, interrupted run.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if fmt not in ('csv', 'jsonl'):
+            raise CommandError(f'Cannot tell the format of {path}, pass --format.')
+
+        # The checkpoint file holds the number of rows committed so far
+        checkpoint = f'{path}.checkpoint'
+        skip = 0
+        if options['resume'] and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                skip = int(f.read().strip() or 0)
+            self.stdout.write(f'Resuming after row {skip}.')
+
+        start = time.perf_counter()
+
+        def on_batch(done):
+            with open(checkpoint, 'w') as f:
+                f.write(str(skip + done))
+            rate = done / (time.perf_counter() - start)
+            self.stdout.write(f'{skip + done} rows ({rate:,.0f} rows/s)')
+
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = read_csv(f) if fmt == 'csv' else read_jsonl(f)
+            done = import_rows(islice(rows, skip, None), options['batch_size'], on_batch)
+
+        # Finished cleanly, so there is nothing to resume
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {done} rows in {elapsed:.1f}s ({done / max(elapsed, 1e-9):,.0f} rows/s).'))
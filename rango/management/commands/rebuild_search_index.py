@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from rango.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from the Category and Page tables.'
+
+    def handle(self, *args, **options):
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt.'))
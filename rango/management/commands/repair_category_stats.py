@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rango import category_stats
+from rango.caching import touch
+from rango.leaderboards import trending_categories
+
+
+class Command(BaseCommand):
+    help = "Recompute every category's page count and total views from its pages."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset-trending', action='store_true',
+                            help='Also reset trending scores, as if every view had happened now.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            repaired = category_stats.repair(reset_trending=options['reset_trending'])
+
+        # update() bypasses model signals
+        touch('catalog')
+        trending_categories.invalidate()
+        self.stdout.write(self.style.SUCCESS(f'Repaired {repaired} categories.'))
@@ -0,0 +1,307 @@
+"""
+Request latency metrics.
+
+MetricsMiddleware times every request and splits the time into phases: SQL
+(db), template rendering (tpl), session and cache calls (cache) and the rest
+(app). Each phase counts only its own time, so the SQL run while a template
+renders, or while the session loads from the database, is db time, not tpl or
+cache time, and the phases add up to the total. They are sent back in a
+Server-Timing header and added to a per-route latency histogram.
+
+Nothing is patched at runtime: SQL is timed by an execute wrapper on every
+connection (see rango.signals), templates by the loader in settings.TEMPLATES
+(see rango.templating), and cache and session calls by the timed backends
+settings.CACHES and SESSION_ENGINE name (LocMemCache here, rango.sessions).
+
+The histograms are kept per thread: a request only ever updates its own
+thread's counters, with no lock. When a thread ends (under ASGI, each request
+may get a thread of its own) its counters are folded into a shared total, so
+the number of shards stays at the number of live threads. /metrics adds them
+together and returns them in the Prometheus text format. Counters are per process, as
+with any Prometheus client running under several workers.
+"""
+import contextvars
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache.backends import locmem, redis
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+
+from rango.hybrid import HybridMiddleware
+
+# Upper bounds of the latency histogram buckets, in seconds (+Inf is implied)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PHASES = ('db', 'tpl', 'cache', 'app')
+
+# Who may scrape /metrics unless RANGO_METRICS_ALLOWED_IPS says otherwise
+LOOPBACK = ('127.0.0.1', '::1')
+
+# Cache and session methods timed as the cache phase (see timed_class)
+CACHE_METHODS = ('get', 'set', 'add', 'delete', 'get_many', 'set_many', 'delete_many',
+                 'incr', 'decr', 'touch', 'has_key', 'clear')
+SESSION_METHODS = ('load', 'save', 'exists', 'delete')
+
+_phases = contextvars.ContextVar('rango_phases', default=None)
+
+
+class Phases:
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        # Time spent in nested phases, for each phase in progress
+        self._children = []
+
+    def start(self):
+        self._children.append(0.0)
+
+    def stop(self, phase, elapsed):
+        children = self._children.pop()
+        if self._children:
+            self._children[-1] += elapsed
+        self.seconds[phase] += elapsed - children
+
+    def finish(self, total):
+        # Whatever the timed phases do not account for is the view's own code
+        self.seconds['app'] = max(total - sum(self.seconds[phase] for phase in PHASES[:-1]), 0.0)
+
+
+def timed(phase, func, *args, **kwargs):
+    # Call func, counting its time towards phase if the current request is being timed
+    phases = _phases.get()
+    if phases is None:
+        return func(*args, **kwargs)
+    phases.start()
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        phases.stop(phase, time.perf_counter() - start)
+
+
+def time_sql(execute, sql, params, many, context):
+    # Execute wrapper on every connection (see rango.signals)
+    return timed('db', execute, sql, params, many, context)
+
+
+def _timed_method(method, phase):
+    @wraps(method)
+    def timed_method(*args, **kwargs):
+        return timed(phase, method, *args, **kwargs)
+    return timed_method
+
+
+def timed_class(base, methods, phase):
+    """
+    A subclass of base whose given methods count as phase, e.g. a cache backend
+    timed as the cache phase. Calls into further timed methods count once.
+    """
+    namespace = {name: _timed_method(getattr(base, name), phase) for name in methods}
+    namespace['__module__'] = __name__
+    return type(base.__name__, (base,), namespace)
+
+
+# Timed cache backends, for CACHES in settings; timed_class() makes one for any other
+LocMemCache = timed_class(locmem.LocMemCache, CACHE_METHODS, 'cache')
+RedisCache = timed_class(redis.RedisCache, CACHE_METHODS, 'cache')
+
+
+class RouteStats:
+
+    __slots__ = ('buckets', 'count', 'sum', 'phases', 'statuses')
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        # status class ('2xx' etc.) -> responses
+        self.statuses = {}
+
+
+class _Shard:
+    # One thread's counters; when the thread ends and drops it, they are folded
+    # into the registry's total (see Registry._retire)
+
+    __slots__ = ('routes', '__weakref__')
+
+    def __init__(self):
+        self.routes = {}
+
+
+def _add(total, stats):
+    # Add one RouteStats into another
+    total.buckets = [a + b for a, b in zip(total.buckets, stats.buckets)]
+    total.count += stats.count
+    total.sum += stats.sum
+    for phase, seconds in list(stats.phases.items()):
+        total.phases[phase] += seconds
+    for status_class, n in list(stats.statuses.items()):
+        total.statuses[status_class] = total.statuses.get(status_class, 0) + n
+
+
+class Registry:
+
+    def __init__(self):
+        self._local = threading.local()
+        # The live threads' {route: RouteStats}, by shard id; only changed under the lock
+        self._live = {}
+        # Everything counted by threads that have since ended
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard.routes
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._live[id(shard)] = shard.routes
+            # Runs once the thread has ended and its locals are gone
+            weakref.finalize(shard, self._retire, id(shard))
+            return shard.routes
+
+    def _retire(self, key):
+        with self._lock:
+            routes = self._live.pop(key, None)
+            if routes:
+                self._merge(self._retired, routes)
+
+    def _merge(self, merged, routes):
+        for route, stats in list(routes.items()):
+            total = merged.get(route)
+            if total is None:
+                total = merged[route] = RouteStats()
+            _add(total, stats)
+
+    def observe(self, route, status, total, phases):
+        routes = self._shard()
+        stats = routes.get(route)
+        if stats is None:
+            stats = routes[route] = RouteStats()
+        stats.buckets[bisect_left(BUCKETS, total)] += 1
+        stats.count += 1
+        stats.sum += total
+        for phase, seconds in phases.items():
+            stats.phases[phase] += seconds
+        status_class = f'{status // 100}xx'
+        stats.statuses[status_class] = stats.statuses.get(status_class, 0) + 1
+
+    def collect(self):
+        # All threads' counters, live and ended, added up by route
+        merged = {}
+        with self._lock:
+            self._merge(merged, self._retired)
+            shards = list(self._live.values())
+        for routes in shards:
+            self._merge(merged, routes)
+        return merged
+
+    @property
+    def shards(self):
+        # How many threads currently hold counters of their own
+        return len(self._live)
+
+    def reset(self):
+        with self._lock:
+            self._retired.clear()
+            for routes in self._live.values():
+                routes.clear()
+
+    def exposition(self):
+        """The counters in the Prometheus text exposition format."""
+        merged = sorted(self.collect().items())
+        lines = [
+            '# HELP rango_request_duration_seconds Time to handle a request, by route.',
+            '# TYPE rango_request_duration_seconds histogram',
+        ]
+        for route, stats in merged:
+            label = _label(route)
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ('+Inf',), stats.buckets):
+                cumulative += n
+                lines.append(f'rango_request_duration_seconds_bucket{{route="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'rango_request_duration_seconds_sum{{route="{label}"}} {stats.sum:.6f}')
+            lines.append(f'rango_request_duration_seconds_count{{route="{label}"}} {stats.count}')
+
+        lines += [
+            '# HELP rango_request_phase_seconds_total Time spent in each phase of handling requests, by route.',
+            '# TYPE rango_request_phase_seconds_total counter',
+        ]
+        for route, stats in merged:
+            for phase in PHASES:
+                lines.append(f'rango_request_phase_seconds_total{{route="{_label(route)}",phase="{phase}"}} '
+                             f'{stats.phases[phase]:.6f}')
+
+        lines += [
+            '# HELP rango_responses_total Responses sent, by route and status class.',
+            '# TYPE rango_responses_total counter',
+        ]
+        for route, stats in merged:
+            for status_class, n in sorted(stats.statuses.items()):
+                lines.append(f'rango_responses_total{{route="{_label(route)}",status="{status_class}"}} {n}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# The counters of every request handled in this process
+registry = Registry()
+
+
+def route_name(request):
+    # The URL pattern's name rather than the path, so the number of series stays fixed
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """
+    Records the latency of every request in the per-route histograms and, with
+    RANGO_SERVER_TIMING, sends the breakdown by phase as a Server-Timing header.
+    Goes first in MIDDLEWARE, so the total covers all the other middleware.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'RANGO_METRICS', True):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.server_timing = getattr(settings, 'RANGO_SERVER_TIMING', True)
+
+    def before(self, request):
+        phases = Phases()
+        return phases, _phases.set(phases), time.perf_counter()
+
+    def after(self, state):
+        _phases.reset(state[1])
+
+    def finish(self, request, response, state):
+        phases, _, start = state
+        total = time.perf_counter() - start
+        phases.finish(total)
+
+        registry.observe(route_name(request), response.status_code, total, phases.seconds)
+
+        if self.server_timing:
+            timings = [f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in phases.seconds.items()]
+            timings.append(f'total;dur={total * 1000:.2f}')
+            response['Server-Timing'] = ', '.join(timings)
+        return response
+
+
+def metrics_view(request):
+    # Prometheus scrape target, for RANGO_METRICS_ALLOWED_IPS (None lets anyone)
+    allowed = getattr(settings, 'RANGO_METRICS_ALLOWED_IPS', LOOPBACK)
+    if allowed is not None and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponse(status=403)
+    return HttpResponse(registry.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
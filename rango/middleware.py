@@ -0,0 +1,248 @@
+import contextvars
+import logging
+import re
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+
+from rango import routers, templating
+from rango.hybrid import HybridMiddleware
+
+logger = logging.getLogger('rango.queries')
+
+# A query shape seen this many times in one request is reported as a likely N+1
+REPEAT_THRESHOLD = getattr(settings, 'RANGO_QUERY_REPEAT_THRESHOLD', 3)
+
+# Literals are stripped from the SQL so queries differing only in parameters compare equal
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+\b')
+_IN_LIST_RE = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+
+
+def query_shape(sql):
+    shape = _STRING_RE.sub('?', sql)
+    shape = _NUMBER_RE.sub('?', shape)
+    return _IN_LIST_RE.sub('(...)', shape)
+
+
+_query_stats = contextvars.ContextVar('rango_query_stats', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    # Execute wrapper on every connection (see rango.signals): counts the query
+    # towards the request in progress, whichever thread it runs on
+    stats = _query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def query_budget(max_queries):
+    # Declare the most queries a view may issue; checked by QueryBudgetMiddleware
+    def decorator(view_func):
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+class QueryStats:
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self.budget = None
+        self.view_name = None
+
+    def __call__(self, execute, sql, params, many, context):
+        # Time a query run during the request (see count_query)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.shapes[query_shape(sql)] += 1
+
+    @property
+    def repeated(self):
+        # Query shapes run often enough to look like an N+1 pattern
+        return {shape: n for shape, n in self.shapes.items() if n >= REPEAT_THRESHOLD}
+
+    @property
+    def over_budget(self):
+        return self.budget is not None and self.count > self.budget
+
+
+class QueryBudgetMiddleware(HybridMiddleware):
+    """
+    Records the number of SQL queries and the total SQL time of every request,
+    on the primary and the read replicas alike, and reports views that go over
+    their declared query_budget or repeat the same query shape (N+1). The stats
+    are left on request.query_stats so tests can assert on them.
+    """
+
+    def before(self, request):
+        request.query_stats = QueryStats()
+        return _query_stats.set(request.query_stats)
+
+    def after(self, token):
+        _query_stats.reset(token)
+
+    def finish(self, request, response, token):
+        stats = request.query_stats
+        # The view as resolved (the URLconf's callable, which carries query_budget)
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            stats.view_name = getattr(match.func, '__name__', repr(match.func))
+            stats.budget = getattr(match.func, 'query_budget', None)
+
+        if stats.over_budget:
+            logger.warning('%s ran %d queries, over its budget of %d',
+                           stats.view_name, stats.count, stats.budget)
+        for shape, n in stats.repeated.items():
+            logger.warning('%s repeated a query %d times (possible N+1): %s',
+                           stats.view_name, n, shape)
+
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(stats.count)
+            response['X-Query-Time'] = f'{stats.duration * 1000:.2f}ms'
+
+        return response
+
+
+class TemplateTimingMiddleware(HybridMiddleware):
+    """
+    Times every template rendered for a request, nested ones included (see
+    rango.templating), and leaves the timings on request.template_timings. With
+    DEBUG the total is sent as an X-Template-Time header and the per-template
+    breakdown is logged to rango.templates.
+    """
+
+    def before(self, request):
+        request.template_timings, token = templating.collect()
+        return token
+
+    def after(self, token):
+        templating.stop_collecting(token)
+
+    def finish(self, request, response, token):
+        timings = request.template_timings
+        if settings.DEBUG and timings.templates:
+            response['X-Template-Time'] = f'{timings.total * 1000:.2f}ms'
+            templating.logger.debug('%s %s', request.path, timings.as_dict())
+
+        return response
+
+
+class ReplicaPinMiddleware(HybridMiddleware):
+    """
+    Pins a client to the primary database after it writes (see rango.routers).
+    Any unsafe request (POST etc.) reads from the primary, and leaves a short
+    lived cookie so the client's next requests do too, until the replicas have
+    had time to catch up.
+    """
+
+    COOKIE = 'rango_primary'
+
+    @staticmethod
+    def writing(request):
+        return request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def before(self, request):
+        if routers.replicas() and (self.writing(request) or self.COOKIE in request.COOKIES):
+            return routers.pin_to_primary()
+        return None
+
+    def after(self, token):
+        if token is not None:
+            routers.unpin(token)
+
+    def finish(self, request, response, token):
+        if routers.replicas() and self.writing(request):
+            response.set_cookie(self.COOKIE, '1', httponly=True, samesite='Lax',
+                                max_age=getattr(settings, 'RANGO_REPLICA_PIN_SECONDS', 5))
+        return response
+
+
+def track_visits(view_func):
+    # Mark a view whose requests VisitorMiddleware should count
+    view_func.track_visits = True
+    return view_func
+
+
+class VisitorMiddleware(HybridMiddleware):
+    """
+    Counts the number of days a visitor has come to the site, as request.visits,
+    on views marked with @track_visits.
+
+    The record is two integers, the visit count and the epoch second of the last
+    counted visit, and it is only written back when a day has passed since that
+    visit (or on the very first one). Every other request leaves the session
+    untouched, so it is not saved. With RANGO_VISITS_STORE = 'cookie' the record
+    lives in a signed cookie instead, and anonymous traffic never touches the
+    session table at all.
+    """
+
+    COOKIE_NAME = 'rango_visits'
+    SESSION_KEY = 'rango_visits'
+    DAY = 24 * 60 * 60
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.use_cookie = getattr(settings, 'RANGO_VISITS_STORE', 'session') == 'cookie'
+        if iscoroutinefunction(self):
+            # Only requests for tracked views go to a thread (the session may load from the database)
+            self.process_view = self.aprocess_view
+
+    def read(self, request):
+        if self.use_cookie:
+            value = request.get_signed_cookie(self.COOKIE_NAME, default=None, salt=self.COOKIE_NAME)
+            try:
+                visits, last_visit = (int(part) for part in value.split(':'))
+                return visits, last_visit
+            except (AttributeError, ValueError):
+                return None
+        record = request.session.get(self.SESSION_KEY)
+        return tuple(record) if record else None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not getattr(view_func, 'track_visits', False):
+            return None
+
+        now = int(time.time())
+        record = self.read(request)
+
+        if record is None:
+            # First visit
+            record = (1, now)
+        elif now - record[1] >= self.DAY:
+            # More than a day since the last counted visit
+            record = (record[0] + 1, now)
+        else:
+            # Already counted today: nothing to write
+            request.visits = record[0]
+            return None
+
+        request.visits = record[0]
+        if self.use_cookie:
+            request.visit_record = record
+        else:
+            request.session[self.SESSION_KEY] = list(record)
+        return None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        if getattr(view_func, 'track_visits', False):
+            await sync_to_async(VisitorMiddleware.process_view)(self, request, view_func, view_args, view_kwargs)
+        return None
+
+    def finish(self, request, response, state):
+        record = getattr(request, 'visit_record', None)
+        if record is not None:
+            response.set_signed_cookie(self.COOKIE_NAME, f'{record[0]}:{record[1]}',
+                                       salt=self.COOKIE_NAME, max_age=365 * self.DAY,
+                                       httponly=True, samesite='Lax')
+
+        return response
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.template.defaultfilters import slugify
 from django.contrib.auth.models import User
 
@@ -9,12 +9,43 @@ class Category(models.Model):
 
     name = models.CharField(max_length=maxlength_name, unique=True)
     views = models.IntegerField(default=0)
-    likes = models.IntegerField(default=0)
+    # Indexed: the index page ranks categories by likes
+    likes = models.IntegerField(default=0, db_index=True)
     slug = models.SlugField(unique=True)
+    # Kept up to date from the category's pages (see rango/category_stats.py)
+    page_count = models.IntegerField(default=0)
+    total_views = models.IntegerField(default=0)
+    # Indexed: the sidebar and the index page list trending categories first
+    trending_score = models.FloatField(default=0, db_index=True)
+    # When the category or any of its pages last changed; F() updates of the
+    # counters set it by hand (see rango/category_stats.py and rango/counters.py)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Changed with F() updates (see rango/likes.py and rango/category_stats.py), which
+    # an instance loaded a while ago knows nothing of: saving it leaves them as they
+    # are in the database unless they were set on the instance (see _do_update)
+    counter_fields = ('likes', 'page_count', 'total_views', 'trending_score')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        category = super().from_db(db, field_names, values)
+        # Remember the slug, so a rename can drop the old slug's cached id
+        category.loaded_slug = category.__dict__.get('slug')
+        category.loaded_counters = {name: category.__dict__.get(name) for name in cls.counter_fields}
+        return category
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.name)
         super(Category, self).save(*args, **kwargs)
+        self.loaded_counters = {name: getattr(self, name) for name in self.counter_fields}
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        # Leave the counters out of the UPDATE unless they were changed since the row
+        # was loaded; if the row is gone, save() still inserts it as usual
+        loaded = getattr(self, 'loaded_counters', {})
+        values = [value for value in values
+                  if value[0].name not in loaded or value[2] != loaded[value[0].name]]
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
 
     class Meta:
         verbose_name_plural = 'categories'
@@ -30,12 +61,59 @@ class Page(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     title = models.CharField(max_length=maxlength_title)
     url = models.URLField()
-    views = models.IntegerField(default=0)
+    # Indexed: the index page ranks pages by views
+    views = models.IntegerField(default=0, db_index=True)
+
+    # Filled in by manage.py check_links (see rango/linkcheck.py). link_status is
+    # the HTTP status, or None when the URL could not be fetched (see link_error).
+    # Indexed: the admin filters pages by ranges of it
+    link_status = models.IntegerField(null=True, blank=True, db_index=True)
+    link_error = models.CharField(max_length=200, blank=True)
+    link_latency = models.FloatField(null=True, blank=True)
+    link_etag = models.CharField(max_length=200, blank=True)
+    link_last_modified = models.CharField(max_length=64, blank=True)
+    # Indexed: pages are re-checked oldest check first
+    link_checked = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    # When the page last changed, including its buffered views being written
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Pages of one category, most viewed first
+            models.Index(fields=['category', '-views'], name='rango_page_cat_views_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        page = super().from_db(db, field_names, values)
+        # Remember where the page was and how many views it had, so saving it can
+        # adjust its category's counters by the difference
+        page.loaded_values = (page.__dict__.get('category_id'), page.__dict__.get('views'))
+        return page
+
+    def save(self, *args, **kwargs):
+        # The category's counters are updated (by rango.signals) in the same transaction
+        with transaction.atomic():
+            super(Page, self).save(*args, **kwargs)
 
     def __str__(self):
         return self.title
 
 
+class CategoryLike(models.Model):
+
+    # One row per user per liked category: the set that stops a user liking twice
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('user', 'category')
+
+    def __str__(self):
+        return f'{self.user} likes {self.category}'
+
+
 class UserProfile(models.Model):
 
     # Link userProfile to a User model instance 
@@ -45,6 +123,11 @@ class UserProfile(models.Model):
     website = models.URLField(blank=True)
     picture = models.ImageField(upload_to='profile_images', blank=True)
 
+    # SHA-256 of the picture (it is stored under this name), and whether the
+    # background workers have made its thumbnails yet (see rango.images)
+    picture_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    thumbnails_ready = models.BooleanField(default=False)
+
     def __str__(self):
         return self.user.username
 
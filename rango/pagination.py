@@ -0,0 +1,70 @@
+"""
+Keyset (cursor) pagination for the pages of a category.
+
+Pages are listed most viewed first, ties broken by id, which is exactly the order
+of the (category, -views) index (SQLite and most engines keep the primary key at
+the end of every index entry). A cursor names the last row already shown, as
+'<views>.<id>', and the next slice is "rows after that one" in index order. So
+every slice is an index range scan of PAGE_SIZE rows, however deep it is, where
+OFFSET would have to walk past every earlier row.
+"""
+from django.conf import settings
+from django.db.models import Q
+
+from rango.models import Page
+
+PAGE_SIZE = getattr(settings, 'RANGO_CATEGORY_PAGE_SIZE', 20)
+
+
+def make_cursor(page):
+    return f'{page.views}.{page.id}'
+
+
+def parse_cursor(cursor):
+    # Returns (views, id), or None for a missing or malformed cursor
+    try:
+        views, page_id = cursor.split('.')
+        return int(views), int(page_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _slice(category, cursor, size):
+    pages = Page.objects.filter(category=category).only('id', 'title', 'url', 'views')
+
+    after = parse_cursor(cursor)
+    if after is not None:
+        views, page_id = after
+        pages = pages.filter(Q(views__lt=views) | Q(views=views, id__gt=page_id))
+
+    # Fetch one extra row to find out whether there is another slice
+    return pages.order_by('-views', 'id')[:size + 1]
+
+
+def _split(pages, size):
+    if len(pages) > size:
+        pages = pages[:size]
+        return pages, make_cursor(pages[-1])
+    return pages, None
+
+
+def category_pages(category, cursor=None, size=PAGE_SIZE):
+    """
+    Return (pages, next_cursor) for the slice of category's pages after cursor.
+    next_cursor is None when there is nothing more to show.
+    """
+    return _split(list(_slice(category, cursor, size)), size)
+
+
+async def acategory_pages(category, cursor=None, size=PAGE_SIZE):
+    # category_pages() for async views, using the async ORM
+    return _split([page async for page in _slice(category, cursor, size)], size)
+
+
+def page_values(category_id, cursor=None, size=PAGE_SIZE):
+    # category_pages() as plain dicts, for the JSON API
+    rows = list(_slice(category_id, cursor, size).values('id', 'title', 'url', 'views'))
+    if len(rows) > size:
+        rows = rows[:size]
+        return rows, f"{rows[-1]['views']}.{rows[-1]['id']}"
+    return rows, None
@@ -0,0 +1,61 @@
+"""
+Database routing for read replicas.
+
+Reads of rango's models go to one of the RANGO_READ_REPLICAS database aliases,
+writes always go to the primary ('default'). A replica may lag behind the
+primary, so a client that has just written is pinned to the primary: for the
+rest of the request that made the write, and for RANGO_REPLICA_PIN_SECONDS after
+it (see rango.middleware.ReplicaPinMiddleware), so it always reads its own
+writes. Reads inside a transaction stay on the primary too, since only that
+connection can see the transaction's uncommitted rows.
+"""
+import contextvars
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_pinned = contextvars.ContextVar('rango_pinned_to_primary', default=False)
+
+
+def replicas():
+    return getattr(settings, 'RANGO_READ_REPLICAS', [])
+
+
+def pin_to_primary():
+    # Send every read in the current context to the primary; returns a token for unpin()
+    return _pinned.set(True)
+
+
+def unpin(token):
+    _pinned.reset(token)
+
+
+class ReadReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'rango':
+            return None
+        aliases = replicas()
+        if not aliases or _pinned.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        # Never the database an instance was read from: that may be a replica
+        if model._meta.app_label != 'rango':
+            return None
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The primary and its replicas hold the same rows
+        aliases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas get their schema (and everything else) from the primary
+        if db in replicas():
+            return False
+        return None
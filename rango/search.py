@@ -0,0 +1,242 @@
+"""
+Full-text search over pages and categories.
+
+On SQLite the text lives in an FTS5 virtual table, rango_search, with one row per
+page (title plus its category's name) and one per category (its name). The rowid
+encodes what the row is, 2 * id for a page and 2 * id + 1 for a category, so
+keeping a row in sync is a rowid lookup rather than a scan. The table
+is created after migrate, kept in step with the models by the signal handlers
+in rango.signals, and can be rebuilt from scratch in a couple of set-based
+statements with manage.py rebuild_search_index.
+
+Results are ranked by BM25 blended with popularity (Page.views, Category.likes):
+the (negated) bm25() score is scaled by a factor between 1 and 2 that grows with
+popularity, keeping text relevance in charge. Only the best few hundred text
+matches are blended, so broad queries stay cheap.
+
+On PostgreSQL rango_search is an ordinary table with the same rowid, title and
+context columns plus a stored tsvector generated from them (title weighted A,
+context B) under a GIN index, so the same statements keep it in sync and a query
+is an index lookup ranked with ts_rank; categories and pages are ranked together
+either way. Other backends fall back to icontains.
+"""
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from rango.models import Category, Page
+
+TABLE = 'rango_search'
+
+# rowid = 2 * id + kind
+PAGE, CATEGORY = 0, 1
+
+# Popularity at which a result gets half of the maximum boost
+POPULARITY_HALF = 100
+
+MAX_RESULTS = 20
+
+# Best text matches considered when blending in popularity
+CANDIDATES = 200
+
+# Text search configuration of the PostgreSQL index and queries
+PG_CONFIG = 'english'
+
+
+def _vendor(using=None):
+    return (using or connection).vendor
+
+
+def _indexed(using=None):
+    # Backends that keep rango_search
+    return _vendor(using) in ('sqlite', 'postgresql')
+
+
+def _fts_query(q):
+    # Quote every word so user input can never be parsed as FTS5 syntax, and
+    # let the last word match as a prefix so partial words still find results
+    terms = ['"{}"'.format(word.replace('"', '""')) for word in q.split()]
+    if terms:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def create_index(using=None):
+    vendor = _vendor(using)
+    with (using or connection).cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5('
+                           f'title, context, '
+                           f"tokenize = 'unicode61 remove_diacritics 2')")
+        elif vendor == 'postgresql':
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {TABLE} ("
+                           f"rowid bigint PRIMARY KEY, title text NOT NULL, context text NOT NULL, "
+                           f"document tsvector GENERATED ALWAYS AS ("
+                           f"setweight(to_tsvector('{PG_CONFIG}', title), 'A') || "
+                           f"setweight(to_tsvector('{PG_CONFIG}', context), 'B')) STORED)")
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {TABLE}_document ON {TABLE} USING gin (document)')
+
+
+def rebuild_index(using=None):
+    if not _indexed(using):
+        return
+    create_index(using)
+    with (using or connection).cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+        cursor.execute(f"INSERT INTO {TABLE} (rowid, title, context) "
+                       f"SELECT 2 * id + {CATEGORY}, name, '' FROM {Category._meta.db_table}")
+        cursor.execute(f"INSERT INTO {TABLE} (rowid, title, context) "
+                       f"SELECT 2 * p.id + {PAGE}, p.title, c.name "
+                       f"FROM {Page._meta.db_table} p JOIN {Category._meta.db_table} c "
+                       f"ON c.id = p.category_id")
+
+
+def index_new(category_ids, using=None):
+    """
+    Index the given categories, and their pages, that are not in the index yet:
+    what a bulk import adds without the signals. An import never renames
+    anything, so the rows already indexed stay as they are.
+    """
+    if not _indexed(using) or not category_ids:
+        return
+    ids = ', '.join(str(int(category_id)) for category_id in category_ids)
+    with (using or connection).cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE} (rowid, title, context) "
+                       f"SELECT 2 * c.id + {CATEGORY}, c.name, '' FROM {Category._meta.db_table} c "
+                       f"WHERE c.id IN ({ids}) AND NOT EXISTS "
+                       f"(SELECT 1 FROM {TABLE} s WHERE s.rowid = 2 * c.id + {CATEGORY})")
+        cursor.execute(f"INSERT INTO {TABLE} (rowid, title, context) "
+                       f"SELECT 2 * p.id + {PAGE}, p.title, c.name "
+                       f"FROM {Page._meta.db_table} p JOIN {Category._meta.db_table} c "
+                       f"ON c.id = p.category_id WHERE c.id IN ({ids}) AND NOT EXISTS "
+                       f"(SELECT 1 FROM {TABLE} s WHERE s.rowid = 2 * p.id + {PAGE})")
+
+
+def _replace(kind, object_id, title, context, created=False):
+    rowid = 2 * object_id + kind
+    with connection.cursor() as cursor:
+        # A newly created object cannot be in the index yet
+        if not created:
+            cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [rowid])
+        if title is not None:
+            cursor.execute(f'INSERT INTO {TABLE} (rowid, title, context) VALUES (%s, %s, %s)',
+                           [rowid, title, context])
+
+
+def index_page(page, created=False):
+    if _indexed():
+        _replace(PAGE, page.id, page.title, page.category.name, created)
+
+
+def index_category(category, created=False):
+    if not _indexed():
+        return
+    _replace(CATEGORY, category.id, category.name, '', created)
+    if created:
+        return
+    # The category name is also indexed alongside each of its pages
+    with connection.cursor() as cursor:
+        cursor.execute(f"UPDATE {TABLE} SET context = %s WHERE rowid IN "
+                       f"(SELECT 2 * id + {PAGE} FROM {Page._meta.db_table} WHERE category_id = %s)",
+                       [category.name, category.id])
+
+
+def unindex_page(page_id):
+    if _indexed():
+        _replace(PAGE, page_id, None, None)
+
+
+def unindex_category(category_id):
+    # Its pages are removed by their own post_delete signals (cascade)
+    if _indexed():
+        _replace(CATEGORY, category_id, None, None)
+
+
+def _boosted(candidates):
+    # Blend popularity into the relevance of the candidate rows (rowid, title,
+    # relevance; higher relevance is better) and look up their URLs and slugs
+    return (f"SELECT s.rowid, s.title, p.url, c.slug, "
+            f"       s.relevance * "
+            f"       (1.0 + 1.0 * COALESCE(p.views, c.likes, 0) / "
+            f"        (COALESCE(p.views, c.likes, 0) + {POPULARITY_HALF})) AS score "
+            f"FROM ({candidates}) s "
+            f"LEFT JOIN {Page._meta.db_table} p ON s.rowid %% 2 = {PAGE} AND p.id = s.rowid / 2 "
+            f"LEFT JOIN {Category._meta.db_table} c ON s.rowid %% 2 = {CATEGORY} AND c.id = s.rowid / 2 "
+            f"ORDER BY score DESC LIMIT %s")
+
+
+def _results(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [{'kind': 'category' if rowid % 2 == CATEGORY else 'page', 'id': rowid // 2,
+                 'title': title, 'url': url, 'slug': slug}
+                for rowid, title, url, slug, _ in cursor.fetchall()]
+
+
+def _search_sqlite(q, limit):
+    match = _fts_query(q)
+    if not match:
+        return []
+    # Take the best CANDIDATES rows by text relevance alone inside FTS5, then blend
+    # in popularity for just those, so broad queries do not join every match.
+    # bm25() is lower for better matches, so it is negated
+    candidates = (f"SELECT rowid, title, -bm25({TABLE}, 10.0, 2.0) AS relevance FROM {TABLE} "
+                  f"WHERE {TABLE} MATCH %s ORDER BY relevance DESC LIMIT {CANDIDATES}")
+    return _results(_boosted(candidates), [match, limit])
+
+
+def _search_postgres(q, limit):
+    # The GIN index finds the matches; ts_rank only scores them
+    candidates = (f"SELECT rowid, title, ts_rank(document, query) AS relevance "
+                  f"FROM {TABLE}, plainto_tsquery('{PG_CONFIG}', %s) query "
+                  f"WHERE document @@ query ORDER BY relevance DESC LIMIT {CANDIDATES}")
+    return _results(_boosted(candidates), [q, limit])
+
+
+def _search_fallback(q, limit):
+    categories = Category.objects.filter(name__icontains=q).order_by('-likes').values('id', 'name', 'slug')[:limit]
+    pages = Page.objects.filter(title__icontains=q).order_by('-views').values('id', 'title', 'url')[:limit]
+    return ([{'kind': 'category', 'id': c['id'], 'title': c['name'], 'url': None, 'slug': c['slug']}
+             for c in categories] +
+            [{'kind': 'page', 'id': p['id'], 'title': p['title'], 'url': p['url'], 'slug': None}
+             for p in pages])[:limit]
+
+
+def filter_matching(queryset, q):
+    """
+    Narrow a Page or Category queryset to the rows whose indexed text matches q
+    (a page's title or its category's name), unranked, e.g. for the admin's
+    search box. On SQLite this is an FTS5 lookup rather than a LIKE scan.
+    """
+    q = q.strip()
+    if not q:
+        return queryset
+    kind = PAGE if queryset.model is Page else CATEGORY
+    vendor = _vendor()
+    if vendor == 'sqlite':
+        rows = RawSQL(f'SELECT rowid / 2 FROM {TABLE} WHERE {TABLE} MATCH %s AND rowid %% 2 = {kind}',
+                      [_fts_query(q)])
+        return queryset.filter(id__in=rows)
+    if vendor == 'postgresql':
+        rows = RawSQL(f"SELECT rowid / 2 FROM {TABLE} "
+                      f"WHERE document @@ plainto_tsquery('{PG_CONFIG}', %s) AND rowid %% 2 = {kind}", [q])
+        return queryset.filter(id__in=rows)
+    if kind == PAGE:
+        return queryset.filter(Q(title__icontains=q) | Q(category__name__icontains=q))
+    return queryset.filter(name__icontains=q)
+
+
+def search(q, limit=MAX_RESULTS):
+    """
+    Return up to limit results for q, best first, as dicts with kind
+    ('page' or 'category'), id, title, url (pages) and slug (categories).
+    """
+    q = q.strip()
+    if not q:
+        return []
+    vendor = _vendor()
+    if vendor == 'sqlite':
+        return _search_sqlite(q, limit)
+    if vendor == 'postgresql':
+        return _search_postgres(q, limit)
+    return _search_fallback(q, limit)
@@ -0,0 +1,11 @@
+"""
+Database-backed sessions whose calls count as the cache phase of the request
+metrics (see rango.metrics). Selected by SESSION_ENGINE in settings.
+"""
+from django.contrib.sessions.backends import db
+
+from rango.metrics import SESSION_METHODS, timed_class
+
+
+class SessionStore(timed_class(db.SessionStore, SESSION_METHODS, 'cache')):
+    pass
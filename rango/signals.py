@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from rango.api import CATEGORY_ID_KEY
+from rango.caching import bump_generation, touch_on_commit
+from rango.leaderboards import top_categories, top_pages, trending_categories
+from rango.models import Category, Page
+from rango import category_stats, search
+from rango.metrics import time_sql
+from rango.middleware import count_query
+from rango.suggest import category_index
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    # Any change to a category invalidates the cached sidebar and category listings
+    bump_generation('categories')
+    touch_on_commit('categories', f'category:{instance.pk}')
+    # Under the slug it was loaded with too, or a renamed category keeps its old URL
+    slugs = {instance.slug, getattr(instance, 'loaded_slug', None) or instance.slug}
+    cache.delete_many([CATEGORY_ID_KEY.format(slug) for slug in slugs])
+    instance.loaded_slug = instance.slug
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, **kwargs):
+    top_categories.update({field: getattr(instance, field) for field in top_categories.fields})
+    search.index_category(instance, created)
+    category_index.update(instance)
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    top_categories.remove(instance.pk)
+    category_index.remove(instance.pk)
+    search.unindex_category(instance.pk)
+
+
+@receiver(post_save, sender=Page)
+@receiver(post_delete, sender=Page)
+def page_changed(sender, instance, **kwargs):
+    # The category's page listing changed
+    touch_on_commit(f'category:{instance.category_id}')
+
+
+@receiver(post_save, sender=Page)
+def page_saved(sender, instance, created, **kwargs):
+    top_pages.update({field: getattr(instance, field) for field in top_pages.fields})
+    search.index_page(instance, created)
+
+    if created:
+        category_stats.page_added(instance)
+    else:
+        category_stats.page_changed(instance)
+    instance.loaded_values = (instance.category_id, instance.views)
+    # A new page counts towards its category's trending score
+    trending_categories.invalidate()
+
+
+@receiver(post_delete, sender=Page)
+def page_deleted(sender, instance, **kwargs):
+    top_pages.remove(instance.pk)
+    search.unindex_page(instance.pk)
+    category_stats.page_removed(instance)
+
+
+@receiver(post_migrate)
+def create_search_index(sender, using, **kwargs):
+    # rango has no migrations for the FTS5 table, so create it once rango's tables exist
+    if sender.name == 'rango':
+        search.create_index(connections[using])
+
+
+@receiver(connection_created)
+def wrap_queries(sender, connection, **kwargs):
+    # Count and time every query against the request in progress, if any, on
+    # whatever connection and thread it runs (see rango.middleware and rango.metrics)
+    for wrapper in (count_query, time_sql):
+        if wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.append(wrapper)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    # WAL (by default) lets readers carry on while a write is in progress; with it,
+    # synchronous=NORMAL only syncs at checkpoints and is still safe from corruption
+    if connection.vendor != 'sqlite':
+        return
+    journal_mode = getattr(settings, 'RANGO_SQLITE_JOURNAL_MODE', 'WAL')
+    # On the raw sqlite3 connection, so these never count towards a query budget
+    connection.connection.execute(f'PRAGMA journal_mode={journal_mode}')
+    if journal_mode.upper() == 'WAL':
+        connection.connection.execute('PRAGMA synchronous=NORMAL')
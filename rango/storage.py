@@ -0,0 +1,59 @@
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only .gz files are written
+    brotli = None
+
+# Text assets worth compressing ahead of time (images are already compressed)
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.html', '.txt', '.json', '.xml', '.map')
+
+# Below this size the compressed copy is rarely smaller enough to be worth a file
+MIN_SIZE = 256
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    collectstatic storage that gives every file a content-hashed name (so it can
+    be cached forever) and writes .gz and, when brotli is installed, .br copies
+    of text assets next to it, for the web server or rango.files.serve_file to
+    hand out without compressing on every request.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if not dry_run and hashed_name and not isinstance(processed, Exception):
+                self.compress(hashed_name)
+            yield name, hashed_name, processed
+
+    def compress(self, name):
+        if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+            return
+        with self.open(name) as f:
+            content = f.read()
+        if len(content) < MIN_SIZE:
+            return
+
+        compressed = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed['.br'] = brotli.compress(content)
+
+        for suffix, data in compressed.items():
+            # Only keep a compressed copy that actually saves something
+            if len(data) >= len(content):
+                continue
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self._save(name + suffix, ContentFile(data))
+
+
+def precompressed_path(path, accept_encoding):
+    # The best precompressed sibling of path the client accepts, as (path, encoding)
+    for suffix, encoding in (('.br', 'br'), ('.gz', 'gzip')):
+        if encoding in accept_encoding and os.path.exists(path + suffix):
+            return path + suffix, encoding
+    return path, None
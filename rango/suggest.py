@@ -0,0 +1,206 @@
+"""
+Category name autocomplete.
+
+Every process keeps its own index of the categories in memory: a sorted list of
+(lowercased name or slug, id) keys, so the keys starting with a prefix are one
+contiguous run found with bisect, and the categories sorted by likes. A narrow
+prefix ranks the few categories in its run; a broad one (a single letter, say)
+walks the most liked categories until enough of them match, so no lookup
+touches more than a few hundred entries. The index is built with a single query and then patched in place when
+a category is saved or deleted here. Changes made by other processes (or bulk
+imports) show up as a new 'categories' generation (see rango.caching), and the
+index is rebuilt the next time it is used. Every like (see rango.likes) bumps
+the 'category-likes' generation and publishes the counts it changed under the
+new generation, so every other process catches up by applying the generations
+it missed, from one cache round trip. Only a process too far behind (or one
+whose entries have expired) reloads all the like counts, with one query.
+"""
+import heapq
+import threading
+from bisect import bisect_left, insort
+
+from django.core.cache import cache
+
+from rango.caching import bump_generation, get_generation
+from rango.models import Category
+
+MAX_SUGGESTIONS = 8
+
+# Bumped by every like; the counts each one changed are cached under LIKES_KEY
+LIKES_GENERATION = 'category-likes'
+LIKES_KEY = 'rango:category-likes:{}'
+LIKES_TIMEOUT = 300
+
+# A process more generations behind than this reloads every count instead
+MAX_LIKES_BEHIND = 100
+
+# A prefix matching more keys than this is answered from the by-likes list instead
+SCAN_LIMIT = 256
+
+
+class CategoryIndex:
+
+    def __init__(self):
+        self._keys = []
+        # id -> (name, slug, likes)
+        self._categories = {}
+        # (-likes, name, id), most liked first
+        self._ranked = []
+        self._generation = None
+        self._likes_generation = None
+        self._lock = threading.Lock()
+
+    def rebuild(self):
+        # Read the generations first: a change made during the query must trigger another rebuild
+        generation = get_generation('categories')
+        likes_generation = get_generation(LIKES_GENERATION)
+        categories = {pk: (name, slug, likes) for pk, name, slug, likes in
+                      Category.objects.values_list('id', 'name', 'slug', 'likes')}
+        keys = sorted(key for pk, category in categories.items() for key in self._keys_for(pk, category))
+        ranked = sorted(self._rank(pk, category) for pk, category in categories.items())
+        with self._lock:
+            self._categories, self._keys, self._ranked = categories, keys, ranked
+            self._generation = generation
+            self._likes_generation = likes_generation
+
+    def reload_likes(self):
+        # Another process counted likes: only the ranking has to change
+        likes_generation = get_generation(LIKES_GENERATION)
+        likes = dict(Category.objects.values_list('id', 'likes'))
+        with self._lock:
+            for pk, (name, slug, _) in list(self._categories.items()):
+                if pk in likes:
+                    self._categories[pk] = (name, slug, likes[pk])
+            # Every count may have moved, so sort once rather than move entries one by one
+            self._ranked = sorted(self._rank(pk, category) for pk, category in self._categories.items())
+            self._likes_generation = likes_generation
+
+    def _keys_for(self, pk, category):
+        name, slug, _ = category
+        return {(name.lower(), pk), (slug, pk)}
+
+    def _rank(self, pk, category):
+        name, _, likes = category
+        return -likes, name, pk
+
+    def _ensure_current(self):
+        if self._generation != get_generation('categories'):
+            self.rebuild()
+        else:
+            likes_generation = get_generation(LIKES_GENERATION)
+            if self._likes_generation != likes_generation:
+                self.catch_up_likes(likes_generation)
+
+    def catch_up_likes(self, likes_generation):
+        # Apply the counts published by the generations this process missed, in order
+        behind = self._likes_generation
+        if behind is None or not 0 < likes_generation - behind <= MAX_LIKES_BEHIND:
+            return self.reload_likes()
+        keys = [LIKES_KEY.format(generation) for generation in range(behind + 1, likes_generation + 1)]
+        published = cache.get_many(keys)
+        if len(published) != len(keys):
+            # Expired, or not written yet by the process that bumped the generation
+            return self.reload_likes()
+        self._apply_likes([{'id': pk, 'likes': likes} for key in keys for pk, likes in published[key]])
+        with self._lock:
+            if self._likes_generation == behind:
+                self._likes_generation = likes_generation
+
+    def suggest(self, prefix, limit=MAX_SUGGESTIONS):
+        """
+        Categories whose name or slug starts with prefix (case-insensitively),
+        most liked first, as dicts of id, name, slug and likes.
+        """
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        self._ensure_current()
+
+        with self._lock:
+            lo = bisect_left(self._keys, (prefix,))
+            hi = bisect_left(self._keys, (prefix + '\U0010ffff',))
+
+            if hi - lo <= SCAN_LIMIT:
+                matches = {pk for _, pk in self._keys[lo:hi]}
+                best = heapq.nsmallest(limit, (self._rank(pk, self._categories[pk]) for pk in matches))
+            else:
+                best = []
+                for rank in self._ranked:
+                    name, slug, _ = self._categories[rank[2]]
+                    if name.lower().startswith(prefix) or slug.startswith(prefix):
+                        best.append(rank)
+                        if len(best) == limit:
+                            break
+
+            return [{'id': pk, 'name': name, 'slug': self._categories[pk][1], 'likes': -likes}
+                    for likes, name, pk in best]
+
+    def _advance(self):
+        # After a local change (which has just bumped the generation), the index is
+        # current only if it was current before it; otherwise leave it to be rebuilt
+        current = get_generation('categories')
+        if self._generation == current - 1:
+            self._generation = current
+
+    def update(self, category):
+        # Patch one saved category into the index
+        with self._lock:
+            if self._generation is None:
+                # Not built yet; the first lookup will load everything
+                return
+            self._remove(category.pk)
+            entry = (category.name, category.slug, category.likes)
+            self._categories[category.pk] = entry
+            for key in self._keys_for(category.pk, entry):
+                insort(self._keys, key)
+            insort(self._ranked, self._rank(category.pk, entry))
+            self._advance()
+
+    def remove(self, pk):
+        with self._lock:
+            if self._generation is None:
+                return
+            self._remove(pk)
+            self._advance()
+
+    def _remove(self, pk):
+        entry = self._categories.pop(pk, None)
+        if entry is None:
+            return
+        for key in self._keys_for(pk, entry):
+            _discard(self._keys, key)
+        _discard(self._ranked, self._rank(pk, entry))
+
+    def likes_changed(self, rows):
+        # New like counts (dicts of id and likes) written by this process, which only
+        # move categories in the ranking; other processes pick them up from the cache
+        current = bump_generation(LIKES_GENERATION)
+        cache.set(LIKES_KEY.format(current), [(row['id'], row['likes']) for row in rows], LIKES_TIMEOUT)
+        self._apply_likes(rows)
+        with self._lock:
+            if self._likes_generation == current - 1:
+                self._likes_generation = current
+
+    def _apply_likes(self, rows):
+        with self._lock:
+            for row in rows:
+                pk = row['id']
+                entry = self._categories.get(pk)
+                if entry is not None:
+                    _discard(self._ranked, self._rank(pk, entry))
+                    self._categories[pk] = entry = (entry[0], entry[1], row['likes'])
+                    insort(self._ranked, self._rank(pk, entry))
+
+
+def _discard(sorted_list, item):
+    i = bisect_left(sorted_list, item)
+    if i < len(sorted_list) and sorted_list[i] == item:
+        del sorted_list[i]
+
+
+# The index used by every request handled in this process
+category_index = CategoryIndex()
+
+
+def suggest(prefix, limit=MAX_SUGGESTIONS):
+    return category_index.suggest(prefix, limit)
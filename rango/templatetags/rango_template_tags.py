@@ -1,9 +1,41 @@
 from django import template
-from rango.models import Category
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from rango.caching import versioned_key
+from rango.images import thumbnail_url
+from rango.models import Category, UserProfile
 
 register = template.Library()
 
-@register.inclusion_tag('rango/categories.html')
+# How long the sidebar's categories may live in the cache (they are invalidated when
+# categories change, and this bounds how stale their trending order gets)
+SIDEBAR_TIMEOUT = 60 * 60
+
+
+@register.simple_tag
 def get_category_list(current_category=None):
-    return {'categories': Category.objects.all(),
-            'current_category': current_category}
\ No newline at end of file
+    # The sidebar lists trending categories first. Its entries only change when a
+    # category is saved or deleted, which bumps the 'categories' generation; the order
+    # may lag behind the trending scores by up to SIDEBAR_TIMEOUT. One list of them is
+    # cached under the current generation, whichever category is shown in bold, so
+    # steady state costs no queries; the highlight is applied as it is rendered.
+    key = versioned_key('categories', 'sidebar')
+
+    categories = cache.get(key)
+    if categories is None:
+        categories = list(Category.objects.order_by('-trending_score', 'name').values('name', 'slug'))
+        cache.set(key, categories, SIDEBAR_TIMEOUT)
+
+    return render_to_string('rango/categories.html',
+                            {'categories': categories,
+                             'current_slug': current_category.slug if current_category else None})
+
+
+@register.simple_tag
+def profile_picture_url(user, size='small', fmt='webp'):
+    # URL of the user's picture at the given thumbnail size, or '' if they have none
+    try:
+        return thumbnail_url(user.userprofile, size, fmt)
+    except (AttributeError, UserProfile.DoesNotExist):
+        return ''
@@ -0,0 +1,140 @@
+"""
+Template warm-up and render timing.
+
+Templates are loaded through rango's Loader (see settings.TEMPLATES), Django's
+cached loader, which keeps every compiled template in memory after its first
+use. warm_up() loads all of rango's templates when a server starts (it is
+called from wsgi.py and asgi.py, not by management commands), so no request
+pays for reading and parsing them.
+
+The loader compiles templates as TimedTemplate, whose _render runs whether the
+template was loaded directly, through {% extends %} or through {% include %},
+and adds up how long each template takes. Timings are only kept while a
+RenderTimings collector is active for the current request (see
+rango.middleware.TemplateTimingMiddleware). Either way the render counts as
+the request's tpl phase in rango.metrics. Configure Django's cached loader
+instead to turn the timing off.
+"""
+import contextvars
+import logging
+import os
+import time
+from django.conf import settings
+from django.template import TemplateDoesNotExist, TemplateSyntaxError, engines
+from django.template.base import Template
+from django.template.loaders import base, cached
+
+from rango.metrics import timed
+
+logger = logging.getLogger('rango.templates')
+
+_collector = contextvars.ContextVar('rango_render_timings', default=None)
+
+
+class RenderTimings:
+
+    def __init__(self):
+        # template name -> [renders, seconds including nested templates, seconds in the template itself]
+        self.templates = {}
+        # Time spent in nested templates, for each render in progress
+        self._children = []
+
+    def start(self):
+        self._children.append(0.0)
+
+    def stop(self, name, elapsed):
+        children = self._children.pop()
+        if self._children:
+            self._children[-1] += elapsed
+        row = self.templates.setdefault(name, [0, 0.0, 0.0])
+        row[0] += 1
+        row[1] += elapsed
+        row[2] += elapsed - children
+
+    @property
+    def total(self):
+        return sum(own for _, _, own in self.templates.values())
+
+    def as_dict(self):
+        # Milliseconds, slowest template first
+        rows = sorted(self.templates.items(), key=lambda item: -item[1][2])
+        return {name: {'renders': renders, 'ms': round(total * 1000, 3), 'self_ms': round(own * 1000, 3)}
+                for name, (renders, total, own) in rows}
+
+
+def collect():
+    # Start collecting render timings for the current request; returns (timings, token)
+    timings = RenderTimings()
+    return timings, _collector.set(timings)
+
+
+def stop_collecting(token):
+    _collector.reset(token)
+
+
+class TimedTemplate(Template):
+
+    def _render(self, context):
+        # Rendering also counts as the tpl phase of the request's Server-Timing (see rango.metrics)
+        timings = _collector.get()
+        if timings is None:
+            return timed('tpl', super()._render, context)
+        timings.start()
+        start = time.perf_counter()
+        try:
+            return timed('tpl', super()._render, context)
+        finally:
+            timings.stop(self.name or '<string>', time.perf_counter() - start)
+
+
+class TimedTemplates(base.Loader):
+    # base.Loader.get_template, compiling TimedTemplates
+
+    def get_template(self, template_name, skip=None):
+        tried = []
+        for origin in self.get_template_sources(template_name):
+            if skip is not None and origin in skip:
+                tried.append((origin, 'Skipped to avoid recursion'))
+                continue
+            try:
+                contents = self.get_contents(origin)
+            except TemplateDoesNotExist:
+                tried.append((origin, 'Source does not exist'))
+                continue
+            return TimedTemplate(contents, origin, origin.template_name, self.engine)
+        raise TemplateDoesNotExist(template_name, tried=tried)
+
+
+class Loader(cached.Loader, TimedTemplates):
+    """
+    Django's cached loader, caching TimedTemplates: the cached loader's
+    get_template() compiles through TimedTemplates.get_template().
+    """
+
+
+def precompile(prefix='rango'):
+    """
+    Load every template under <template dir>/<prefix>/ so the cached loader
+    holds them compiled before the first request. Returns how many were loaded.
+    """
+    engine = engines['django'].engine
+    loaded = 0
+    for directory in engine.dirs:
+        root = os.path.join(directory, prefix)
+        for dirpath, _, filenames in os.walk(root):
+            for filename in sorted(filenames):
+                if not filename.endswith('.html'):
+                    continue
+                name = os.path.relpath(os.path.join(dirpath, filename), directory).replace(os.sep, '/')
+                try:
+                    engine.get_template(name)
+                    loaded += 1
+                except TemplateSyntaxError:
+                    logger.exception('Could not compile template %s', name)
+    return loaded
+
+
+def warm_up():
+    # Called by the server entry points (wsgi.py, asgi.py)
+    if getattr(settings, 'RANGO_PRECOMPILE_TEMPLATES', True):
+        precompile()
@@ -1,3 +1,1152 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_login_failed
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections
+from django.http import HttpResponse
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from rango.admin import EstimatedCountPaginator
+from rango.caching import asingle_flight, bump_generation
+from rango.suggest import LIKES_GENERATION, LIKES_KEY
+from rango.importer import import_rows
+from rango.leaderboards import top_categories
+from rango.linkcheck import LinkChecker, LinkResult
+from rango.middleware import (REPEAT_THRESHOLD, QueryBudgetMiddleware, ReplicaPinMiddleware,
+                              TemplateTimingMiddleware, VisitorMiddleware, query_shape)
+from rango import category_stats, images, metrics, routers, search, templating, throttle
+from rango.clicks import ClickBuffer
+from rango.counters import clear_buffers
+from rango.routers import ReadReplicaRouter
+from rango.templatetags.rango_template_tags import get_category_list
+from rango.models import Category, CategoryLike, Page, UserProfile
+from rango.pagination import category_pages, make_cursor
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Requests every rango view through the test client and fails if a view runs
+    more queries than its declared query_budget, or repeats a query shape often
+    enough to look like an N+1 pattern. The numbers come from
+    rango.middleware.QueryBudgetMiddleware via response.wsgi_request.query_stats.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('rango', password='tango-with-django')
+        cls.category = Category.objects.create(name='Python', likes=64)
+        for i in range(10):
+            Page.objects.create(category=cls.category, title=f'Page {i}',
+                                url=f'http://example.com/{i}', views=i)
+
+    def setUp(self):
+        # Start every test with a cold cache so cache misses are counted too
+        cache.clear()
+
+    def tearDown(self):
+        # Clicks and likes a test leaves buffered must not be written later, at
+        # exit, to whatever database is the default by then
+        clear_buffers()
+
+    def assertWithinBudget(self, response):
+        stats = response.wsgi_request.query_stats
+        self.assertIsNotNone(stats.budget, f'{stats.view_name} has no query_budget')
+        self.assertLessEqual(stats.count, stats.budget,
+                             f'{stats.view_name} ran {stats.count} queries, budget is {stats.budget}')
+        self.assertEqual(stats.repeated, {},
+                         f'{stats.view_name} repeated a query {REPEAT_THRESHOLD}+ times')
+        return response
+
+    def get(self, name, **kwargs):
+        return self.assertWithinBudget(self.client.get(reverse(name, kwargs=kwargs)))
+
+    def post(self, name, data, **kwargs):
+        return self.assertWithinBudget(self.client.post(reverse(name, kwargs=kwargs), data))
+
+    def login(self):
+        self.client.login(username='rango', password='tango-with-django')
+
+
+class AnonymousViewQueryTests(QueryBudgetTestCase):
+
+    def test_index(self):
+        self.get('rango:index')
+        self.get('rango:index')
+
+    def test_about(self):
+        self.get('rango:about')
+
+    def test_show_category(self):
+        self.get('rango:show_category', category_name_slug=self.category.slug)
+        self.get('rango:show_category', category_name_slug='missing')
+
+    def test_goto(self):
+        page = Page.objects.first()
+        self.get('rango:goto', page_id=page.id)
+
+    def test_login_upgrades_hashes_and_reports_failures(self):
+        self.user.password = make_password('tango-with-django', hasher='pbkdf2_sha1')
+        self.user.save()
+        failures = []
+        user_login_failed.connect(lambda **kwargs: failures.append(kwargs['credentials']),
+                                  weak=False, dispatch_uid='test-login-failed')
+        self.addCleanup(user_login_failed.disconnect, dispatch_uid='test-login-failed')
+
+        self.client.post(reverse('rango:login'), {'username': 'rango', 'password': 'wrong'})
+        self.assertEqual(failures, [{'username': 'rango', 'password': '********************'}])
+
+        self.client.post(reverse('rango:login'), {'username': 'rango', 'password': 'tango-with-django'})
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+        self.assertEqual(len(failures), 1)
+
+    def test_login(self):
+        self.get('rango:login')
+        self.post('rango:login', {'username': 'rango', 'password': 'wrong'})
+        self.post('rango:login', {'username': 'rango', 'password': 'tango-with-django'})
+
+    def test_register(self):
+        self.get('rango:register')
+        self.post('rango:register', {'username': 'django', 'email': 'django@example.com',
+                                     'password': 'unchained-42', 'website': ''})
+
+
+class AuthenticatedViewQueryTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+
+    def test_index(self):
+        self.get('rango:index')
+
+    def test_show_category(self):
+        self.get('rango:show_category', category_name_slug=self.category.slug)
+
+    def test_add_category(self):
+        self.get('rango:add_category')
+        self.post('rango:add_category', {'name': 'Django', 'views': 0, 'likes': 0})
+
+    def test_add_page(self):
+        slug = self.category.slug
+        self.get('rango:add_page', category_name_slug=slug)
+        self.post('rango:add_page', {'title': 'Docs', 'url': 'http://docs.python.org/', 'views': 0},
+                  category_name_slug=slug)
+
+    def test_restricted(self):
+        self.get('rango:restricted')
+
+    def test_logout(self):
+        self.get('rango:logout')
+
+
+class QueryShapeTests(TestCase):
+
+    def test_literals_are_normalised(self):
+        self.assertEqual(query_shape("SELECT * FROM t WHERE id = 1 AND name = 'a'"),
+                         query_shape("SELECT * FROM t WHERE id = 22 AND name = 'b'"))
+        self.assertEqual(query_shape('SELECT * FROM t WHERE id IN (%s, %s)'),
+                         query_shape('SELECT * FROM t WHERE id IN (%s, %s, %s)'))
+
+
+class ImporterTests(TestCase):
+
+    def test_import_is_an_upsert(self):
+        rows = [{'category': 'Python', 'category_likes': 5},
+                {'category': 'Python', 'title': 'Docs', 'url': 'http://docs.python.org/', 'views': 3},
+                {'category': 'Django', 'title': 'Docs', 'url': 'http://djangoproject.com/', 'views': 1}]
+        import_rows(rows, batch_size=2)
+        rows[1]['views'] = 10
+        import_rows(rows, batch_size=2)
+
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(Page.objects.count(), 2)
+        self.assertEqual(Category.objects.get(name='Python').likes, 5)
+        self.assertEqual(Category.objects.get(name='Django').slug, 'django')
+        self.assertEqual(Page.objects.get(category__name='Python').views, 10)
+        python = Category.objects.get(name='Python')
+        self.assertEqual((python.page_count, python.total_views), (1, 10))
+
+    def test_slug_clash_is_skipped(self):
+        import_rows([{'category': 'Python', 'category_views': 1},
+                     {'category': 'Python!', 'category_views': 2, 'title': 'Docs'}])
+        self.assertEqual(list(Category.objects.values_list('name', 'views')), [('Python', 1)])
+        self.assertFalse(Page.objects.exists())
+
+    def test_imported_rows_are_searchable(self):
+        rows = [{'category': 'Python', 'title': 'Tutorial', 'url': 'http://docs.python.org/'},
+                {'category': 'Django', 'title': 'Docs', 'url': 'http://djangoproject.com/'}]
+        import_rows(rows, batch_size=1)
+        import_rows(rows, batch_size=1)
+        self.assertEqual([r['title'] for r in search.search('tutorial')], ['Tutorial'])
+        # Each row indexed once, however often it is imported
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {search.TABLE}')
+            self.assertEqual(cursor.fetchone()[0], 4)
+
+
+class LeaderboardTests(QueryBudgetTestCase):
+
+    def test_updated_in_place(self):
+        self.assertEqual(top_categories.top()[0]['name'], 'Python')
+        Category.objects.create(name='Django', likes=100)
+        with self.assertNumQueries(0):
+            self.assertEqual([row['name'] for row in top_categories.top()], ['Django', 'Python'])
+
+        Category.objects.get(name='Django').delete()
+        self.assertEqual([row['name'] for row in top_categories.top()], ['Python'])
+
+    def test_updates_wait_for_the_lock(self):
+        top_categories.top()
+        row = {'id': 1000, 'likes': 100, 'name': 'Django', 'slug': 'django'}
+        with top_categories.lock():
+            updater = threading.Thread(target=top_categories.update, args=(row,))
+            updater.start()
+            updater.join(0.1)
+            # Still waiting, so it cannot overwrite the list the lock holder is writing
+            self.assertTrue(updater.is_alive())
+        updater.join()
+        self.assertEqual(top_categories.top()[0]['id'], 1000)
+
+
+class SidebarTests(QueryBudgetTestCase):
+
+    def test_one_cached_list_for_every_highlight(self):
+        django = Category.objects.create(name='Django')
+        with self.assertNumQueries(1):
+            html = get_category_list(self.category)
+        self.assertInHTML('<strong><a href="/rango/category/python/">Python</a></strong>', html)
+
+        # Another category in bold comes from the same cached list
+        with self.assertNumQueries(0):
+            html = get_category_list(django)
+        self.assertInHTML('<strong><a href="/rango/category/django/">Django</a></strong>', html)
+        self.assertInHTML('<a href="/rango/category/python/">Python</a>', html)
+
+        # A new category bumps the generation, so it shows up straight away
+        Category.objects.create(name='Flask')
+        self.assertIn('Flask', get_category_list())
+
+
+class SearchTests(QueryBudgetTestCase):
+
+    def test_search_ranks_and_stays_in_sync(self):
+        # Page 9 has the most views, so it outranks the other page titles
+        response = self.client.get(reverse('rango:search'), {'q': 'page'})
+        self.assertWithinBudget(response)
+        results = response.context['results']
+        self.assertEqual(results[0]['title'], 'Page 9')
+
+        Page.objects.filter(title='Page 9').get().delete()
+        self.assertNotIn('Page 9', [r['title'] for r in search.search('page')])
+        self.assertEqual(search.search('pyth')[0]['kind'], 'category')
+
+    def test_search_input_is_not_fts_syntax(self):
+        self.assertEqual(search.search('"AND OR *('), [])
+
+
+class CategoryPaginationTests(QueryBudgetTestCase):
+
+    def test_slices_cover_every_page_once_in_order(self):
+        seen = []
+        cursor = None
+        while True:
+            pages, cursor = category_pages(self.category, cursor, size=3)
+            seen.extend(page.title for page in pages)
+            if cursor is None:
+                break
+        self.assertEqual(seen, [f'Page {i}' for i in range(9, -1, -1)])
+
+    def test_fragment_endpoint(self):
+        url = reverse('rango:category_pages', kwargs={'category_name_slug': self.category.slug})
+        response = self.assertWithinBudget(self.client.get(url, {'after': 'junk'}))
+        self.assertContains(response, 'Page 9')
+        self.assertEqual(self.client.get(url.replace('python', 'missing')).status_code, 404)
+
+
+class VisitorMiddlewareTests(TestCase):
+
+    def test_visit_is_only_written_once_a_day(self):
+        response = self.client.get(reverse('rango:about'))
+        self.assertEqual(response.context['visits'], 1)
+
+        response = self.client.get(reverse('rango:about'))
+        self.assertEqual(response.context['visits'], 1)
+        self.assertFalse(response.wsgi_request.session.modified)
+
+    @override_settings(RANGO_VISITS_STORE='cookie')
+    def test_cookie_store_skips_the_session(self):
+        response = self.client.get(reverse('rango:about'))
+        self.assertIn('rango_visits', response.cookies)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+
+class ProfileImageTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def upload(self):
+        with open(os.path.join(settings.BASE_DIR, 'media', 'cat.jpg'), 'rb') as f:
+            return SimpleUploadedFile('cat.jpg', f.read(), content_type='image/jpeg')
+
+    def test_identical_uploads_are_stored_once(self):
+        first, first_hash = images.store_picture(self.upload())
+        second, second_hash = images.store_picture(self.upload())
+        self.assertEqual((first, first_hash), (second, second_hash))
+        self.assertEqual(len(os.listdir(os.path.dirname(os.path.join(self.media_root, first)))), 1)
+
+    def test_named_after_the_detected_format(self):
+        upload = self.upload()
+        upload.name = 'cat.html'
+        name, _ = images.store_picture(upload)
+        self.assertTrue(name.endswith('.jpg'))
+
+        page = SimpleUploadedFile('cat.jpg', b'<script>alert(1)</script>', content_type='image/jpeg')
+        with self.assertRaises(ValueError):
+            images.store_picture(page)
+
+    def test_register_rejects_non_images(self):
+        page = SimpleUploadedFile('cat.html', b'<script>alert(1)</script>', content_type='text/html')
+        response = self.client.post(reverse('rango:register'), {
+            'username': 'cat', 'email': 'cat@example.com', 'password': 'tango-with-django',
+            'picture': page})
+        self.assertIn('picture', response.context['profile_form'].errors)
+        self.assertFalse(User.objects.filter(username='cat').exists())
+
+        self.client.post(reverse('rango:register'), {
+            'username': 'cat', 'email': 'cat@example.com', 'password': 'tango-with-django',
+            'picture': self.upload()})
+        self.assertTrue(UserProfile.objects.get(user__username='cat').picture.name.endswith('.jpg'))
+
+    def test_thumbnails(self):
+        user = User.objects.create_user('cat')
+        name, content_hash = images.store_picture(self.upload())
+        profile = UserProfile.objects.create(user=user, picture=name, picture_hash=content_hash)
+        self.assertEqual(images.thumbnail_url(profile), profile.picture.url)
+
+        images._process(profile.id, name, content_hash, in_worker=False)
+        profile.refresh_from_db()
+        self.assertTrue(profile.thumbnails_ready)
+        for fmt in images.THUMBNAIL_FORMATS:
+            path = os.path.join(self.media_root, images.thumbnail_name(content_hash, 'small', fmt))
+            with Image.open(path) as thumbnail:
+                self.assertLessEqual(max(thumbnail.size), images.THUMBNAIL_SIZES['small'])
+        self.assertTrue(images.thumbnail_url(profile).endswith('_small.webp'))
+
+
+class MediaServingTests(TestCase):
+
+    def setUp(self):
+        self.url = settings.MEDIA_URL + 'cat.jpg'
+        with open(os.path.join(settings.MEDIA_ROOT, 'cat.jpg'), 'rb') as f:
+            self.content = f.read()
+
+    def test_etag_and_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-5:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-0')
+        self.assertEqual(response.status_code, 416)
+
+    @override_settings(RANGO_FILE_ACCEL='nginx')
+    def test_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/cat.jpg')
+        self.assertEqual(response.content, b'')
+
+    def test_non_images_are_downloads(self):
+        self.assertTrue(self.client.get(self.url)['Content-Disposition'].startswith('inline'))
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with open(os.path.join(media_root, 'cat.html'), 'w') as f:
+            f.write('<script>alert(1)</script>')
+        with override_settings(MEDIA_ROOT=media_root):
+            response = self.client.get(settings.MEDIA_URL + 'cat.html')
+        self.assertEqual(response['Content-Disposition'], 'attachment')
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+    def test_no_escape_from_media_root(self):
+        self.assertEqual(self.client.get(settings.MEDIA_URL + '../manage.py').status_code, 404)
+
+
+class CategoryPageCacheTests(QueryBudgetTestCase):
+
+    def test_rendered_once(self):
+        url = reverse('rango:show_category', kwargs={'category_name_slug': self.category.slug})
+        self.client.get(url)
+
+        # Anonymous visitors get the cached body without any queries
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'Page 9')
+        self.assertNotContains(response, 'Add Page')
+
+        # Logged in users get the same body plus their own links
+        self.login()
+        self.assertContains(self.client.get(url), 'Add Page')
+
+        # A new page replaces the cached body
+        Page.objects.create(category=self.category, title='Page 99', url='http://example.com/99', views=99)
+        self.assertContains(self.client.get(url), 'Page 99')
+
+    def test_only_first_slice_cached(self):
+        url = reverse('rango:show_category', kwargs={'category_name_slug': self.category.slug})
+        after = make_cursor(Page.objects.get(title='Page 5'))
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'after': after})
+            self.assertContains(response, 'Page 4')
+            self.assertNotContains(response, 'Page 5')
+            self.assertTrue(queries)
+
+        # A cursor that does not parse is the first slice, from the cache
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(url, {'after': 'made-up'}), 'Page 9')
+
+    def test_single_flight(self):
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            return 'fresh'
+
+        async def run():
+            self.assertEqual(await asingle_flight('test-key', 1, compute), 'fresh')
+            self.assertEqual(await asingle_flight('test-key', 1, compute), 'fresh')
+
+            # While another request holds the lock, the stale copy is served
+            cache.add('test-key:lock', 1)
+            self.assertEqual(await asingle_flight('test-key', 2, compute), 'fresh')
+            cache.delete('test-key:lock')
+
+        async_to_sync(run)()
+        self.assertEqual(len(calls), 1)
+
+
+class CategoryStatsTests(QueryBudgetTestCase):
+
+    def assertStats(self, page_count, total_views):
+        category = Category.objects.get(id=self.category.id)
+        self.assertEqual((category.page_count, category.total_views), (page_count, total_views))
+        return category
+
+    def test_maintained_with_pages(self):
+        self.assertStats(10, 45)
+
+        page = Page.objects.create(category=self.category, title='Page 10', url='http://example.com/10', views=5)
+        self.assertStats(11, 50)
+
+        page = Page.objects.get(id=page.id)
+        page.views = 7
+        page.save()
+        self.assertStats(11, 52)
+
+        other = Category.objects.create(name='Django')
+        page.category = other
+        page.save()
+        self.assertStats(10, 45)
+        self.assertEqual(Category.objects.get(id=other.id).page_count, 1)
+
+        page.delete()
+        self.assertEqual(Category.objects.get(id=other.id).page_count, 0)
+
+    def test_idle_buffer_flushes_on_a_timer(self):
+        buffer = ClickBuffer(flush_interval=0.05, flush_threshold=float('inf'))
+        flushed = threading.Event()
+        with mock.patch.object(buffer, 'flush', side_effect=lambda: flushed.set()):
+            buffer.record(Page.objects.first().id)
+            # No further clicks arrive, and the timer writes the one buffered anyway
+            self.assertTrue(flushed.wait(5))
+
+    def test_clicks_and_trending(self):
+        buffer = ClickBuffer(flush_interval=float('inf'), flush_threshold=float('inf'))
+        page = Page.objects.first()
+        for _ in range(3):
+            buffer.record(page.id)
+        before = Category.objects.get(id=self.category.id).trending_score
+        buffer.flush()
+
+        category = self.assertStats(10, 48)
+        self.assertGreater(category.trending_score, before)
+        self.assertAlmostEqual(category_stats.decayed(category.trending_score) -
+                               category_stats.decayed(before), 3, places=3)
+
+    def test_trending_score_never_overflows(self):
+        # A one-second half-life: tens of millions of half-lives since the epoch
+        with mock.patch('rango.category_stats.HALF_LIFE', 1.0):
+            category_stats.repair([self.category.id], reset_trending=True)
+            Page.objects.create(category=self.category, title='Page 10', url='http://example.com/10')
+            category = Category.objects.get(id=self.category.id)
+            self.assertAlmostEqual(category_stats.decayed(category.trending_score), 46, delta=1)
+
+    def test_stale_save_keeps_counters(self):
+        stale = Category.objects.get(id=self.category.id)
+        Page.objects.create(category=self.category, title='Page 10', url='http://example.com/10')
+        stale.save()
+        self.assertStats(11, 45)
+
+    def test_repair(self):
+        Category.objects.update(page_count=0, total_views=0)
+        category_stats.repair()
+        self.assertStats(10, 45)
+
+
+class AdminTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        admin = User.objects.create_superuser('admin', password='admin-password')
+        self.client.force_login(admin)
+        self.url = reverse('admin:rango_page_changelist')
+
+    def test_changelist_queries_do_not_grow(self):
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.url)
+        for i in range(10, 30):
+            Page.objects.create(category=self.category, title=f'Page {i}', url=f'http://example.com/{i}')
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(self.url)
+        self.assertContains(response, 'Page 29')
+        self.assertEqual(len(many), len(few))
+
+    def test_category_filter_is_bounded(self):
+        Category.objects.bulk_create(Category(name=f'Category {i}', slug=f'category-{i}') for i in range(30))
+        response = self.client.get(self.url)
+        # Only the most active categories are offered, not all 31
+        self.assertEqual(len(response.context['cl'].filter_specs[0].lookup_choices), 10)
+
+        other = Category.objects.get(name='Category 29')
+        Page.objects.create(category=other, title='Elsewhere', url='http://example.com/elsewhere')
+        response = self.client.get(self.url, {'category': other.id})
+        self.assertContains(response, 'Elsewhere')
+        self.assertNotContains(response, 'Page 9')
+
+    def test_link_status_filter(self):
+        Page.objects.filter(title='Page 1').update(link_status=404, link_checked=timezone.now())
+        Page.objects.filter(title='Page 2').update(link_status=200, link_checked=timezone.now())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'link': 'client_error'})
+        self.assertContains(response, 'Page 1')
+        self.assertNotContains(response, 'Page 2')
+        self.assertFalse([q for q in queries if 'DISTINCT' in q['sql']])
+        self.assertEqual(self.client.get(self.url, {'link': 'unchecked'}).context['cl'].result_count, 8)
+
+    def test_search(self):
+        Page.objects.create(category=Category.objects.create(name='Django'), title='Tutorial',
+                            url='http://example.com/tutorial')
+        response = self.client.get(self.url, {'q': 'djan'})
+        self.assertContains(response, 'Tutorial')
+        self.assertNotContains(response, 'Page 9')
+
+    def test_reset_views(self):
+        pages = Page.objects.filter(views__gte=5)
+        self.client.post(self.url, {'action': 'reset_views',
+                                    '_selected_action': [page.id for page in pages]})
+        self.assertEqual(Page.objects.filter(views__gt=0).count(), 4)
+        self.assertEqual(Category.objects.get(id=self.category.id).total_views, 10)
+
+    def test_move_to_category(self):
+        other = Category.objects.create(name='Django')
+        pages = list(Page.objects.values_list('id', flat=True)[:3])
+        self.client.post(self.url, {'action': 'move_to_category', 'category': other.id,
+                                    '_selected_action': pages})
+        self.assertEqual(Page.objects.filter(category=other).count(), 3)
+        self.assertEqual(Category.objects.get(id=other.id).page_count, 3)
+        self.assertEqual(Category.objects.get(id=self.category.id).page_count, 7)
+
+    def test_estimated_count(self):
+        paginator = EstimatedCountPaginator(Page.objects.order_by('id'), 5)
+        self.assertEqual(paginator.count, 10)
+        with mock.patch('rango.admin.MAX_COUNT', 4):
+            self.assertEqual(EstimatedCountPaginator(Page.objects.filter(views__gt=0).order_by('id'), 5).count, 4)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # A few canned answers for the link checker to find
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self, status, headers=()):
+        self.send_response(status)
+        for header in headers:
+            self.send_header(*header)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_HEAD(self):
+        if self.path == '/ok':
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.respond(304)
+            else:
+                self.respond(200, [('ETag', '"v1"')])
+        elif self.path == '/moved':
+            self.respond(301, [('Location', '/ok')])
+        elif self.path == '/no-head':
+            self.respond(405)
+        else:
+            self.respond(404)
+
+    def do_GET(self):
+        self.respond(200 if self.path == '/no-head' else 404)
+
+    def log_message(self, *args):
+        pass
+
+
+class CheckLinksTests(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def check_links(self):
+        call_command('check_links', '--timeout', '5', stdout=StringIO())
+        return {page.url.rsplit('/', 1)[-1]: page for page in Page.objects.exclude(link_checked=None)}
+
+    def test_check_links(self):
+        Page.objects.all().delete()
+        for path in ('ok', 'moved', 'no-head', 'missing'):
+            Page.objects.create(category=self.category, title=path, url=f'{self.base}/{path}')
+        Page.objects.create(category=self.category, title='down', url='http://127.0.0.1:1/down')
+
+        pages = self.check_links()
+        self.assertEqual({path: page.link_status for path, page in pages.items()},
+                         {'ok': 200, 'moved': 200, 'no-head': 200, 'missing': 404, 'down': None})
+        self.assertEqual(pages['ok'].link_etag, '"v1"')
+        self.assertTrue(pages['down'].link_error)
+
+        # Re-checked with If-None-Match: the 304 keeps the earlier status
+        pages = self.check_links()
+        self.assertEqual(pages['ok'].link_status, 200)
+        self.assertEqual(pages['ok'].link_etag, '"v1"')
+
+    def test_busy_host_does_not_hold_up_others(self):
+        Page.objects.all().delete()
+        for i in range(6):
+            Page.objects.create(category=self.category, title=f'busy {i}', url=f'http://busy.test/{i}')
+        Page.objects.create(category=self.category, title='quiet', url='http://quiet.test/')
+        quiet_checked = asyncio.Event()
+        in_flight = {'busy.test': 0, 'most': 0}
+
+        async def check(checker, url, etag='', last_modified=''):
+            if 'quiet' in url:
+                quiet_checked.set()
+            else:
+                in_flight['busy.test'] += 1
+                in_flight['most'] = max(in_flight['most'], in_flight['busy.test'])
+                # The busy host answers only once the quiet one has been checked
+                await asyncio.wait_for(quiet_checked.wait(), 5)
+                in_flight['busy.test'] -= 1
+            return LinkResult(200, 1.0, '', '', '')
+
+        with mock.patch.object(LinkChecker, 'check', check):
+            call_command('check_links', '--concurrency', '4', '--per-host', '2', stdout=StringIO())
+        self.assertEqual(Page.objects.filter(link_status=200).count(), 7)
+        self.assertEqual(in_flight['most'], 2)
+
+
+class SuggestTests(QueryBudgetTestCase):
+
+    def suggest(self, prefix):
+        response = self.assertWithinBudget(self.client.get(reverse('rango:suggest'), {'prefix': prefix}))
+        return [row['name'] for row in response.json()['results']]
+
+    def test_ranked_by_likes(self):
+        Category.objects.create(name='Pyramid', likes=80)
+        Category.objects.create(name='PyPy', likes=10)
+        self.assertEqual(self.suggest('py'), ['Pyramid', 'Python', 'PyPy'])
+        self.assertEqual(self.suggest('PYTH'), ['Python'])
+        self.assertEqual(self.suggest(''), [])
+
+    def test_updated_in_place(self):
+        self.suggest('py')
+        category = Category.objects.create(name='Pytest', likes=100)
+        # The saved category was patched into the index; nothing is reloaded
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('pyt')[0], 'Pytest')
+
+        category.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('pyt'), ['Python'])
+
+
+    def test_likes_counted_elsewhere(self):
+        pyramid = Category.objects.create(name='Pyramid', likes=80)
+        self.assertEqual(self.suggest('py'), ['Pyramid', 'Python'])
+
+        # Another process counts likes: it bumps the likes generation and publishes
+        # the new counts, which this process applies without touching the database
+        Category.objects.filter(id=self.category.id).update(likes=100)
+        generation = bump_generation(LIKES_GENERATION)
+        cache.set(LIKES_KEY.format(generation), [(self.category.id, 100)])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('py'), ['Python', 'Pyramid'])
+
+        # When an entry is missing it falls back to reloading every count
+        Category.objects.filter(id=pyramid.id).update(likes=120)
+        bump_generation(LIKES_GENERATION)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.suggest('py'), ['Pyramid', 'Python'])
+
+
+class ReplicaQueryCountTests(TransactionTestCase):
+    # Outside TestCase's transaction, so reads really are routed to the replica
+    databases = {'default', 'replica'}
+
+    @override_settings(RANGO_READ_REPLICAS=['replica'])
+    def test_replica_queries_count_towards_the_budget(self):
+        Category.objects.create(name='Python')
+        cache.clear()
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = self.client.get(reverse('rango:api_categories'))
+        self.assertEqual(len(replica_queries), 1)
+        self.assertEqual(response.wsgi_request.query_stats.count, 1)
+
+
+class ReadReplicaRouterTests(SimpleTestCase):
+    # No test transaction here: reads inside a transaction always stay on the primary
+
+    def setUp(self):
+        self.router = ReadReplicaRouter()
+
+    @override_settings(RANGO_READ_REPLICAS=['replica'])
+    def test_routing(self):
+        self.assertEqual(self.router.db_for_read(Page), 'replica')
+        self.assertEqual(self.router.db_for_write(Page, instance=Page()), 'default')
+        self.assertIsNone(self.router.db_for_read(User))
+        self.assertFalse(self.router.allow_migrate('replica', 'rango'))
+
+        token = routers.pin_to_primary()
+        self.assertEqual(self.router.db_for_read(Page), 'default')
+        routers.unpin(token)
+
+    @override_settings(RANGO_READ_REPLICAS=[])
+    def test_no_replicas(self):
+        self.assertEqual(self.router.db_for_read(Page), 'default')
+
+    @override_settings(RANGO_READ_REPLICAS=['replica'])
+    def test_pinned_after_write(self):
+        # (an anonymous POST is redirected to the login page without touching the database)
+        response = self.client.post(reverse('rango:like_category'), {'category_id': 1})
+        self.assertIn(ReplicaPinMiddleware.COOKIE, response.cookies)
+        self.assertNotIn(ReplicaPinMiddleware.COOKIE, self.client.get(reverse('rango:register')).cookies)
+
+
+class TemplateTimingTests(QueryBudgetTestCase):
+
+    def test_timings(self):
+        response = self.get('rango:about')
+        timings = response.wsgi_request.template_timings.as_dict()
+        self.assertEqual(timings['rango/categories.html']['renders'], 1)
+        # base.html is rendered through {% extends %}, and includes the sidebar
+        self.assertGreaterEqual(timings['rango/base.html']['ms'], timings['rango/categories.html']['ms'])
+
+    def test_precompile(self):
+        names = os.listdir(os.path.join(settings.BASE_DIR, 'templates', 'rango'))
+        self.assertEqual(templating.precompile(), len(names))
+
+
+class MetricsTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics.registry.reset()
+
+    def test_server_timing(self):
+        response = self.get('rango:about')
+        timings = dict(entry.split(';dur=') for entry in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timings), {'db', 'tpl', 'cache', 'app', 'total'})
+        # The phases exclude each other's time, so they add up to the total
+        phases = sum(float(timings[phase]) for phase in metrics.PHASES)
+        self.assertAlmostEqual(phases, float(timings['total']), delta=0.05)
+        self.assertGreater(float(timings['tpl']), 0)
+
+    def test_phases_count_their_own_time(self):
+        phases = metrics.Phases()
+        phases.start()
+        phases.start()
+        phases.stop('db', 0.25)
+        phases.stop('tpl', 1.0)
+        phases.finish(1.5)
+        self.assertEqual(phases.seconds, {'db': 0.25, 'tpl': 0.75, 'cache': 0.0, 'app': 0.5})
+
+    def test_metrics_endpoint(self):
+        self.get('rango:about')
+        self.get('rango:about')
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('rango_request_duration_seconds_count{route="rango:about"} 2', body)
+        self.assertIn('rango_request_duration_seconds_bucket{route="rango:about",le="+Inf"} 2', body)
+        self.assertIn('rango_responses_total{route="rango:about",status="2xx"} 2', body)
+        # Only loopback by default
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1').status_code, 403)
+        with override_settings(RANGO_METRICS_ALLOWED_IPS=['10.0.0.1']):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    def test_ended_threads_are_folded_in(self):
+        registry = metrics.Registry()
+        phases = dict.fromkeys(metrics.PHASES, 0.0)
+        for _ in range(20):
+            thread = threading.Thread(target=registry.observe, args=('route', 200, 0.01, phases))
+            thread.start()
+            thread.join()
+        self.assertEqual(registry.shards, 0)
+        self.assertEqual(registry.collect()['route'].count, 20)
+
+
+class ExportTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Category.objects.create(name='Empty')
+        User.objects.create_user('staff', password='tango-with-django', is_staff=True)
+
+    def test_csv(self):
+        self.assertEqual(self.client.get(reverse('rango:export_csv')).status_code, 302)
+
+        self.client.login(username='staff', password='tango-with-django')
+        response = self.get('rango:export_csv')
+        rows = list(csv.DictReader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows), 11)
+        # Categories without pages come first, with no page columns
+        self.assertEqual((rows[0]['category'], rows[0]['title']), ('Empty', ''))
+        self.assertEqual(rows[1]['category'], 'Python')
+        self.assertEqual(rows[1]['category_likes'], '64')
+
+    def test_gzipped_jsonl(self):
+        self.client.login(username='staff', password='tango-with-django')
+        response = self.client.get(reverse('rango:export_jsonl'), {'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(json.loads(lines[0]), {'category': 'Empty', 'category_views': 0, 'category_likes': 0})
+        self.assertEqual(json.loads(lines[-1])['title'], 'Page 9')
+
+    def test_streams_under_asgi(self):
+        # The ASGI handler sends an async iterator chunk by chunk instead of reading it all first
+        self.client.login(username='staff', password='tango-with-django')
+        client = AsyncClient()
+        client.cookies = self.client.cookies
+        async def read():
+            response = await client.get(reverse('rango:export_csv'))
+            self.assertTrue(response.is_async)
+            return [chunk async for chunk in response.streaming_content]
+
+        with mock.patch('rango.export.CHUNK_BYTES', 64):
+            chunks = async_to_sync(read)()
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(len(b''.join(chunks).decode().splitlines()), 12)
+
+    def test_command_round_trip(self):
+        path = os.path.join(tempfile.mkdtemp(), 'catalog.csv.gz')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        call_command('export_catalog', path, stdout=StringIO())
+
+        Category.objects.all().delete()
+        with gzip.open(path, 'rt') as f, open(path[:-3], 'w') as out:
+            out.write(f.read())
+        call_command('import_catalog', path[:-3], stdout=StringIO())
+
+        python = Category.objects.get(name='Python')
+        self.assertEqual(python.likes, 64)
+        self.assertEqual(Page.objects.filter(category=python).count(), 10)
+        self.assertTrue(Category.objects.filter(name='Empty').exists())
+
+
+class ThrottleTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        caches['throttle'].clear()
+        # Stop the clock, so no bucket refills during a test, and skip the password hashing
+        clock = mock.patch('rango.throttle.time')
+        clock.start().time.return_value = 1000.0
+        self.addCleanup(clock.stop)
+        authenticate = mock.patch('rango.views.authenticate_async', new=mock.AsyncMock(return_value=None))
+        self.authenticate = authenticate.start()
+        self.addCleanup(authenticate.stop)
+
+    def login_attempt(self, username, ip='10.0.0.1'):
+        return self.client.post(reverse('rango:login'), {'username': username, 'password': 'wrong'},
+                                REMOTE_ADDR=ip)
+
+    def test_bucket_refills(self):
+        bucket = throttle.Bucket('key', '2/m')
+        state, _ = bucket.take(None, 0)
+        state, _ = bucket.take(state, 0)
+        self.assertEqual(bucket.take(state, 0), (None, 30))
+        # Half a minute later one token is back
+        self.assertIsNotNone(bucket.take(state, 30)[0])
+
+    def test_login_throttled_before_hashing(self):
+        # The login route allows 10 attempts a minute per username
+        for i in range(10):
+            self.assertEqual(self.login_attempt('rango', ip=f'10.0.0.{i}').status_code, 200)
+        response = self.login_attempt('Rango', ip='10.0.1.1')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '6')
+        self.assertEqual(self.authenticate.call_count, 10)
+
+        # Other usernames are unaffected, and GETs are never throttled
+        self.assertEqual(self.login_attempt('tango', ip='10.0.2.1').status_code, 200)
+        self.assertEqual(self.client.get(reverse('rango:login'), REMOTE_ADDR='10.0.1.1').status_code, 200)
+
+    def test_per_ip(self):
+        for i in range(30):
+            self.login_attempt(f'user{i}')
+        self.assertEqual(self.login_attempt('someone').status_code, 429)
+        self.assertEqual(self.login_attempt('someone', ip='10.0.0.2').status_code, 200)
+        with override_settings(RANGO_THROTTLE=False):
+            self.assertEqual(self.login_attempt('someone').status_code, 200)
+
+    def test_deploy_check_wants_a_shared_cache(self):
+        self.assertEqual([e.id for e in throttle.check_shared_cache(None)], ['rango.W001'])
+        shared = dict(settings.CACHES, throttle={'BACKEND': 'django.core.cache.backends.redis.RedisCache'})
+        with override_settings(CACHES=shared):
+            self.assertEqual(throttle.check_shared_cache(None), [])
+
+
+class ConditionalPageTests(QueryBudgetTestCase):
+
+    def revalidate(self, url):
+        # The first visit starts a session, which is part of the ETag; the second is the steady state
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        return etag, response, queries
+
+    def test_index(self):
+        url = reverse('rango:index')
+        etag, response, queries = self.revalidate(url)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        # Only the visit counter's session lookup; nothing for the page itself
+        self.assertEqual([q['sql'] for q in queries if 'rango_' in q['sql']], [])
+
+        # Any change to the catalog, e.g. buffered clicks being written, changes the index
+        buffer = ClickBuffer(flush_interval=3600, flush_threshold=10 ** 6)
+        buffer.record(Page.objects.first().id)
+        buffer.flush()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_show_category(self):
+        url = reverse('rango:show_category', kwargs={'category_name_slug': self.category.slug})
+        etag, response, queries = self.revalidate(url)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 0)
+
+        # Another category's pages do not change this one (a new category does, via the sidebar)
+        other = Category.objects.create(name='Django')
+        Page.objects.create(category=other, title='Other', url='http://example.com/other')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Page.objects.create(category=self.category, title='New', url='http://example.com/new')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_seeded_from_updated_at(self):
+        url = reverse('rango:show_category', kwargs={'category_name_slug': self.category.slug})
+        etag = self.revalidate(url)[0]
+        stamp = 'rango:stamp:category:%d' % self.category.id
+
+        # A restart (or eviction) loses the stamp; it is rebuilt from the database, unchanged
+        cache.delete(stamp)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Category.objects.filter(id=self.category.id).update(updated_at=timezone.now())
+        cache.delete(stamp)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_catalog_stamps_seeded(self):
+        other = Category.objects.create(name='Django')
+        url = reverse('rango:index')
+        stamps = ['rango:stamp:catalog', 'rango:stamp:categories', 'rango:stamp:global']
+        cache.delete_many(stamps)
+        etag = self.revalidate(url)[0]
+
+        # A restart (or eviction) loses the stamps; they are rebuilt from the database, unchanged
+        cache.delete_many(stamps)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # A deletion leaves no updated_at behind, but still changes the seed
+        Category.objects.filter(id=other.id).delete()
+        cache.delete_many(stamps)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_updated_at(self):
+        page = Page.objects.get(title='Page 0')
+        before = page.updated_at
+        buffer = ClickBuffer(flush_interval=3600, flush_threshold=10 ** 6)
+        buffer.record(page.id)
+        buffer.flush()
+        page.refresh_from_db()
+        self.assertGreater(page.updated_at, before)
+        self.category.refresh_from_db()
+        self.assertGreaterEqual(self.category.updated_at, page.updated_at)
+
+
+class LikeCategoryTests(QueryBudgetTestCase):
+
+    def test_like_once_per_user(self):
+        self.login()
+        response = self.post('rango:like_category', {'category_id': self.category.id})
+        self.assertEqual(response.json(), {'liked': True, 'likes': 65})
+
+        # A second like from the same user is not counted
+        response = self.post('rango:like_category', {'category_id': self.category.id})
+        self.assertEqual(response.json(), {'liked': False, 'likes': 65})
+        self.assertEqual(CategoryLike.objects.count(), 1)
+        self.assertEqual(Category.objects.get(id=self.category.id).likes, 65)
+
+    def test_count_commits_with_the_like(self):
+        # The like's INSERT fails, so the count's UPDATE is rolled back with it
+        self.login()
+        with mock.patch('rango.likes.CategoryLike.objects.create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.client.post(reverse('rango:like_category'), {'category_id': self.category.id})
+        self.assertEqual(Category.objects.get(id=self.category.id).likes, 64)
+
+    def test_stale_save_keeps_likes(self):
+        stale = Category.objects.get(id=self.category.id)
+        self.login()
+        self.post('rango:like_category', {'category_id': self.category.id})
+        stale.views = 5
+        stale.save()
+        category = Category.objects.get(id=self.category.id)
+        self.assertEqual((category.views, category.likes), (5, 65))
+
+    def test_counters_set_by_hand_are_saved(self):
+        category = Category.objects.get(id=self.category.id)
+        category.likes = 5
+        category.save()
+        self.assertEqual(Category.objects.get(id=self.category.id).likes, 5)
+
+        # A row deleted meanwhile is inserted again, as a plain save() would
+        Category.objects.filter(id=category.id).delete()
+        category.save()
+        self.assertEqual(Category.objects.get(id=category.id).likes, 5)
+
+    def test_requires_login_and_post(self):
+        url = reverse('rango:like_category')
+        self.assertEqual(self.client.post(url, {'category_id': self.category.id}).status_code, 302)
+        self.login()
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.assertEqual(self.client.post(url, {'category_id': 'x'}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'category_id': 0}).status_code, 404)
+
+
+class ApiTests(QueryBudgetTestCase):
+
+    def test_categories(self):
+        response = self.get('rango:api_categories')
+        self.assertEqual(response.json()['results'][0]['slug'], 'python')
+
+        # Unchanged data is revalidated without touching the database
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('rango:api_categories'),
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_category_pages(self):
+        url = reverse('rango:api_category_pages', kwargs={'category_name_slug': self.category.slug})
+        response = self.assertWithinBudget(self.client.get(url, {'limit': 4}))
+        data = response.json()
+        self.assertEqual([row['title'] for row in data['results']], ['Page 9', 'Page 8', 'Page 7', 'Page 6'])
+
+        response = self.client.get(url, {'limit': 4, 'after': data['next']})
+        self.assertEqual(response.json()['results'][0]['title'], 'Page 5')
+
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # A new page changes the listing, so the old ETag no longer matches
+        Page.objects.create(category=self.category, title='Page 10', url='http://example.com/10', views=10)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_async_middleware_chain(self):
+        async def view(request):
+            return HttpResponse()
+
+        # Every rango middleware runs natively under ASGI instead of on a thread
+        for middleware in (metrics.MetricsMiddleware, QueryBudgetMiddleware, TemplateTimingMiddleware,
+                           ReplicaPinMiddleware, VisitorMiddleware):
+            self.assertTrue(iscoroutinefunction(middleware(view)), middleware.__name__)
+
+        # Queries run on the ORM's worker thread still count towards the request
+        async def get():
+            return await AsyncClient().get(reverse('rango:api_categories'))
+
+        response = async_to_sync(get)()
+        self.assertEqual(response.asgi_request.query_stats.count, 1)
+        self.assertIn('db;dur=', response['Server-Timing'])
+
+    def test_unknown_category(self):
+        url = reverse('rango:api_category_pages', kwargs={'category_name_slug': 'missing'})
+        response = self.assertWithinBudget(self.client.get(url))
+        self.assertEqual(response.status_code, 404)
+        # The validators and the view share one lookup
+        self.assertEqual(response.wsgi_request.query_stats.count, 1)
+
+    def test_renamed_category(self):
+        url = reverse('rango:api_category_pages', kwargs={'category_name_slug': 'python'})
+        self.assertEqual(self.client.get(url).status_code, 200)
+        category = Category.objects.get(id=self.category.id)
+        category.name = 'Snakes'
+        category.save()
+        # The old slug's cached id is gone with it
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+def tearDownModule():
+    clear_buffers()
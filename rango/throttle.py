@@ -0,0 +1,159 @@
+"""
+Token-bucket throttling for views that are expensive to call, such as the ones
+that hash passwords.
+
+throttle() wraps a view in rango/urls.py with per-IP and/or per-username
+buckets, e.g. throttle(views.user_login, ip='30/m', username='10/m'). A bucket
+holds up to N tokens, refills at N per period, and each POST takes one token
+from each of its buckets. When any of them is empty the request is answered
+with a 429 and a Retry-After header before the view runs, so a flood of
+login attempts never reaches the password hasher.
+
+The buckets live in their own cache, CACHES['throttle'], and a check is one
+get_many and at most one set_many whatever the traffic. That cache has to be
+shared (Redis, Memcached) for the limits to hold: with a LocMemCache each
+process has its own buckets, so N worker processes let through up to N times
+the rate, and manage.py check --deploy warns about it. Two requests checking
+the same bucket at the same instant can both take the last token, so a burst
+may let a request or two more through than the rate allows.
+"""
+import hashlib
+import time
+from asyncio import iscoroutinefunction
+from functools import wraps
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+KEY = 'rango:throttle:{}:{}:{}'
+
+CACHE_ALIAS = 'throttle'
+
+# Backends that keep the buckets per process (or not at all)
+LOCAL_BACKENDS = (LocMemCache, DummyCache)
+
+
+@checks.register(checks.Tags.security, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if not getattr(settings, 'RANGO_THROTTLE', True):
+        return []
+    backend = settings.CACHES.get(CACHE_ALIAS, {}).get('BACKEND')
+    if backend is None:
+        return [checks.Error(f"CACHES has no '{CACHE_ALIAS}' alias for the rate limits.",
+                             id='rango.E001')]
+    if issubclass(import_string(backend), LOCAL_BACKENDS):
+        return [checks.Warning(f"CACHES['{CACHE_ALIAS}'] is not shared between processes, so "
+                               f"each worker enforces the rate limits on its own.",
+                               hint='Use a shared backend such as Redis or Memcached.',
+                               id='rango.W001')]
+    return []
+
+
+def parse_rate(rate):
+    # '10/m' -> (10 tokens, refilled over 60 seconds)
+    count, _, period = rate.partition('/')
+    return int(count), PERIODS[period[:1]]
+
+
+class Bucket:
+
+    def __init__(self, key, rate):
+        self.key = key
+        self.capacity, self.period = parse_rate(rate)
+
+    def take(self, state, now):
+        """
+        Take a token from the bucket's cached state, a (tokens, time) pair or
+        None for a full bucket. Returns (new state, seconds until a token is
+        available); the new state is None when the bucket is empty.
+        """
+        tokens, then = state if state is not None else (self.capacity, now)
+        tokens = min(self.capacity, tokens + (now - then) * self.capacity / self.period)
+        if tokens < 1:
+            return None, (1 - tokens) * self.period / self.capacity
+        return (tokens - 1, now), 0
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def buckets_for(request, route, limits):
+    buckets = []
+    if limits.get('ip'):
+        buckets.append(Bucket(KEY.format(route, 'ip', client_ip(request)), limits['ip']))
+    username = request.POST.get('username', '')
+    if limits.get('username') and username:
+        # Hashed, so any username makes a valid cache key
+        digest = hashlib.sha256(username.strip().lower().encode()).hexdigest()[:32]
+        buckets.append(Bucket(KEY.format(route, 'user', digest), limits['username']))
+    return buckets
+
+
+def check(buckets, states):
+    # (states to store, or None if throttled, and the Retry-After in seconds)
+    now = time.time()
+    taken = {}
+    for bucket in buckets:
+        state, wait = bucket.take(states.get(bucket.key), now)
+        if state is None:
+            return None, wait
+        taken[bucket.key] = state
+    return taken, 0
+
+
+def timeout(buckets):
+    # An untouched bucket refills completely within its period, so it can then expire
+    return max(bucket.period for bucket in buckets)
+
+
+def throttled(wait):
+    response = HttpResponse('Too many attempts, please try again later.', status=429)
+    response['Retry-After'] = str(max(1, int(wait + 0.999)))
+    return response
+
+
+def throttle(view_func, ip=None, username=None, methods=('POST',)):
+    """
+    Throttle view_func's requests (POSTs by default) with an ip and/or username
+    rate, each given as 'N/s', 'N/m', 'N/h' or 'N/d'. Works on sync and async views.
+    """
+    limits = {'ip': ip, 'username': username}
+    route = view_func.__name__
+
+    def enabled(request):
+        return request.method in methods and getattr(settings, 'RANGO_THROTTLE', True)
+
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            if enabled(request):
+                buckets = buckets_for(request, route, limits)
+                if buckets:
+                    cache = caches[CACHE_ALIAS]
+                    taken, wait = check(buckets, await cache.aget_many([b.key for b in buckets]))
+                    if taken is None:
+                        return throttled(wait)
+                    await cache.aset_many(taken, timeout(buckets))
+            return await view_func(request, *args, **kwargs)
+    else:
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if enabled(request):
+                buckets = buckets_for(request, route, limits)
+                if buckets:
+                    cache = caches[CACHE_ALIAS]
+                    taken, wait = check(buckets, cache.get_many([b.key for b in buckets]))
+                    if taken is None:
+                        return throttled(wait)
+                    cache.set_many(taken, timeout(buckets))
+            return view_func(request, *args, **kwargs)
+
+    return wrapper
@@ -1,5 +1,6 @@
 from django.urls import path
-from rango import views
+from rango import api, views
+from rango.throttle import throttle
 
 app_name = 'rango'
 
@@ -7,10 +8,23 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('about/', views.about, name='about'),
     path('category/<slug:category_name_slug>/', views.show_category, name='show_category'),
+    path('category/<slug:category_name_slug>/pages/', views.category_pages_fragment,
+         name='category_pages'),
     path('add_category/', views.add_category, name='add_category'),
     path('category/<slug:category_name_slug>/add_page/', views.add_page, name='add_page'),
-    path('register/', views.register, name='register'),
-    path('login/', views.user_login, name='login'),
+    # Both hash a password on every POST, so attempts are rate limited per client
+    # IP and, for logins, per username (see rango/throttle.py)
+    path('register/', throttle(views.register, ip='10/h'), name='register'),
+    path('login/', throttle(views.user_login, ip='30/m', username='10/m'), name='login'),
     path('logout/', views.user_logout, name='logout'),
     path('restricted/', views.restricted, name='restricted'),
+    path('like_category/', views.like_category, name='like_category'),
+    path('suggest/', views.suggest, name='suggest'),
+    path('search/', views.search, name='search'),
+    path('goto/<int:page_id>/', views.goto_url, name='goto'),
+    path('export.csv', views.export_csv, name='export_csv'),
+    path('export.jsonl', views.export_jsonl, name='export_jsonl'),
+    path('api/categories/', api.categories, name='api_categories'),
+    path('api/categories/<slug:category_name_slug>/pages/', api.category_pages,
+         name='api_category_pages'),
 ]
\ No newline at end of file
@@ -1,5 +1,11 @@
+import logging
+
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.http import HttpResponse, Http404, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.views.decorators.http import require_POST
+from asgiref.sync import sync_to_async
 
 # Import catagory model
 from rango.models import Category
@@ -12,76 +18,149 @@ from rango.forms import UserForm, UserProfileForm
 
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import redirect
 from django.urls import reverse
-from datetime import datetime
+from django.db import transaction
+
+# Buffered click counter for Page.views
+from rango.clicks import record_click
+
+# Declared per-view query budgets, checked by rango.middleware.QueryBudgetMiddleware
+from rango.middleware import query_budget
+
+# Visit counting, done by rango.middleware.VisitorMiddleware
+from rango.middleware import track_visits
+
+# Profile picture storage and background thumbnailing
+from rango.images import store_picture, queue_thumbnails
+
+# Likes: deduplicated per user, counted through a write-coalescing buffer
+from rango.likes import like_category as record_like
+
+# Keyset pagination of a category's pages
+from rango.pagination import category_pages, acategory_pages, parse_cursor
+
+# Cached slug -> id lookups, change stamps and single-flight caching of rendered pages
+from rango.api import category_id
+from rango.caching import asingle_flight, get_stamps
+
+# Full-text search over pages and categories
+from rango.search import search as search_catalog
 
-def index(request): 
+# In-memory category name index for autocomplete
+from rango.suggest import suggest as suggest_categories
 
-    # Query the database for a list of ALL categories currently stored.
-    category_list = Category.objects.order_by('-likes')[:5]
-    pages= Page.objects.order_by('-views')[:5]
+# Precomputed top-N lists for the index page
+from rango.leaderboards import top_categories, top_pages, trending_categories
+
+# Streaming dumps of the whole catalog, in the import_catalog format
+from rango.export import CONTENT_TYPES, aiterate, export
+
+# 304s for unchanged pages, from the change stamps, before any page query runs
+from rango.caching import GLOBAL_STAMP
+from rango.conditional import conditional_page
+
+# Password hashing on a bounded thread pool, for the async login and register views
+from rango.hashing import authenticate_async, hash_password
+
+# Invalid forms and failed logins go to the log
+logger = logging.getLogger('rango.views')
+
+# render() for async views: run the template (and any queries it makes) in a thread
+arender = sync_to_async(render)
+
+@query_budget(10)
+@track_visits
+@conditional_page(lambda request: ('catalog', GLOBAL_STAMP))
+async def index(request): 
+
+    # The top five categories and pages come from the cached leaderboards,
+    # which are kept up to date as likes and views change.
+    category_list = await top_categories.atop()
+    trending_list = await trending_categories.atop()
+    pages = await top_pages.atop()
 
     context_dict = {}
     context_dict['boldmessage'] = 'Crunchy, creamy, cookie, candy, cupcake!'
     context_dict['categories'] = category_list
+    context_dict['trending'] = trending_list
     context_dict['pages'] = pages
-    
-    # Add cookie information via helper method
-    visitor_cookie_handler(request)
 
-    # create a response variable
-    response = render(request, 'rango/index.html', context=context_dict)
+    # create a response variable (templates may query the database, e.g. for
+    # request.user and the sidebar, so rendering runs in a worker thread)
+    response = await arender(request, 'rango/index.html', context=context_dict)
 
     # Return response back to user 
     return response
     
 
-def about(request):
-    # prints out whether the method is a GET or a POST
-    print(request.method)
-
-    # prints out the user name, if no one is logged in it prints `AnonymousUser`
-    print(request.user)
-
-    # Add cookie information via helper method
-    visitor_cookie_handler(request)
-
+@query_budget(5)
+@track_visits
+async def about(request):
     # Add visits to context dictionary to display to user
+    # (counted by rango.middleware.VisitorMiddleware)
     context_dict = {}
-    context_dict['visits'] = request.session['visits']
+    context_dict['visits'] = request.visits
     
     # {} since render requires a dictionary parameter, passing an empty dictionary
-    return render(request, 'rango/about.html', context_dict)
+    return await arender(request, 'rango/about.html', context_dict)
 
 # Show the category when selected 
-def show_category(request, category_name_slug):
+@query_budget(8)
+@conditional_page(lambda request, category_name_slug: category_stamps(category_name_slug))
+async def show_category(request, category_name_slug):
     
     # Create a context dictionary which we can pass
     # to the template rendering engine.
     context_dict = {}
-    try:
-        # Try to get the catagory via the slug name
-        category = Category.objects.get(slug=category_name_slug)
-
-        # Retrieve all of the associated pages.
-        pages = Page.objects.filter(category=category)
-
-        # Adds our results list to the template context under name pages.
-        context_dict['pages'] = pages
-        
-        # Add category to context dictionary
-        context_dict['category'] = category
-        
-    except Category.DoesNotExist:
 
+    # The body (category name, likes and one slice of its pages) is the same for
+    # every visitor, so it is rendered once and cached until the category or its
+    # pages change; only the links for logged in users are rendered per request.
+    # ?after=<cursor> moves on to the next slice, which is rendered every time:
+    # only the first slice is cached, or any client could fill the cache with
+    # one entry per cursor it makes up.
+    pk = await sync_to_async(category_id)(category_name_slug)
+    cached = None
+    if pk is not None:
+        after = request.GET.get('after')
+        try:
+            if parse_cursor(after):
+                cached = await render_category_body(pk, after)
+            else:
+                version = tuple(get_stamps('catalog', f'category:{pk}'))
+                cached = await asingle_flight(f'rango:category-page:{pk}', version,
+                                              lambda: render_category_body(pk, None),
+                                              timeout=CATEGORY_PAGE_TIMEOUT)
+        except Category.DoesNotExist:
+            pass
+
+    if cached is not None:
+        # Add category and its rendered body to context dictionary
+        context_dict['category'] = cached['category']
+        context_dict['body'] = cached['body']
+    else:
         # No specified catagory found.
         context_dict['category'] = None
-        context_dict['pages'] = None
     
     # Go render the response and return it to the client.
-    return render(request, 'rango/category.html', context=context_dict)
+    return await arender(request, 'rango/category.html', context=context_dict)
+
+# The next slice of a category's pages, as an HTML fragment for "load more"
+@query_budget(2)
+def category_pages_fragment(request, category_name_slug):
+    try:
+        category = Category.objects.only('id', 'slug').get(slug=category_name_slug)
+    except Category.DoesNotExist:
+        raise Http404('No such category.')
 
+    pages, next_cursor = category_pages(category, request.GET.get('after'))
+    context_dict = {'category': category, 'pages': pages, 'next_cursor': next_cursor}
+
+    return render(request, 'rango/page_list.html', context=context_dict)
+
+@query_budget(5)
 @login_required
 def add_category(request):
     
@@ -100,13 +179,14 @@ def add_category(request):
             # Redirect to index page if sucessful
             return redirect('/rango/')
         else:
-            # The supplied form contained errors -# just print them to the terminal.
-            print(form.errors)
+            # The supplied form contained errors; they are shown with the form
+            logger.debug('Invalid category form: %s', form.errors.as_json())
 
     # Will handle the bad form, new form, or no form supplied cases.
     # Render the form with error messages (if any).
     return render(request, 'rango/add_category.html', {'form': form})
 
+@query_budget(8)
 @login_required
 def add_page(request, category_name_slug):
     try:
@@ -132,7 +212,7 @@ def add_page(request, category_name_slug):
                 
                 return redirect(reverse('rango:show_category',kwargs={'category_name_slug': category_name_slug}))
         else:
-            print(form.errors)
+            logger.debug('Invalid page form: %s', form.errors.as_json())
     
     # Set context dict
     context_dict = {'form': form, 'category': category}
@@ -140,7 +220,8 @@ def add_page(request, category_name_slug):
     return render(request, 'rango/add_page.html', context=context_dict)
 
 
-def register(request):
+@query_budget(5)
+async def register(request):
 
     # Boolean variable to define if a user has been registered (switch to true when successful)
     registered = False
@@ -150,35 +231,24 @@ def register(request):
 
         # Try to get information from the form 
         user_form = UserForm(request.POST)
-        profile_form = UserProfileForm(request.POST)
-
-        # If both forms are valid
-        if user_form.is_valid() and profile_form.is_valid():
-
-            # Save the form data to the database
-            user = user_form.save()
+        profile_form = UserProfileForm(request.POST, request.FILES)
 
-            # Hash the password with the set_password method of the User model from django
-            user.set_password(user.password)
-            user.save() 
+        # If both forms are valid (validation checks the username against the database)
+        if await sync_to_async(forms_valid)(user_form, profile_form):
 
-            # Set user attributes. Delay saving the model to avoid integrity problems 
-            profile = profile_form.save(commit=False)
-            profile.user = user 
+            # Hash the password on the hashing pool, keeping the event loop free
+            password = await hash_password(user_form.cleaned_data['password'])
 
-            # If the user saved a profile picture, get it from the input form
-            if 'picture' in request.FILES:
-                profile.picture = request.FILES['picture']
-                
-            # With that dealt with, now can safe
-            profile.save()
+            # Save the user and profile to the database
+            await sync_to_async(save_registration)(request, user_form, profile_form, password)
 
             # Set registration boolean to true to indicate success
             registered = True
         else:
                 
-            # Invalid form, print problems to termminal
-            print(user_form.errors, profile_form.errors)
+            # Invalid form; the problems are shown with the form
+            logger.debug('Invalid registration: %s %s', user_form.errors.as_json(),
+                         profile_form.errors.as_json())
     else:
         # Not a HTTP POST (get instead), render our forms using ModelForm instances. 
         # Outputs blank forms for user input 
@@ -187,12 +257,13 @@ def register(request):
         profile_form = UserProfileForm()
 
     # render the template depending on the context from the control flow above
-    return render(request,'rango/register.html', context = {'user_form': user_form, 
-                                                            'profile_form': profile_form,
-                                                            'registered': registered})
+    return await arender(request,'rango/register.html', context = {'user_form': user_form, 
+                                                                   'profile_form': profile_form,
+                                                                   'registered': registered})
 
 
-def user_login(request):
+@query_budget(10)
+async def user_login(request):
     # If the request is a HTTP POST, try to pull out the relevant information.
     if request.method == 'POST':
 
@@ -200,8 +271,8 @@ def user_login(request):
         username = request.POST.get('username')
         password = request.POST.get('password')
 
-        # Django function to check if username and password is correct
-        user = authenticate(username=username, password=password)
+        # Check if username and password is correct, hashing on the bounded pool
+        user = await authenticate_async(request, username=username, password=password)
         
         # If we have a User object, the details are correct.
         if user:
@@ -210,26 +281,87 @@ def user_login(request):
             if user.is_active:
 
                 # If the account is valid and active, we can log the user in and send back to homepage
-                login(request, user)
+                await sync_to_async(login)(request, user)
                 return redirect(reverse('rango:index'))
             else:
                 # Account is innactive
                 return HttpResponse("Your Rango account is disabled.")
         else:
-            # Invalid login details, 
-            print(f"Invalid login details: {username}, {password}")
+            # Invalid login details (never log the password)
+            logger.info('Invalid login details for %r', username)
             return HttpResponse("Invalid login details supplied.")
     
     # The request is not a HTTP POST, so display the login form.
     # This scenario would most likely be a HTTP GET.
     else:
         # No context variables to pass to the template system
-        return render(request, 'rango/login.html')
+        return await arender(request, 'rango/login.html')
+
+@query_budget(1)
+def goto_url(request, page_id):
+    try:
+        # Only the url is needed to send the user on their way
+        page = Page.objects.only('url').get(id=page_id)
+    except Page.DoesNotExist:
+        return redirect(reverse('rango:index'))
+
+    # Count the click in the buffer; it is written to the database in batches
+    record_click(page.id)
+
+    return redirect(page.url)
+
+@query_budget(3)
+def search(request):
+    # The search terms come in on the query string, e.g. /rango/search/?q=django
+    query = request.GET.get('q', '').strip()
+
+    context_dict = {'query': query}
+    context_dict['results'] = search_catalog(query) if query else []
+
+    return render(request, 'rango/search.html', context=context_dict)
+
+# Autocomplete for category names: /rango/suggest/?prefix=py
+@query_budget(1)
+def suggest(request):
+    suggestions = suggest_categories(request.GET.get('prefix', ''))
+    return JsonResponse({'results': suggestions})
 
+@query_budget(8)
+@require_POST
+@login_required
+def like_category(request):
+    # AJAX: POST category_id, get back the new like count
+    try:
+        category_id = int(request.POST.get('category_id', ''))
+    except ValueError:
+        return JsonResponse({'error': 'category_id must be an integer.'}, status=400)
+
+    result = record_like(request.user, category_id)
+    if result is None:
+        raise Http404('No such category.')
+
+    liked, likes = result
+    return JsonResponse({'liked': liked, 'likes': likes})
+
+# Full catalog dumps for staff: /rango/export.csv and /rango/export.jsonl, ?gzip=1 to compress.
+# The budget covers the session and user; the rows are read as the response streams,
+# after the view (and the query budget check) has returned.
+@query_budget(2)
+@staff_member_required
+def export_csv(request):
+    return export_response(request, 'csv')
+
+@query_budget(2)
+@staff_member_required
+def export_jsonl(request):
+    return export_response(request, 'jsonl')
+
+@query_budget(4)
 @login_required
 def restricted(request):
     return render(request, 'rango/restricted.html')
 
+@query_budget(4)
 @login_required
 def user_logout(request):
     # Since we know the user is logged in, we can now just log them out.
@@ -242,32 +374,69 @@ def user_logout(request):
 """
 Helper methods
 """
-def visitor_cookie_handler(request):
-    
-    # Get the number of visits to the site. If cookie exists, cast result to int. If not, default to 1
-    visits = int(get_server_side_cookie(request, 'visits', '1'))
-    
-    last_visit_cookie = get_server_side_cookie(request, 'last_visit', str(datetime.now()))
-    last_visit_time = datetime.strptime(last_visit_cookie[:-7],'%Y-%m-%d %H:%M:%S')
-    
-    # If it's been more than a day since the last visit...
-    if (datetime.now() - last_visit_time).days > 0:
-        visits = visits + 1
-        # Update the last visit cookie now that we have updated the count
-        request.session['last_visit'] = str(datetime.now())
-    else:
-        # Set the last visit cookie
-        request.session['last_visit'] = last_visit_cookie
+# How long a rendered category body may stay cached (it is replaced on change anyway)
+CATEGORY_PAGE_TIMEOUT = 60 * 60
 
-    # Update/set the visits cookie
-    request.session['visits'] = visits
 
+def category_stamps(slug):
+    # What a category's page depends on: its own stamp, and the sidebar's categories
+    pk = category_id(slug)
+    if pk is None:
+        return None
+    return ('catalog', 'categories', f'category:{pk}')
 
-def get_server_side_cookie(request, cookie, default_val=None):
-    
-    val = request.session.get(cookie)
-    
-    if not val:
-        val = default_val
-    
-    return val
\ No newline at end of file
+
+async def render_category_body(pk, cursor):
+    category = await Category.objects.aget(id=pk)
+
+    # Retrieve one slice of the associated pages, most viewed first
+    pages, next_cursor = await acategory_pages(category, cursor)
+
+    context_dict = {'category': category, 'pages': pages, 'next_cursor': next_cursor}
+    body = await sync_to_async(render_to_string)('rango/category_body.html', context_dict)
+    return {'category': category, 'body': body}
+
+
+def export_response(request, fmt):
+    compress = request.GET.get('gzip') in ('1', 'true', 'yes')
+    filename = f'rango-catalog.{fmt}' + ('.gz' if compress else '')
+
+    chunks = export(fmt, compress)
+    if isinstance(request, ASGIRequest):
+        # An async iterator, or Django would buffer the whole export before sending it
+        chunks = aiterate(chunks)
+
+    response = StreamingHttpResponse(chunks,
+                                     content_type='application/gzip' if compress else CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def forms_valid(user_form, profile_form):
+    return user_form.is_valid() and profile_form.is_valid()
+
+
+@transaction.atomic
+def save_registration(request, user_form, profile_form, password):
+
+    # Save the user with the already hashed password in a single write
+    user = user_form.save(commit=False)
+    user.password = password
+    user.save()
+
+    # Set user attributes. Delay saving the model to avoid integrity problems 
+    profile = profile_form.save(commit=False)
+    profile.user = user 
+
+    # If the user saved a profile picture, store it under its content hash
+    # (identical uploads share one file); thumbnails are made in the background
+    if 'picture' in request.FILES:
+        profile.picture.name, profile.picture_hash = store_picture(request.FILES['picture'])
+        
+    # With that dealt with, now can safe
+    profile.save()
+
+    if profile.picture_hash:
+        queue_thumbnails(profile)
+
+    return user
@@ -0,0 +1,25 @@
+"""
+ASGI config for tango_with_django_project project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Run it with an ASGI server, e.g. ``uvicorn tango_with_django_project.asgi:application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tango_with_django_project.settings')
+# Tells the settings not to keep database connections open between requests
+os.environ['RANGO_ASGI'] = '1'
+
+application = get_asgi_application()
+
+# Compile rango's templates now, in the server process, rather than on the first
+# request for each (management commands do not pay for this)
+from rango.templating import warm_up  # noqa: E402
+
+warm_up()
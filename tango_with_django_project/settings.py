@@ -45,25 +45,35 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'rango.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'rango.middleware.QueryBudgetMiddleware',
+    'rango.middleware.TemplateTimingMiddleware',
+    'rango.middleware.ReplicaPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'rango.middleware.VisitorMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 # Setting the browser session to expire on close
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
+# Database sessions, timed as the cache phase of the request metrics
+SESSION_ENGINE = 'rango.sessions'
+
+# Where VisitorMiddleware keeps the visit count: 'session', or 'cookie' for a signed
+# cookie so anonymous visitors never cause a session read or write
+RANGO_VISITS_STORE = 'session'
 
 ROOT_URLCONF = 'tango_with_django_project.urls'
 
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [TEMPLATE_DIR, STATIC_DIR, MEDIA_DIR, ],
-        'APP_DIRS': True,
+        'DIRS': [TEMPLATE_DIR, ],
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -72,23 +82,105 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'django.template.context_processors.media',
             ],
+            # Templates are only looked for in templates/ and the installed apps, and the
+            # cached loader keeps them compiled in memory (in development Django's
+            # autoreloader empties it whenever a template file changes). rango's
+            # subclass also times each template rendered per request; use
+            # django.template.loaders.cached.Loader to turn that off
+            'loaders': [
+                ('rango.templating.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
 
+# Compile every template under templates/rango/ when the server starts (see
+# rango/templating.py)
+RANGO_PRECOMPILE_TEMPLATES = True
+
+# Rate limits on the login and register views, set per route in rango/urls.py;
+# False turns them all off (see rango/throttle.py)
+RANGO_THROTTLE = True
+
+# Per-route latency histograms with a db/tpl/cache/app breakdown, served in the
+# Prometheus text format at /metrics (see rango/metrics.py). The breakdown is also
+# sent as a Server-Timing header. Only the addresses in RANGO_METRICS_ALLOWED_IPS
+# can scrape /metrics (add the Prometheus server's); None lets anyone.
+RANGO_METRICS = True
+RANGO_SERVER_TIMING = True
+RANGO_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
 WSGI_APPLICATION = 'tango_with_django_project.wsgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
+# Keep connections open between requests under WSGI. Under ASGI (asgi.py sets
+# RANGO_ASGI) each request may run on a thread of its own, and a connection left
+# on a finished thread is never reused or closed, so close them after every request.
+CONN_MAX_AGE = 0 if os.environ.get('RANGO_ASGI') else 60
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        # Wait up to 20 seconds for a lock instead of failing with "database is locked"
+        'OPTIONS': {'timeout': 20},
+        # Checked before reuse when kept open
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # A read replica. Locally this is the same SQLite file opened through a second
+    # connection (in WAL mode readers and the writer do not block each other); in
+    # production point it at a real replica of the primary. Tests mirror 'default'.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': {'timeout': 20},
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    },
 }
 
+# Reads of rango's models go to these aliases; writes, and reads by a client that
+# wrote in the last RANGO_REPLICA_PIN_SECONDS, go to 'default' (see rango/routers.py)
+DATABASE_ROUTERS = ['rango.routers.ReadReplicaRouter']
+RANGO_READ_REPLICAS = ['replica']
+RANGO_REPLICA_PIN_SECONDS = 5
+
+# SQLite journal mode set on every new connection. WAL lets readers carry on while
+# a write is in progress; 'DELETE' is SQLite's own (rollback journal) default.
+RANGO_SQLITE_JOURNAL_MODE = 'WAL'
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# Swap for memcached/redis in production so every worker shares the same entries
+
+# rango.metrics.LocMemCache (or RedisCache) is Django's backend timed as the
+# cache phase of the request metrics
+CACHES = {
+    'default': {
+        'BACKEND': 'rango.metrics.LocMemCache',
+        'LOCATION': 'rango',
+    },
+    # The rate limit buckets (see rango/throttle.py). Must be shared by every worker
+    # in production, or each one lets through the full rate; manage.py check
+    # --deploy warns while it is a per-process LocMemCache
+    'throttle': {
+        'BACKEND': 'rango.metrics.LocMemCache',
+        'LOCATION': 'rango-throttle',
+    },
+}
+
+# Keep the integer primary keys the tables were created with
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -119,8 +211,6 @@ TIME_ZONE = 'UTC'
 
 USE_I18N = True
 
-USE_L10N = True
-
 USE_TZ = True
 
 
@@ -130,3 +220,39 @@ USE_TZ = True
 STATICFILES_DIRS = [STATIC_DIR, ]
 
 STATIC_URL = '/static/'
+
+# collectstatic target. Outside DEBUG, collected files get content-hashed names
+# (cacheable forever) and text assets get precompressed .gz/.br copies.
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+if not DEBUG:
+    STATICFILES_STORAGE = 'rango.storage.CompressedManifestStaticFilesStorage'
+
+# Serve STATIC_ROOT through rango.files when no front-end server does it
+RANGO_SERVE_STATIC = False
+
+# Hand media/static transfers to the front-end server: 'nginx' (X-Accel-Redirect),
+# 'sendfile' (X-Sendfile) or None to stream from Django. For nginx, map each
+# kind of file to an internal location aliased onto MEDIA_ROOT / STATIC_ROOT.
+RANGO_FILE_ACCEL = None
+RANGO_FILE_ACCEL_PREFIXES = {
+    'media': '/protected-media/',
+    'static': '/protected-static/',
+}
+
+# Page click tracking: buffered clicks are written to the database in one batch
+# every RANGO_CLICK_FLUSH_INTERVAL seconds or every RANGO_CLICK_FLUSH_THRESHOLD clicks
+RANGO_CLICK_FLUSH_INTERVAL = 5.0
+RANGO_CLICK_FLUSH_THRESHOLD = 500
+
+# Half-life of a page addition or click in a category's trending score
+RANGO_TRENDING_HALF_LIFE_DAYS = 7
+
+# Number of pages shown per slice of a category listing
+RANGO_CATEGORY_PAGE_SIZE = 20
+
+# Background threads making profile picture thumbnails (0 = inline, after commit)
+RANGO_IMAGE_WORKERS = 2
+
+# Threads hashing passwords for the async login and register views
+RANGO_HASH_WORKERS = 4
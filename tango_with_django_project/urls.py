@@ -14,15 +14,26 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, re_path
 from django.urls import include
 from rango import views
+from rango import files
+from rango import metrics
 from django.conf import settings
-from django.conf.urls.static import static
 
 urlpatterns = [
     path('', views.index, name= 'index'),
     path('rango/', include('rango.urls')),
     # The above maps any URLs starting with rango/ to be handled by rango.
     path('admin/', admin.site.urls),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    # Request latency metrics for Prometheus
+    path('metrics', metrics.metrics_view, name='metrics'),
+    # Media files, with ETags, byte ranges and optional X-Accel-Redirect/X-Sendfile
+    re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), files.serve_media, name='media'),
+]
+
+# Collected static files, when no front-end server is serving STATIC_ROOT itself
+if settings.RANGO_SERVE_STATIC:
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.+)$' % settings.STATIC_URL.lstrip('/'), files.serve_static, name='static'),
+    ]
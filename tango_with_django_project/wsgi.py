@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tango_with_django_project.settings')
 
 application = get_wsgi_application()
+
+# Compile rango's templates now, in the server process, rather than on the first
+# request for each (management commands do not pay for this)
+from rango.templating import warm_up  # noqa: E402
+
+warm_up()